@@ -1,44 +1,180 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import ValidationError
 from elasticsearch import AsyncElasticsearch
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from datetime import datetime, timedelta
+from typing import List
 
 from ...db.elasticsearch import get_es_client
 from ...db.mysql import get_db
 from ...services.data_service import DataService
+from ...services.ingest_service import ingest_service, IngestQueueFullError, IngestUnavailableError
+from ...services.rate_limiter import ingest_rate_limiter, RateLimitExceededError
+from ...services.ndjson_stream import iter_ndjson_lines, NdjsonStreamError, UnsupportedEncodingError
 from ...services.usage_analysis_service import UsageAnalysisService
-from ...models.data import DataReport, DataReportResponse
+from ...services.usage_aggregation import usage_aggregator
+from ...services.client_activity import client_activity_tracker
+from ...services.facet_cache import facet_cache
+from ...core.config import settings
+from ...models.data import DataReport, DataReportResponse, BatchLineResult, BatchReportResponse, ClientActivityItem
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/report", response_model=DataReportResponse)
-async def report_data(
-    report: DataReport,
-    es_client: AsyncElasticsearch = Depends(get_es_client)
-):
+@router.post("/report", response_model=DataReportResponse, status_code=202)
+async def report_data(report: DataReport, request: Request):
     """
-    接收并存储客户端数据报告
+    接收客户端数据报告，校验后放入摄取队列，由后台批量写入ES
+    
+    超过客户端限速或全局在途预算时返回429及Retry-After；响应中的 next_upload_interval
+    随服务端写入压力增大，客户端应据此调整上报间隔。
     """
     try:
-        # 创建数据服务
-        data_service = DataService(es_client)
-        
-        # 存储报告
-        report_id = await data_service.store_report(report)
-        
-        # 异步处理专门数据（可选）
-        # 这可以在后台任务中执行，不阻塞响应
-        await data_service.extract_and_store_specialized_data(report, report_id)
+        ingest_rate_limiter.acquire(report.clientId)
+        content_length = request.headers.get("content-length")
+        try:
+            report_id = await ingest_service.submit(
+                report, int(content_length) if content_length and content_length.isdigit() else None
+            )
+        except Exception:
+            # 报告未被接收，退还配额，客户端重试时不会被额外限速
+            ingest_rate_limiter.refund(report.clientId)
+            raise
         
-        # 返回成功响应
+        # 返回已接收响应
         return DataReportResponse(
-            status="success",
-            message="Data report received and processed successfully",
+            status="accepted",
+            message="Data report accepted for processing",
             received_at=datetime.utcnow() + timedelta(hours=8),
-            report_id=report_id
+            report_id=report_id,
+            next_upload_interval=ingest_rate_limiter.next_upload_interval()
         )
         
+    except RateLimitExceededError as e:
+        logger.warning(f"Data report rate limited ({e.scope}): {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except (IngestQueueFullError, IngestUnavailableError) as e:
+        logger.warning(f"Data report rejected: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Error processing data report: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing data report: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing data report: {e}")
+
+@router.post("/report/batch", response_model=BatchReportResponse, status_code=202)
+async def report_data_batch(request: Request, response: Response):
+    """
+    批量接收客户端数据报告
+    
+    请求体为NDJSON（每行一个DataReport），可使用 gzip / zstd 压缩并通过Content-Encoding声明。
+    请求体按流解析，每行独立校验并放入摄取队列，响应中返回每一行的处理结果；
+    报告ID是确定性的，客户端可以只重传未被接收的行，也可以整体重传。
+    每个报告消耗一个客户端限速配额，被限速的行标记为rejected，并通过Retry-After提示重传时间。
+    """
+    results = []
+    counts = {"accepted": 0, "invalid": 0, "rejected": 0}
+    notes = []  # 导致部分接收的原因
+    retry_after = None
+    
+    # 全局预算已满时不读取请求体
+    try:
+        ingest_rate_limiter.check_global()
+    except RateLimitExceededError as e:
+        logger.warning(f"Batch data report rate limited ({e.scope}): {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    try:
+        async for line_number, line in iter_ndjson_lines(
+            request.stream(), request.headers.get("content-encoding")
+        ):
+            if sum(counts.values()) >= settings.INGEST_BATCH_MAX_LINES:
+                notes.append(f"Batch truncated after {settings.INGEST_BATCH_MAX_LINES} reports, resend the rest")
+                break
+            
+            try:
+                report = DataReport.model_validate_json(line)
+            except ValidationError as e:
+                counts["invalid"] += 1
+                results.append(BatchLineResult(
+                    line=line_number, status="invalid",
+                    error=str(e.errors(include_url=False, include_input=False))
+                ))
+                continue
+            
+            try:
+                ingest_rate_limiter.acquire(report.clientId)
+                try:
+                    report_id = await ingest_service.submit(report, len(line))
+                except Exception:
+                    ingest_rate_limiter.refund(report.clientId)
+                    raise
+                counts["accepted"] += 1
+                results.append(BatchLineResult(line=line_number, status="accepted", report_id=report_id))
+            except RateLimitExceededError as e:
+                retry_after = max(retry_after or 0, e.retry_after)
+                counts["rejected"] += 1
+                results.append(BatchLineResult(line=line_number, status="rejected", error=str(e)))
+            except (IngestQueueFullError, IngestUnavailableError) as e:
+                counts["rejected"] += 1
+                results.append(BatchLineResult(line=line_number, status="rejected", error=str(e)))
+    except UnsupportedEncodingError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except NdjsonStreamError as e:
+        if not results:
+            raise HTTPException(status_code=400, detail=str(e))
+        # 已解析的行仍然有效，其余部分需要客户端重传
+        logger.warning(f"Batch report stream error after {len(results)} line(s): {e}")
+        notes.append(str(e))
+    except Exception as e:
+        logger.error(f"Error processing batch data report: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing batch data report: {e}")
+    
+    if counts["invalid"] or counts["rejected"]:
+        notes.insert(0, f"{counts['invalid']} invalid and {counts['rejected']} rejected report(s)")
+    
+    logger.info(
+        f"Batch report: {counts['accepted']} accepted, {counts['invalid']} invalid, {counts['rejected']} rejected"
+    )
+    if retry_after:
+        response.headers["Retry-After"] = str(retry_after)
+    return BatchReportResponse(
+        status="partial" if notes else "accepted",
+        message="; ".join(notes) or "Data reports accepted for processing",
+        received_at=datetime.utcnow() + timedelta(hours=8),
+        results=results,
+        retry_after=retry_after,
+        next_upload_interval=ingest_rate_limiter.next_upload_interval(),
+        **counts
+    )
+
+@router.get("/ingest/stats")
+async def get_ingest_stats():
+    """
+    获取摄取队列深度、写入延迟、限速、增量统计与筛选项缓存统计
+    """
+    stats = ingest_service.get_stats()
+    stats["rate_limit"] = ingest_rate_limiter.get_stats()
+    stats["usage_aggregation"] = usage_aggregator.get_stats()
+    stats["client_activity"] = client_activity_tracker.get_stats()
+    stats["facet_cache"] = facet_cache.get_stats()
+    return stats
+
+@router.get("/clients/activity", response_model=List[ClientActivityItem])
+async def get_client_activity(
+    active_within_minutes: int = Query(60, ge=1, description="返回最近多少分钟内上报过的客户端"),
+    limit: int = Query(1000, ge=1, le=10000, description="最多返回的客户端数"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    获取最近活跃的客户端
+
+    查询摄取时维护的 client_activity 表（按 last_seen 索引），按最近上报时间倒序返回，
+    不需要聚合ES。时间均为UTC。
+    """
+    try:
+        since = datetime.utcnow() - timedelta(minutes=active_within_minutes)
+        clients = await client_activity_tracker.get_active_clients(db, since, limit)
+        return [ClientActivityItem.model_validate(client, from_attributes=True) for client in clients]
+    except Exception as e:
+        logger.error(f"Error getting client activity: {e}")
+        raise HTTPException(status_code=500, detail=f"Error getting client activity: {e}")
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from elasticsearch import AsyncElasticsearch
 from datetime import datetime, timedelta
 import logging
@@ -6,10 +6,18 @@ from typing import List, Optional
 
 from ...db.elasticsearch import get_es_client
 from ...services.query_service import QueryService
+from ...services.query_builder import parse_track_total_hits
+from ...services.query_cursor import InvalidCursorError
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def _split_fields(value: Optional[str]) -> Optional[List[str]]:
+    """解析逗号分隔的字段列表"""
+    if not value:
+        return None
+    return [field.strip() for field in value.split(",") if field.strip()]
+
 @router.get("/ui-monitoring")
 async def get_ui_monitoring(
     client_id: Optional[str] = None,
@@ -20,11 +28,25 @@ async def get_ui_monitoring(
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     sort_order: str = Query("desc", regex="^(asc|desc)$"),
+    reconstruct_text: bool = False,
+    cursor: Optional[str] = None,
+    use_cursor: bool = False,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    track_total_hits: Optional[str] = Query(None, regex="^(exact|off|[1-9][0-9]*)$"),
     es_client: AsyncElasticsearch = Depends(get_es_client)
 ):
     """
     获取UI监控数据，支持按时间、应用和窗口过滤
+    
+    启用增量存储后，差异文档默认不含text_output，设置 reconstruct_text=true 时按关键帧重建完整文本。
+    设置 use_cursor=true 使用游标分页，之后用响应中的 next_cursor 作为 cursor 请求下一页，
+    每一页的代价相同且不受一万条结果的限制；传入 cursor 时忽略过滤、排序和字段参数，next_cursor 为空表示没有更多数据。
+    fields / exclude 为逗号分隔的字段列表（支持通配符），例如列表视图可只取 fields=timestamp,app,window；
+    track_total_hits 为 exact（精确统计）、off（不统计）或N（最多统计到N），默认精确统计到10000。
     """
+    if offset and (cursor or use_cursor):
+        raise HTTPException(status_code=400, detail="offset cannot be combined with cursor pagination")
     try:
         # 如果没有指定时间范围，默认查询最近24小时
         if not start_time and not end_time:
@@ -43,11 +65,19 @@ async def get_ui_monitoring(
             window=window,
             limit=limit,
             offset=offset,
-            sort_order=sort_order
+            sort_order=sort_order,
+            reconstruct_text=reconstruct_text,
+            cursor=cursor,
+            use_cursor=use_cursor,
+            fields=_split_fields(fields),
+            exclude=_split_fields(exclude),
+            track_total_hits=parse_track_total_hits(track_total_hits)
         )
         
         return result
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in UI monitoring query API: {e}")
         raise
@@ -98,6 +128,76 @@ async def get_ui_monitoring_windows(
         logger.error(f"Error in UI monitoring windows query API: {e}")
         raise
 
+@router.get("/ui-monitoring/apps/page")
+async def get_ui_monitoring_apps_page(
+    client_id: Optional[str] = None,
+    prefix: Optional[str] = None,
+    after: Optional[str] = None,
+    size: int = Query(100, ge=1, le=1000),
+    es_client: AsyncElasticsearch = Depends(get_es_client)
+):
+    """
+    分页获取UI监控的应用名称及文档数，按名称排序
+    
+    可用 prefix 按名称前缀过滤（不区分大小写），用响应中的 next_after 作为 after 请求下一页，
+    next_after 为空表示没有更多数据。
+    """
+    try:
+        # 创建查询服务
+        query_service = QueryService(es_client)
+        
+        # 执行查询
+        result = await query_service.get_ui_monitoring_apps_page(
+            client_id=client_id,
+            prefix=prefix,
+            after=after,
+            size=size
+        )
+        
+        return result
+        
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in UI monitoring apps page query API: {e}")
+        raise
+
+@router.get("/ui-monitoring/windows/page")
+async def get_ui_monitoring_windows_page(
+    client_id: Optional[str] = None,
+    app: Optional[str] = None,
+    prefix: Optional[str] = None,
+    after: Optional[str] = None,
+    size: int = Query(100, ge=1, le=1000),
+    es_client: AsyncElasticsearch = Depends(get_es_client)
+):
+    """
+    分页获取UI监控的窗口名称及文档数，按名称排序
+    
+    可用 prefix 按名称前缀过滤（不区分大小写），用响应中的 next_after 作为 after 请求下一页，
+    next_after 为空表示没有更多数据。
+    """
+    try:
+        # 创建查询服务
+        query_service = QueryService(es_client)
+        
+        # 执行查询
+        result = await query_service.get_ui_monitoring_windows_page(
+            client_id=client_id,
+            app=app,
+            prefix=prefix,
+            after=after,
+            size=size
+        )
+        
+        return result
+        
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in UI monitoring windows page query API: {e}")
+        raise
+
 @router.get("/ocr-text")
 async def get_ocr_text(
     client_id: Optional[str] = None,
@@ -109,11 +209,23 @@ async def get_ocr_text(
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     sort_order: str = Query("desc", regex="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    use_cursor: bool = False,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None,
+    track_total_hits: Optional[str] = Query(None, regex="^(exact|off|[1-9][0-9]*)$"),
     es_client: AsyncElasticsearch = Depends(get_es_client)
 ):
     """
     获取OCR文本数据，支持按时间、应用和窗口过滤
+    
+    设置 use_cursor=true 使用游标分页，之后用响应中的 next_cursor 作为 cursor 请求下一页；
+    传入 cursor 时忽略过滤、排序和字段参数，next_cursor 为空表示没有更多数据。
+    fields / exclude 为逗号分隔的字段列表（支持通配符），例如 exclude=text,text_json 可省去大文本字段；
+    track_total_hits 为 exact（精确统计）、off（不统计）或N（最多统计到N），默认精确统计到10000。
     """
+    if offset and (cursor or use_cursor):
+        raise HTTPException(status_code=400, detail="offset cannot be combined with cursor pagination")
     try:
         # 如果没有指定时间范围，默认查询最近24小时
         if not start_time and not end_time:
@@ -133,11 +245,18 @@ async def get_ocr_text(
             focused=focused,
             limit=limit,
             offset=offset,
-            sort_order=sort_order
+            sort_order=sort_order,
+            cursor=cursor,
+            use_cursor=use_cursor,
+            fields=_split_fields(fields),
+            exclude=_split_fields(exclude),
+            track_total_hits=parse_track_total_hits(track_total_hits)
         )
         
         return result
         
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in OCR text query API: {e}")
         raise
@@ -186,4 +305,74 @@ async def get_ocr_text_windows(
         
     except Exception as e:
         logger.error(f"Error in OCR text windows query API: {e}")
-        raise 
\ No newline at end of file
+        raise
+
+@router.get("/ocr-text/apps/page")
+async def get_ocr_text_apps_page(
+    client_id: Optional[str] = None,
+    prefix: Optional[str] = None,
+    after: Optional[str] = None,
+    size: int = Query(100, ge=1, le=1000),
+    es_client: AsyncElasticsearch = Depends(get_es_client)
+):
+    """
+    分页获取OCR文本的应用名称及文档数，按名称排序
+    
+    可用 prefix 按名称前缀过滤（不区分大小写），用响应中的 next_after 作为 after 请求下一页，
+    next_after 为空表示没有更多数据。
+    """
+    try:
+        # 创建查询服务
+        query_service = QueryService(es_client)
+        
+        # 执行查询
+        result = await query_service.get_ocr_text_apps_page(
+            client_id=client_id,
+            prefix=prefix,
+            after=after,
+            size=size
+        )
+        
+        return result
+        
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in OCR text apps page query API: {e}")
+        raise
+
+@router.get("/ocr-text/windows/page")
+async def get_ocr_text_windows_page(
+    client_id: Optional[str] = None,
+    app_name: Optional[str] = None,
+    prefix: Optional[str] = None,
+    after: Optional[str] = None,
+    size: int = Query(100, ge=1, le=1000),
+    es_client: AsyncElasticsearch = Depends(get_es_client)
+):
+    """
+    分页获取OCR文本的窗口名称及文档数，按名称排序
+    
+    可用 prefix 按名称前缀过滤（不区分大小写），用响应中的 next_after 作为 after 请求下一页，
+    next_after 为空表示没有更多数据。
+    """
+    try:
+        # 创建查询服务
+        query_service = QueryService(es_client)
+        
+        # 执行查询
+        result = await query_service.get_ocr_text_windows_page(
+            client_id=client_id,
+            app_name=app_name,
+            prefix=prefix,
+            after=after,
+            size=size
+        )
+        
+        return result
+        
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in OCR text windows page query API: {e}")
+        raise
@@ -21,6 +21,17 @@ class Settings(BaseSettings):
     
     # 索引配置
     ES_INDEX_PREFIX: str = "timeglass"
+    ES_INDEX_PRECREATE_INTERVAL: int = int(os.getenv("ES_INDEX_PRECREATE_INTERVAL", "3600"))  # 秒，预创建次日索引的检查间隔
+    
+    # bulk写入重试配置
+    ES_BULK_MAX_RETRIES: int = int(os.getenv("ES_BULK_MAX_RETRIES", "3"))
+    ES_BULK_RETRY_BACKOFF: float = float(os.getenv("ES_BULK_RETRY_BACKOFF", "0.5"))  # 秒，首次重试等待时间
+    ES_PIT_KEEP_ALIVE: str = os.getenv("ES_PIT_KEEP_ALIVE", "1m")  # 流式读取时point-in-time的保持时间
+    ES_CURSOR_KEEP_ALIVE: str = os.getenv("ES_CURSOR_KEEP_ALIVE", "5m")  # 查询接口游标分页时point-in-time的保持时间
+    QUERY_CURSOR_SECRET: str = os.getenv("QUERY_CURSOR_SECRET", "")  # 查询游标的HMAC签名密钥，多个worker需配置相同的值；为空时使用进程内随机密钥
+    QUERY_TIME_ROUNDING: str = os.getenv("QUERY_TIME_ROUNDING", "1m")  # 查询接口时间范围的取整粒度（如1m、5m），相同粒度内的请求可命中ES请求缓存，0表示不取整
+    ES_SEARCH_PAGE_SIZE: int = int(os.getenv("ES_SEARCH_PAGE_SIZE", "1000"))  # 流式读取的每页文档数
+    ES_COMPOSITE_PAGE_SIZE: int = int(os.getenv("ES_COMPOSITE_PAGE_SIZE", "1000"))  # composite聚合每页的桶数
     
     # MySQL数据库配置
     MYSQL_USER: str = os.getenv("MYSQL_USER", "root")
@@ -29,6 +40,77 @@ class Settings(BaseSettings):
     MYSQL_PORT: str = os.getenv("MYSQL_PORT", "3306")
     MYSQL_DATABASE: str = os.getenv("MYSQL_DATABASE", "timeglass")
     MYSQL_DATABASE_URL: str = f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}"
+    MYSQL_POOL_SIZE: int = int(os.getenv("MYSQL_POOL_SIZE", "10"))  # 连接池常驻连接数
+    MYSQL_MAX_OVERFLOW: int = int(os.getenv("MYSQL_MAX_OVERFLOW", "20"))  # 连接池可额外创建的连接数
+    
+    # 数据摄取队列配置
+    INGEST_QUEUE_MAX_SIZE: int = int(os.getenv("INGEST_QUEUE_MAX_SIZE", "10000"))  # 队列中最多积压的报告数
+    INGEST_FLUSHER_COUNT: int = int(os.getenv("INGEST_FLUSHER_COUNT", "4"))  # 并发flusher数量
+    INGEST_BATCH_MAX_REPORTS: int = int(os.getenv("INGEST_BATCH_MAX_REPORTS", "200"))  # 单批最多报告数
+    INGEST_BATCH_MAX_DOCS: int = int(os.getenv("INGEST_BATCH_MAX_DOCS", "5000"))  # 单批最多文档数
+    INGEST_FLUSH_INTERVAL: float = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))  # 秒，凑批最长等待时间
+    INGEST_SHUTDOWN_TIMEOUT: float = float(os.getenv("INGEST_SHUTDOWN_TIMEOUT", "30"))  # 秒，关闭时排空队列的超时
+    INGEST_BATCH_MAX_LINES: int = int(os.getenv("INGEST_BATCH_MAX_LINES", "5000"))  # 批量上报单次请求最多的报告行数
+    INGEST_BATCH_MAX_LINE_BYTES: int = int(os.getenv("INGEST_BATCH_MAX_LINE_BYTES", str(16 * 1024 * 1024)))  # 批量上报单行解压后的字节上限
+    INGEST_BATCH_MAX_DECOMPRESSED_BYTES: int = int(os.getenv("INGEST_BATCH_MAX_DECOMPRESSED_BYTES", str(512 * 1024 * 1024)))  # 批量上报单次请求解压后的总字节上限
+    
+    # 摄取限速配置
+    INGEST_RATE_LIMIT_ENABLED: bool = os.getenv("INGEST_RATE_LIMIT_ENABLED", "True").lower() == "true"
+    INGEST_RATE_LIMIT_PER_CLIENT: float = float(os.getenv("INGEST_RATE_LIMIT_PER_CLIENT", "1.0"))  # 每个客户端每秒补充的报告配额
+    INGEST_RATE_LIMIT_BURST: float = float(os.getenv("INGEST_RATE_LIMIT_BURST", "120"))  # 每个客户端可突发的报告数
+    INGEST_RATE_LIMIT_MAX_CLIENTS: int = int(os.getenv("INGEST_RATE_LIMIT_MAX_CLIENTS", "100000"))  # 跟踪的客户端数量上限
+    INGEST_GLOBAL_INFLIGHT_MAX: int = int(os.getenv("INGEST_GLOBAL_INFLIGHT_MAX", "8000"))  # 全局在途（已入队未写入）报告数上限
+    INGEST_RATE_LIMIT_DEFAULT_RETRY: int = int(os.getenv("INGEST_RATE_LIMIT_DEFAULT_RETRY", "5"))  # 秒，无法估算时的Retry-After
+    INGEST_UPLOAD_INTERVAL: int = int(os.getenv("INGEST_UPLOAD_INTERVAL", "60"))  # 秒，无压力时建议的上报间隔
+    INGEST_UPLOAD_INTERVAL_MAX: int = int(os.getenv("INGEST_UPLOAD_INTERVAL_MAX", "600"))  # 秒，高压力时建议的最长上报间隔
+    
+    # 摄取本地缓冲配置（ES不可用时暂存报告）
+    INGEST_SPOOL_DIR: str = os.getenv("INGEST_SPOOL_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "storage", "spool"))
+    INGEST_SPOOL_SEGMENT_BYTES: int = int(os.getenv("INGEST_SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))  # 单个分段文件大小上限
+    INGEST_SPOOL_MAX_BYTES: int = int(os.getenv("INGEST_SPOOL_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))  # 缓冲总磁盘用量上限
+    INGEST_SPOOL_FSYNC: str = os.getenv("INGEST_SPOOL_FSYNC", "interval")  # always / interval / never
+    INGEST_SPOOL_FSYNC_INTERVAL: float = float(os.getenv("INGEST_SPOOL_FSYNC_INTERVAL", "1.0"))  # 秒，interval策略下的fsync间隔
+    INGEST_SPOOL_REPLAY_INTERVAL: float = float(os.getenv("INGEST_SPOOL_REPLAY_INTERVAL", "10"))  # 秒，检查ES恢复并回放的间隔
+    
+    # OCR文本去重配置
+    OCR_DEDUP_ENABLED: bool = os.getenv("OCR_DEDUP_ENABLED", "True").lower() == "true"
+    OCR_DEDUP_CACHE_SIZE: int = int(os.getenv("OCR_DEDUP_CACHE_SIZE", "100000"))  # 缓存的 (客户端, 应用, 窗口) 数量上限
+    OCR_DEDUP_MAX_GAP_SECONDS: float = float(os.getenv("OCR_DEDUP_MAX_GAP_SECONDS", "300"))  # 相同文本的两帧间隔超过该值时不再合并
+    OCR_NEAR_DUP_ENABLED: bool = os.getenv("OCR_NEAR_DUP_ENABLED", "False").lower() == "true"  # 近似重复检测（MinHash）
+    OCR_NEAR_DUP_THRESHOLD: float = float(os.getenv("OCR_NEAR_DUP_THRESHOLD", "0.9"))  # Jaccard相似度阈值
+    OCR_NEAR_DUP_NUM_PERM: int = int(os.getenv("OCR_NEAR_DUP_NUM_PERM", "64"))  # MinHash签名长度
+    OCR_NEAR_DUP_SHINGLE_SIZE: int = int(os.getenv("OCR_NEAR_DUP_SHINGLE_SIZE", "3"))  # 每个shingle包含的词数
+    OCR_NEAR_DUP_WINDOW: int = int(os.getenv("OCR_NEAR_DUP_WINDOW", "8"))  # 每个客户端参与比较的最近文档数
+    UI_DELTA_ENABLED: bool = os.getenv("UI_DELTA_ENABLED", "False").lower() == "true"  # UI监控文本增量存储
+    UI_DELTA_KEYFRAME_INTERVAL: int = int(os.getenv("UI_DELTA_KEYFRAME_INTERVAL", "50"))  # 两个关键帧之间最多的差异文档数
+    UI_DELTA_MAX_RATIO: float = float(os.getenv("UI_DELTA_MAX_RATIO", "0.5"))  # 差异内容超过全文该比例时改写关键帧
+    UI_DELTA_CACHE_SIZE: int = int(os.getenv("UI_DELTA_CACHE_SIZE", "100000"))  # 缓存的关键帧数量上限
+    UI_DELTA_CACHE_MAX_BYTES: int = int(os.getenv("UI_DELTA_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 缓存的关键帧文本总字节数上限
+    
+    # 小时应用使用统计配置
+    USAGE_INGEST_AGGREGATION_ENABLED: bool = os.getenv("USAGE_INGEST_AGGREGATION_ENABLED", "True").lower() == "true"  # 摄取时增量统计
+    USAGE_AGGREGATION_FLUSH_INTERVAL: float = float(os.getenv("USAGE_AGGREGATION_FLUSH_INTERVAL", "30"))  # 秒，增量写入MySQL的间隔
+    USAGE_IDLE_GAP_SECONDS: float = float(os.getenv("USAGE_IDLE_GAP_SECONDS", "1800"))  # 相邻事件间隔超过该值视为离开，不计时；0表示不限制
+    USAGE_ACCUMULATOR_MAX_CLIENTS: int = int(os.getenv("USAGE_ACCUMULATOR_MAX_CLIENTS", "100000"))  # 增量统计在内存中保留未结束区间的客户端数上限
+    USAGE_REPAIR_INTERVAL: int = int(os.getenv("USAGE_REPAIR_INTERVAL", "3600"))  # 秒，从ES重算修复统计的间隔，0表示不运行
+    USAGE_REPAIR_HOURS_BACK: int = int(os.getenv("USAGE_REPAIR_HOURS_BACK", "2"))  # 修复任务重算的小时数
+    USAGE_RECALC_CONCURRENCY: int = int(os.getenv("USAGE_RECALC_CONCURRENCY", "8"))  # 重算时并发处理的客户端数，每个客户端占用一个MySQL连接
+    USAGE_RECALC_PROCESS_WORKERS: int = int(os.getenv("USAGE_RECALC_PROCESS_WORKERS", "0"))  # 重算使用时间计算的进程数，0表示在事件循环中计算
+    USAGE_RECALC_POOL_CHUNK_EVENTS: int = int(os.getenv("USAGE_RECALC_POOL_CHUNK_EVENTS", "100000"))  # 每次交给进程池计算的事件数
+    HOURLY_USAGE_UPSERT_BATCH_SIZE: int = int(os.getenv("HOURLY_USAGE_UPSERT_BATCH_SIZE", "1000"))  # 每条 INSERT ... ON DUPLICATE KEY UPDATE 的行数
+    APP_CATEGORY_MATCH_CACHE_SIZE: int = int(os.getenv("APP_CATEGORY_MATCH_CACHE_SIZE", "10000"))  # 缓存类别匹配结果的应用名称数
+    
+    # 客户端活动登记配置
+    CLIENT_ACTIVITY_ENABLED: bool = os.getenv("CLIENT_ACTIVITY_ENABLED", "True").lower() == "true"  # 摄取时登记客户端活动
+    CLIENT_ACTIVITY_FLUSH_INTERVAL: float = float(os.getenv("CLIENT_ACTIVITY_FLUSH_INTERVAL", "10"))  # 秒，活动记录写入MySQL的间隔
+    CLIENT_ACTIVITY_MAX_FILTER_IDS: int = int(os.getenv("CLIENT_ACTIVITY_MAX_FILTER_IDS", "10000"))  # 重算时按活动客户端过滤ES查询的最大客户端数
+    
+    # 筛选项缓存配置
+    FACET_CACHE_ENABLED: bool = os.getenv("FACET_CACHE_ENABLED", "True").lower() == "true"  # 缓存应用/窗口筛选项聚合结果
+    FACET_CACHE_TTL: float = float(os.getenv("FACET_CACHE_TTL", "300"))  # 秒，筛选项缓存的有效期
+    FACET_CACHE_SIZE: int = int(os.getenv("FACET_CACHE_SIZE", "10000"))  # 缓存的筛选项条目数上限
+    FACET_CACHE_SETTLE_SECONDS: float = float(os.getenv("FACET_CACHE_SETTLE_SECONDS", "30"))  # 秒，出现新组合后等待索引刷新的时间，与索引 refresh_interval 一致
+    FACET_CACHE_SEEN_PAIRS: int = int(os.getenv("FACET_CACHE_SEEN_PAIRS", "100000"))  # 记录的 (客户端, 应用, 窗口) 组合数上限
     
     # 定时任务配置
     ENABLE_SCHEDULED_TASKS: bool = os.getenv("ENABLE_SCHEDULED_TASKS", "True").lower() == "true"
@@ -0,0 +1,86 @@
+"""
+文档ID生成
+
+ID采用类ULID格式：前10位为毫秒时间戳的Crockford Base32编码（保证按时间有序），
+后16位为业务键的哈希（保证同一数据重复上报时得到相同ID）。
+"""
+import hashlib
+from datetime import datetime, timezone
+
+# Crockford Base32字母表
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_TIME_LENGTH = 10
+_HASH_LENGTH = 16
+
+
+def _to_epoch_ms(value: datetime) -> int:
+    """将datetime转换为毫秒时间戳，无时区信息的按UTC处理"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _encode(number: int, length: int) -> str:
+    """将整数编码为定长的Crockford Base32字符串"""
+    chars = []
+    for _ in range(length):
+        chars.append(_ALPHABET[number & 0x1F])
+        number >>= 5
+    return "".join(reversed(chars))
+
+
+def _make_id(timestamp: datetime, *key_parts) -> str:
+    """由时间戳前缀和业务键哈希组成ID"""
+    time_part = _encode(_to_epoch_ms(timestamp) & ((1 << 50) - 1), _TIME_LENGTH)
+    key = "\x1f".join(str(part) for part in key_parts).encode("utf-8")
+    digest = int.from_bytes(hashlib.blake2b(key, digest_size=10).digest(), "big")
+    return time_part + _encode(digest, _HASH_LENGTH)
+
+
+def make_report_id(client_id: str, period_start: datetime, period_end: datetime) -> str:
+    """
+    生成报告ID
+
+    Args:
+        client_id: 客户端ID
+        period_start: 报告周期开始时间
+        period_end: 报告周期结束时间
+
+    Returns:
+        str: 以报告周期开始时间为前缀的确定性ID
+    """
+    return _make_id(
+        period_start, client_id, _to_epoch_ms(period_start), _to_epoch_ms(period_end)
+    )
+
+
+def make_child_id(client_id: str, kind: str, source_id: int, timestamp: datetime) -> str:
+    """
+    生成专用索引文档ID（OCR帧、音频转录、UI监控）
+
+    Args:
+        client_id: 客户端ID
+        kind: 数据类型，如 "frame"、"transcription"、"ui"
+        source_id: 客户端侧的数据ID
+        timestamp: 数据时间戳
+
+    Returns:
+        str: 以数据时间戳为前缀的确定性ID
+    """
+    return _make_id(timestamp, client_id, kind, source_id)
+
+
+def decode_id_timestamp(doc_id: str) -> datetime:
+    """
+    从ID中解析出时间戳前缀
+
+    Args:
+        doc_id: 由本模块生成的ID
+
+    Returns:
+        datetime: UTC时间
+    """
+    number = 0
+    for char in doc_id[:_TIME_LENGTH].upper():
+        number = (number << 5) | _ALPHABET.index(char)
+    return datetime.fromtimestamp(number / 1000, tz=timezone.utc)
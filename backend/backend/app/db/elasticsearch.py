@@ -1,7 +1,9 @@
-from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch import AsyncElasticsearch, NotFoundError, BadRequestError
 from ..core.config import settings
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Set
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +14,9 @@ es_client = AsyncElasticsearch(
     verify_certs=False  # 生产环境应设置为True并配置适当的证书
 )
 
+# 进程内已知存在的索引，避免在写入热路径上反复发送exists请求
+_known_indices: Set[str] = set()
+
 async def get_es_client() -> AsyncElasticsearch:
     """依赖注入函数，用于获取ES客户端"""
     return es_client
@@ -23,12 +28,18 @@ async def init_es():
         info = await es_client.info()
         logger.info(f"Connected to Elasticsearch: {info['version']['number']}")
         
+        # 加载已存在的索引
+        await seed_known_indices()
+        
         # 创建索引模板
         await create_index_templates()
         
         # 创建专用索引
         await create_specialized_indices()
         
+        # 提前创建明天的数据索引
+        await precreate_daily_indices()
+        
     except Exception as e:
         logger.error(f"Failed to connect to Elasticsearch: {e}")
         raise
@@ -167,6 +178,12 @@ async def create_specialized_indices():
                 "focused": {"type": "boolean"},
                 "text_length": {"type": "integer"},
                 "extracted_at": {"type": "date"},
+                # 去重字段
+                "content_hash": {"type": "keyword"},
+                "last_seen_at": {"type": "date"},
+                "repeat_count": {"type": "integer"},
+                "ref_doc_id": {"type": "keyword"},
+                "similarity": {"type": "float"},
                 # 元数据字段
                 "app_version": {"type": "keyword"},
                 "platform": {"type": "keyword"},
@@ -221,6 +238,10 @@ async def create_specialized_indices():
                 "initial_traversal_at": {"type": "date"},
                 "text_length": {"type": "integer"},
                 "extracted_at": {"type": "date"},
+                # 增量存储字段
+                "storage_mode": {"type": "keyword"},
+                "base_doc_id": {"type": "keyword"},
+                "text_delta": {"type": "object", "enabled": False},
                 # 元数据字段
                 "app_version": {"type": "keyword"},
                 "platform": {"type": "keyword"},
@@ -234,11 +255,51 @@ async def create_specialized_indices():
     })
     
     # 创建当天的数据索引
-    today_index = f"{settings.ES_INDEX_PREFIX}-data-{datetime.utcnow().strftime('%Y.%m.%d')}"
+    today_index = get_daily_index_name(datetime.utcnow())
     await create_index_if_not_exists(today_index)
 
+def get_daily_index_name(day: datetime) -> str:
+    """获取指定日期的主数据索引名称"""
+    return f"{settings.ES_INDEX_PREFIX}-data-{day.strftime('%Y.%m.%d')}"
+
+async def seed_known_indices():
+    """从集群加载当前前缀下已存在的索引，作为已知索引集合的初始值"""
+    try:
+        result = await es_client.indices.get_alias(index=f"{settings.ES_INDEX_PREFIX}-*")
+        _known_indices.update(result.keys())
+        logger.info(f"Loaded {len(result)} existing index(es) into known index cache")
+    except NotFoundError:
+        logger.info("No existing indices found for known index cache")
+
+def forget_index(index_name: str):
+    """从已知索引集合中移除索引（例如索引被外部删除时）"""
+    _known_indices.discard(index_name)
+
+def _is_already_exists_error(error: Exception) -> bool:
+    """判断是否为索引已存在错误（并发创建时可能出现）"""
+    return isinstance(error, BadRequestError) and error.error == "resource_already_exists_exception"
+
+async def _update_mappings(index_name: str, mappings: dict):
+    """
+    将映射中新增的字段应用到已存在的索引
+
+    索引只在不存在时以完整映射创建，之后新增的字段（如去重、增量存储字段）需通过 put_mapping 补充；
+    已有字段的映射不变时 put_mapping 没有副作用。
+    """
+    try:
+        await es_client.indices.put_mapping(index=index_name, body=mappings)
+        logger.info(f"Updated mappings of existing index: {index_name}")
+    except Exception as e:
+        logger.error(f"Error updating mappings of index {index_name}: {e}")
+
 async def create_index_if_not_exists(index_name, body=None):
-    """如果索引不存在，则创建索引"""
+    """如果索引不存在，则创建索引；索引已存在且提供了映射时，补充新增的字段"""
+    mappings = (body or {}).get("mappings")
+    if index_name in _known_indices:
+        logger.info(f"Index already exists: {index_name}")
+        if mappings:
+            await _update_mappings(index_name, mappings)
+        return
     try:
         exists = await es_client.indices.exists(index=index_name)
         if not exists:
@@ -249,18 +310,48 @@ async def create_index_if_not_exists(index_name, body=None):
             logger.info(f"Created index: {index_name}")
         else:
             logger.info(f"Index already exists: {index_name}")
+            if mappings:
+                await _update_mappings(index_name, mappings)
+        _known_indices.add(index_name)
     except Exception as e:
+        if _is_already_exists_error(e):
+            _known_indices.add(index_name)
+            return
         logger.error(f"Error creating index {index_name}: {e}")
         # 在生产环境中，可能需要更好地处理这个错误
 
 async def ensure_index_exists(index_name):
     """确保索引存在，如果不存在则创建"""
+    if index_name in _known_indices:
+        return True
     try:
         exists = await es_client.indices.exists(index=index_name)
         if not exists:
             await es_client.indices.create(index=index_name)
             logger.info(f"Created index: {index_name}")
+        _known_indices.add(index_name)
         return True
     except Exception as e:
+        if _is_already_exists_error(e):
+            _known_indices.add(index_name)
+            return True
         logger.error(f"Error ensuring index {index_name} exists: {e}")
-        return False 
\ No newline at end of file
+        return False
+
+async def precreate_daily_indices(days_ahead: int = 1):
+    """提前创建今天及之后几天的主数据索引，使零点后的写入无需创建索引"""
+    today = datetime.utcnow()
+    for offset in range(days_ahead + 1):
+        await ensure_index_exists(get_daily_index_name(today + timedelta(days=offset)))
+
+async def maintain_daily_indices():
+    """定期预创建次日的主数据索引"""
+    try:
+        while True:
+            await asyncio.sleep(settings.ES_INDEX_PRECREATE_INTERVAL)
+            try:
+                await precreate_daily_indices()
+            except Exception as e:
+                logger.error(f"Error pre-creating daily indices: {e}")
+    except asyncio.CancelledError:
+        logger.info("Daily index maintenance task cancelled") 
\ No newline at end of file
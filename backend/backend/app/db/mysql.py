@@ -11,6 +11,8 @@ engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     pool_pre_ping=True,  # 每次连接前ping一下，确保连接有效
     pool_recycle=3600,   # 一小时后回收连接
+    pool_size=settings.MYSQL_POOL_SIZE,
+    max_overflow=settings.MYSQL_MAX_OVERFLOW,  # 小时统计重算按客户端并发使用独立会话
     echo=settings.DEBUG  # 调试模式下打印SQL语句
 )
 
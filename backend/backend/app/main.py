@@ -5,9 +5,13 @@ import asyncio
 
 from .api.api import api_router
 from .core.config import settings
-from .db.elasticsearch import init_es, close_es
+from .db.elasticsearch import init_es, close_es, maintain_daily_indices
 from .services.scheduled_tasks import schedule_tasks
 from .services.remote_control_service import remote_control_service
+from .services.ingest_service import ingest_service
+from .services.usage_aggregation import usage_aggregator
+from .services.client_activity import client_activity_tracker
+from .services.usage_engine import shutdown_process_pool
 
 # 配置日志
 logging.basicConfig(
@@ -44,6 +48,21 @@ async def startup_event():
     logger.info("Starting up Time Glass API")
     await init_es()
     
+    # 定期预创建次日的数据索引
+    app.state.index_maintenance_task = asyncio.create_task(maintain_daily_indices())
+    
+    # 启动摄取时的小时应用使用统计
+    await usage_aggregator.start()
+    logger.info("Usage aggregator started")
+    
+    # 启动客户端活动登记
+    await client_activity_tracker.start()
+    logger.info("Client activity tracker started")
+    
+    # 启动数据摄取服务
+    await ingest_service.start()
+    logger.info("Ingest service started")
+    
     # 启动远程控制服务
     await remote_control_service.start()
     logger.info("Remote control service started")
@@ -66,6 +85,25 @@ async def shutdown_event():
     await remote_control_service.stop()
     logger.info("Remote control service stopped")
     
+    # 排空摄取队列后再关闭ES连接
+    await ingest_service.stop()
+    logger.info("Ingest service stopped")
+    
+    # 写入剩余的小时应用使用统计增量
+    await usage_aggregator.stop()
+    logger.info("Usage aggregator stopped")
+    
+    # 写入剩余的客户端活动记录
+    await client_activity_tracker.stop()
+    logger.info("Client activity tracker stopped")
+    
+    # 关闭重算使用的计算进程池
+    shutdown_process_pool()
+    
+    index_maintenance_task = getattr(app.state, "index_maintenance_task", None)
+    if index_maintenance_task:
+        index_maintenance_task.cancel()
+    
     await close_es()
 
 @app.get("/")
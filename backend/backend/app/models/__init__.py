@@ -1,6 +1,6 @@
 """数据模型包""" 
 from .data import *
-from .app_usage import AppCategory, HourlyAppUsage, ProductivityType
+from .app_usage import AppCategory, ClientActivity, HourlyAppUsage, ProductivityType
 from .api_models import *
 from .remote_control import *
 from .plugin import Plugin, PluginVersion, PluginStatus, PluginVisibility 
\ No newline at end of file
@@ -1,6 +1,7 @@
 import enum
 
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     Date,
@@ -11,6 +12,7 @@ from sqlalchemy import (
     Integer,
     String,
     Text,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -62,6 +64,48 @@ class HourlyAppUsage(Base):
     category = relationship("AppCategory", back_populates="hourly_usages")
 
     # 唯一约束
+    __table_args__ = (
+        UniqueConstraint("user_id", "timestamp", "app_name", name="uq_hourly_usage_user_time_app"),
+        {
+            "mysql_engine": "InnoDB",
+            "mysql_charset": "utf8mb4",
+            "mysql_collate": "utf8mb4_unicode_ci",
+        },
+    )
+
+
+class UsageWatermark(Base):
+    """小时应用使用统计重算水位表，记录每个客户端已处理到的最后一个UI监控事件"""
+
+    __tablename__ = "usage_watermarks"
+
+    client_id = Column(String(50), primary_key=True)
+    last_event_ms = Column(BigInteger, nullable=False)  # 最后事件的毫秒时间戳（UTC）
+    last_monitoring_id = Column(BigInteger, nullable=False)  # 时间戳相同时区分先后
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        {
+            "mysql_engine": "InnoDB",
+            "mysql_charset": "utf8mb4",
+            "mysql_collate": "utf8mb4_unicode_ci",
+        },
+    )
+
+
+class ClientActivity(Base):
+    """客户端活动表，由摄取服务按批更新，用于按最近活跃时间查询客户端"""
+
+    __tablename__ = "client_activity"
+
+    client_id = Column(String(50), primary_key=True)
+    first_seen = Column(DateTime, nullable=False)  # 首个报告的时间（UTC）
+    last_seen = Column(DateTime, nullable=False, index=True)  # 最近报告的时间（UTC）
+    last_app = Column(String(100), nullable=True)  # 最近报告中最后一个UI监控事件的应用
+    last_report_size = Column(Integer, nullable=True)  # 最近报告的大小（字节）
+    report_count = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
     __table_args__ = (
         {
             "mysql_engine": "InnoDB",
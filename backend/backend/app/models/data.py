@@ -88,4 +88,33 @@ class DataReportResponse(BaseModel):
     status: str
     message: str
     received_at: datetime
-    report_id: Optional[str] = None 
\ No newline at end of file
+    report_id: Optional[str] = None
+    next_upload_interval: Optional[int] = None  # 建议的下次上报间隔（秒），随服务端写入压力增大
+
+# 批量上报中单行的处理结果
+class BatchLineResult(BaseModel):
+    line: int
+    status: str  # accepted / invalid / rejected
+    report_id: Optional[str] = None
+    error: Optional[str] = None
+
+# 批量上报响应模型
+class BatchReportResponse(BaseModel):
+    status: str  # accepted / partial
+    message: str
+    received_at: datetime
+    accepted: int
+    invalid: int
+    rejected: int
+    results: List[BatchLineResult]
+    retry_after: Optional[int] = None  # 存在被限速拒绝的行时，建议重传前等待的秒数
+    next_upload_interval: Optional[int] = None
+
+# 客户端活动
+class ClientActivityItem(BaseModel):
+    client_id: str
+    first_seen: datetime
+    last_seen: datetime
+    last_app: Optional[str] = None
+    last_report_size: Optional[int] = None  # 字节
+    report_count: int
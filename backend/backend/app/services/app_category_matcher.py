@@ -0,0 +1,228 @@
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..models.app_usage import AppCategory
+
+DEFAULT_CATEGORY_NAME = "未分类"
+
+
+class AhoCorasickAutomaton:
+    """
+    多模式子串匹配自动机
+
+    一次扫描文本即可找出所有出现在文本中的模式，复杂度与文本长度和命中数相关，与模式数量无关。
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态命中的模式下标中最小的一个，-1表示无命中
+        self._best: List[int] = [-1]
+
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(-1)
+                    self._goto[state][char] = next_state
+                state = next_state
+            if self._best[state] < 0:
+                self._best[state] = index
+
+        # 广度优先构建失败指针，并沿失败链合并命中结果
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail_state = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = fail_state
+                inherited = self._best[fail_state]
+                if inherited >= 0 and (self._best[next_state] < 0 or inherited < self._best[next_state]):
+                    self._best[next_state] = inherited
+
+    def first_match(self, text: str) -> int:
+        """
+        查找文本中出现的下标最小的模式
+
+        Args:
+            text: 待匹配文本
+
+        Returns:
+            int: 模式下标，没有命中时返回-1
+        """
+        best = -1
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            found = self._best[state]
+            if found >= 0 and (best < 0 or found < best):
+                best = found
+        return best
+
+
+class CompiledCategories:
+    """编译后的应用类别：精确匹配字典、子串自动机及反向包含检查用的拼接名称"""
+
+    def __init__(self, categories: Sequence[AppCategory]):
+        names = [category.name.lower() for category in categories]
+        self.ids = [category.id for category in categories]
+
+        self.exact: Dict[str, int] = {}
+        for name, category_id in zip(names, self.ids):
+            self.exact.setdefault(name, category_id)
+        self.default_id: Optional[int] = next(
+            (category.id for category in categories if category.name == DEFAULT_CATEGORY_NAME), None
+        )
+
+        self.automaton = AhoCorasickAutomaton(names)
+
+        # 应用名称包含于类别名称的反向检查：在拼接串中查找，按偏移定位类别
+        self._joined = "\x00".join(names)
+        self._offsets = []
+        offset = 0
+        for name in names:
+            self._offsets.append(offset)
+            offset += len(name) + 1
+
+    def _first_containing(self, app_name: str) -> int:
+        """查找名称包含应用名称的下标最小的类别，没有时返回-1"""
+        if "\x00" in app_name:
+            return -1
+        # 分隔符不会出现在应用名称中，命中位置必然落在某一个类别名称内
+        position = self._joined.find(app_name)
+        if position < 0:
+            return -1
+        return bisect_right(self._offsets, position) - 1
+
+    def match(self, app_name: str) -> Optional[int]:
+        """
+        匹配应用类别：先按名称精确匹配（不区分大小写），再取类别名称包含于应用名称
+        或应用名称包含于类别名称的第一个类别，都不命中时返回默认类别
+
+        Args:
+            app_name: 应用名称
+
+        Returns:
+            Optional[int]: 类别ID，默认类别不存在时返回None
+        """
+        app_name_lower = app_name.lower()
+        category_id = self.exact.get(app_name_lower)
+        if category_id is not None:
+            return category_id
+
+        candidates = [
+            index
+            for index in (self.automaton.first_match(app_name_lower), self._first_containing(app_name_lower))
+            if index >= 0
+        ]
+        if candidates:
+            return self.ids[min(candidates)]
+        return self.default_id
+
+
+class AppCategoryMatcher:
+    """
+    应用类别匹配器
+
+    首次使用时一次性加载全部应用类别并编译，之后按应用名称缓存匹配结果，统计重算期间不再查询类别表。
+    类别发生增删改时由 AppUsageService 调用 invalidate() 重新加载。
+    """
+
+    def __init__(self, cache_size: Optional[int] = None):
+        self.cache_size = cache_size or settings.APP_CATEGORY_MATCH_CACHE_SIZE
+        self._compiled: Optional[CompiledCategories] = None
+        self._memo: "OrderedDict[str, int]" = OrderedDict()
+        self._generation = 0
+        self._load_lock = asyncio.Lock()
+
+        # 统计信息
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """类别变更后丢弃编译结果和缓存"""
+        self._generation += 1
+        self._compiled = None
+        self._memo.clear()
+
+    async def _get_compiled(self, db: AsyncSession) -> CompiledCategories:
+        """获取编译后的类别，未加载时从数据库加载"""
+        compiled = self._compiled
+        if compiled is not None:
+            return compiled
+
+        async with self._load_lock:
+            if self._compiled is not None:
+                return self._compiled
+            generation = self._generation
+            result = await db.execute(select(AppCategory).order_by(AppCategory.id))
+            compiled = CompiledCategories(result.scalars().all())
+            self.loads += 1
+            # 加载期间类别发生变更时本次结果只使用一次，不缓存
+            if generation == self._generation:
+                self._compiled = compiled
+            return compiled
+
+    async def match(self, db: AsyncSession, app_name: str) -> Optional[int]:
+        """
+        匹配应用类别
+
+        Args:
+            db: 数据库会话，仅在类别未加载时使用
+            app_name: 应用名称
+
+        Returns:
+            Optional[int]: 类别ID，没有匹配且默认类别不存在时返回None
+        """
+        category_id = self._memo.get(app_name)
+        if category_id is not None:
+            self._memo.move_to_end(app_name)
+            self.hits += 1
+            return category_id
+
+        self.misses += 1
+        generation = self._generation
+        compiled = await self._get_compiled(db)
+        category_id = compiled.match(app_name)
+        if category_id is not None and generation == self._generation:
+            self._memo[app_name] = category_id
+            if len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+        return category_id
+
+    async def default_category_id(self, db: AsyncSession) -> Optional[int]:
+        """获取默认类别ID，不存在时返回None"""
+        return (await self._get_compiled(db)).default_id
+
+    def get_stats(self):
+        """获取匹配统计信息"""
+        return {
+            "loaded": self._compiled is not None,
+            "cached_apps": len(self._memo),
+            "loads": self.loads,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 创建全局匹配器实例
+app_category_matcher = AppCategoryMatcher()
@@ -3,15 +3,21 @@ from datetime import date, datetime, timedelta, time
 from typing import Any, Dict, List, Optional, Tuple
 
 from elasticsearch import AsyncElasticsearch
-from sqlalchemy import and_, asc, desc, func, or_, select
+from sqlalchemy import and_, asc, delete, desc, func, or_, select, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from ..core.config import settings
 from ..models.app_usage import AppCategory, HourlyAppUsage, ProductivityType
+from .app_category_matcher import app_category_matcher
 
 logger = logging.getLogger(__name__)
 
+# 批量写入模式：累加到已有记录 / 覆盖已有记录
+UPSERT_ACCUMULATE = "accumulate"
+UPSERT_REPLACE = "replace"
+
 
 class AppUsageService:
     def __init__(
@@ -39,6 +45,7 @@ class AppUsageService:
         self.db.add(new_category)
         await self.db.commit()
         await self.db.refresh(new_category)
+        app_category_matcher.invalidate()
 
         return new_category
 
@@ -104,6 +111,7 @@ class AppUsageService:
 
         await self.db.commit()
         await self.db.refresh(category)
+        app_category_matcher.invalidate()
 
         return category
 
@@ -129,6 +137,7 @@ class AppUsageService:
         # 删除类别
         await self.db.delete(category)
         await self.db.commit()
+        app_category_matcher.invalidate()
 
         return True
 
@@ -168,87 +177,141 @@ class AppUsageService:
         )
 
     # 应用使用时间相关方法
-    async def record_hourly_app_usage(
-        self,
-        app_name: str,
-        category_id: int,
-        usage_date: date,
-        hour: int,
-        duration_minutes: float,
-        client_id: str = "default_user",
-    ) -> HourlyAppUsage:
-        """记录应用使用时间"""
-        # 创建时间戳
-        timestamp = datetime.combine(usage_date, time(hour=hour))
-        
-        # 计算星期几和是否是工作时间
-        day_of_week = timestamp.weekday()
-        is_working_hour = 9 <= hour < 18 and day_of_week < 5  # 工作日9点到18点
-        
-        # 转换为秒
-        total_time_seconds = duration_minutes * 60
+    @staticmethod
+    def _build_hourly_usage_rows(usage_records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        将统计记录转换为 hourly_app_usage 的行，同一自然键的记录合并
 
-        # 检查是否已存在相同记录
-        stmt = select(HourlyAppUsage).where(
-            and_(
-                HourlyAppUsage.app_name == app_name,
-                HourlyAppUsage.app_category_id == category_id,
-                HourlyAppUsage.timestamp == timestamp,
-                HourlyAppUsage.hour_of_day == hour,
-            )
-        )
-        result = await self.db.execute(stmt)
-        existing = result.scalars().first()
+        Args:
+            usage_records: 统计记录，包含 app_name、category_id、usage_date、hour、
+                duration_minutes、client_id，可选 switch_count
 
-        if existing:
-            # 更新现有记录 - 累加而非覆盖
-            existing.total_time_seconds += total_time_seconds
-            # 更新最后修改时间
-            existing.updated_at = datetime.utcnow()
-            await self.db.commit()
-            await self.db.refresh(existing)
-            return existing
-
-        # 创建新记录
-        new_usage = HourlyAppUsage(
-            user_id=client_id,
-            app_name=app_name,
-            app_category_id=category_id,
-            timestamp=timestamp,  # 这里的timestamp已经是北京时间，因为它是从usage_date和hour构建的
-            hour_of_day=hour,
-            day_of_week=day_of_week,
-            is_working_hour=is_working_hour,
-            total_time_seconds=total_time_seconds,
-        )
+        Returns:
+            List[Dict[str, Any]]: 列名 -> 值
+        """
+        rows: Dict[Tuple[str, datetime, str], Dict[str, Any]] = {}
+        for record in usage_records:
+            hour = record["hour"]
+            timestamp = datetime.combine(record["usage_date"], time(hour=hour))
+            key = (record["client_id"], timestamp, record["app_name"])
+            total_time_seconds = record["duration_minutes"] * 60
+            switch_count = record.get("switch_count")
+
+            row = rows.get(key)
+            if row is not None:
+                row["total_time_seconds"] += total_time_seconds
+                if switch_count is not None:
+                    row["switch_count"] = (row["switch_count"] or 0) + switch_count
+                continue
+
+            day_of_week = timestamp.weekday()
+            rows[key] = {
+                "user_id": record["client_id"],
+                "timestamp": timestamp,  # 北京时间
+                "hour_of_day": hour,
+                "day_of_week": day_of_week,
+                "is_working_hour": 9 <= hour < 18 and day_of_week < 5,  # 工作日9点到18点
+                "app_name": record["app_name"],
+                "app_category_id": record["category_id"],
+                "total_time_seconds": total_time_seconds,
+                "switch_count": switch_count,
+            }
+        return list(rows.values())
 
-        self.db.add(new_usage)
-        await self.db.commit()
-        await self.db.refresh(new_usage)
-        
-        return new_usage
+    async def _upsert_hourly_usage_rows(self, rows: List[Dict[str, Any]], mode: str):
+        """
+        以多行 INSERT ... ON DUPLICATE KEY UPDATE 写入，不提交事务
+
+        Args:
+            rows: _build_hourly_usage_rows 生成的行
+            mode: UPSERT_ACCUMULATE 累加到已有记录，UPSERT_REPLACE 覆盖已有记录
+        """
+        batch_size = settings.HOURLY_USAGE_UPSERT_BATCH_SIZE
+        for offset in range(0, len(rows), batch_size):
+            stmt = mysql_insert(HourlyAppUsage).values(rows[offset:offset + batch_size])
+            inserted = stmt.inserted
+            if mode == UPSERT_ACCUMULATE:
+                total_time_seconds = HourlyAppUsage.total_time_seconds + inserted.total_time_seconds
+                switch_count = func.coalesce(HourlyAppUsage.switch_count, 0) + func.coalesce(inserted.switch_count, 0)
+            else:
+                total_time_seconds = inserted.total_time_seconds
+                switch_count = inserted.switch_count
+            stmt = stmt.on_duplicate_key_update(
+                total_time_seconds=total_time_seconds,
+                switch_count=switch_count,
+                app_category_id=inserted.app_category_id,
+                updated_at=func.now(),
+            )
+            await self.db.execute(stmt)
 
     async def batch_record_hourly_app_usage(
         self, usage_records: List[Dict[str, Any]]
-    ) -> List[HourlyAppUsage]:
-        """批量记录应用使用时间"""
-        results = []
+    ) -> int:
+        """
+        批量记录应用使用时间，已存在的记录累加使用时间和切换次数
 
-        for record in usage_records:
-            try:
-                usage = await self.record_hourly_app_usage(
-                    app_name=record["app_name"],
-                    category_id=record["category_id"],
-                    usage_date=record["usage_date"],
-                    hour=record["hour"],
-                    duration_minutes=record["duration_minutes"],
-                    client_id=record["client_id"],
+        整批在一个事务中写入，失败时回滚并抛出异常，由调用方决定是否重试。
+
+        Args:
+            usage_records: 统计记录列表
+
+        Returns:
+            int: 写入的行数（合并同一自然键后）
+        """
+        rows = self._build_hourly_usage_rows(usage_records)
+        if not rows:
+            return 0
+
+        try:
+            await self._upsert_hourly_usage_rows(rows, UPSERT_ACCUMULATE)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return len(rows)
+
+    async def replace_hourly_app_usage(
+        self,
+        client_id: str,
+        start_time: datetime,
+        end_time: datetime,
+        usage_records: List[Dict[str, Any]],
+    ) -> int:
+        """
+        用重新计算的结果替换客户端在时间范围内的统计
+
+        在一个事务中覆盖写入新记录，并删除范围内不再出现的旧记录。
+
+        Args:
+            client_id: 客户端ID
+            start_time: 开始时间（北京时间，包含）
+            end_time: 结束时间（北京时间，包含）
+            usage_records: 该客户端在时间范围内的全部统计记录
+
+        Returns:
+            int: 写入的行数
+        """
+        rows = self._build_hourly_usage_rows(usage_records)
+        stale = delete(HourlyAppUsage).where(
+            HourlyAppUsage.user_id == client_id,
+            HourlyAppUsage.timestamp >= start_time,
+            HourlyAppUsage.timestamp <= end_time,
+        )
+        if rows:
+            stale = stale.where(
+                tuple_(HourlyAppUsage.timestamp, HourlyAppUsage.app_name).notin_(
+                    [(row["timestamp"], row["app_name"]) for row in rows]
                 )
-                results.append(usage)
-            except Exception as e:
-                # 记录错误但继续处理其他记录
-                print(f"记录应用使用时间失败: {str(e)}")
+            )
 
-        return results
+        try:
+            await self._upsert_hourly_usage_rows(rows, UPSERT_REPLACE)
+            await self.db.execute(stale)
+            await self.db.commit()
+        except Exception:
+            await self.db.rollback()
+            raise
+        return len(rows)
 
     async def get_hourly_app_usage(
         self,
@@ -0,0 +1,255 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..db.mysql import AsyncSessionLocal
+from ..models.app_usage import ClientActivity
+from ..models.data import DataReport
+
+logger = logging.getLogger(__name__)
+
+
+def _to_utc_naive(timestamp: datetime) -> datetime:
+    """转换为不带时区的UTC时间，无时区信息的按UTC处理"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+class ClientActivityTracker:
+    """
+    客户端活动登记
+
+    报告写入ES后由 DataService 调用 observe() 在内存中合并每个客户端的首次/最近上报时间、
+    最后使用的应用和最近报告大小，后台任务定期以批量 upsert 写入 client_activity 表。
+    查询最近活跃的客户端时只需按 last_seen 索引查询MySQL，无需聚合ES。
+
+    登记只覆盖本进程启动之后写入的报告（启用前、停用期间或上次进程未写入的记录可能缺失），
+    covers() 用于判断登记是否完整覆盖了某个时间窗口。
+    """
+
+    def __init__(self):
+        # 客户端ID -> [first_seen, last_seen, last_app, last_report_size, report_count]
+        self._pending: Dict[str, list] = {}
+        # 正在写入MySQL的记录，提交成功之前仍对查询可见
+        self._flushing: Dict[str, list] = {}
+        # 开始登记的时间（UTC），未启动时为None
+        self.enabled_since: Optional[datetime] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+        # 统计信息
+        self.reports_observed = 0
+        self.rows_written = 0
+        self.flush_failures = 0
+
+    async def start(self):
+        """启动定期写入任务"""
+        if settings.CLIENT_ACTIVITY_ENABLED:
+            self.enabled_since = _to_utc_naive(datetime.now(timezone.utc))
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("ClientActivityTracker started")
+
+    async def stop(self):
+        """停止定期写入任务，并写入剩余的活动记录"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        logger.info("ClientActivityTracker stopped")
+
+    def _merge(
+        self,
+        client_id: str,
+        first_seen: datetime,
+        last_seen: datetime,
+        last_app: Optional[str],
+        last_report_size: Optional[int],
+        report_count: int,
+    ):
+        """合并一条活动记录到待写入的记录中"""
+        entry = self._pending.get(client_id)
+        if entry is None:
+            self._pending[client_id] = [first_seen, last_seen, last_app, last_report_size, report_count]
+            return
+
+        entry[0] = min(entry[0], first_seen)
+        if last_seen >= entry[1]:
+            entry[1] = last_seen
+            if last_app is not None:
+                entry[2] = last_app
+            if last_report_size is not None:
+                entry[3] = last_report_size
+        entry[4] += report_count
+
+    def observe(self, reports: List[DataReport], report_sizes: Optional[List[Optional[int]]] = None):
+        """
+        登记已写入ES的报告
+
+        Args:
+            reports: 数据报告列表
+            report_sizes: 与 reports 一一对应的报告大小（字节），未知时为None
+        """
+        if not settings.CLIENT_ACTIVITY_ENABLED:
+            return
+
+        for index, report in enumerate(reports):
+            seen = _to_utc_naive(report.timestamp)
+            ui_events = report.data.uiMonitoring
+            last_app = max(ui_events, key=lambda item: item.timestamp).app if ui_events else None
+            size = report_sizes[index] if report_sizes else None
+            self._merge(report.clientId, seen, seen, last_app, size, 1)
+        self.reports_observed += len(reports)
+
+    async def flush(self):
+        """将待写入的活动记录批量写入 client_activity"""
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            self._flushing = pending
+
+            rows = [
+                {
+                    "client_id": client_id,
+                    "first_seen": first_seen,
+                    "last_seen": last_seen,
+                    "last_app": last_app,
+                    "last_report_size": last_report_size,
+                    "report_count": report_count,
+                }
+                for client_id, (first_seen, last_seen, last_app, last_report_size, report_count) in pending.items()
+            ]
+
+            try:
+                async with AsyncSessionLocal() as db:
+                    batch_size = settings.HOURLY_USAGE_UPSERT_BATCH_SIZE
+                    for offset in range(0, len(rows), batch_size):
+                        await db.execute(self._build_upsert(rows[offset:offset + batch_size]))
+                    await db.commit()
+                self.rows_written += len(rows)
+            except Exception as e:
+                self.flush_failures += 1
+                for client_id, entry in pending.items():
+                    self._merge(client_id, *entry)
+                logger.error(f"Error writing client activity, will retry: {e}")
+            finally:
+                self._flushing = {}
+
+    @staticmethod
+    def _build_upsert(rows: List[dict]):
+        """
+        构建多行 INSERT ... ON DUPLICATE KEY UPDATE
+
+        MySQL按顺序执行赋值，last_app 和 last_report_size 需要在 last_seen 更新之前与旧值比较。
+        """
+        stmt = mysql_insert(ClientActivity).values(rows)
+        inserted = stmt.inserted
+        newer = inserted.last_seen >= ClientActivity.last_seen
+        return stmt.on_duplicate_key_update([
+            ("last_app", case(
+                (and_(newer, inserted.last_app.isnot(None)), inserted.last_app), else_=ClientActivity.last_app
+            )),
+            ("last_report_size", case(
+                (and_(newer, inserted.last_report_size.isnot(None)), inserted.last_report_size),
+                else_=ClientActivity.last_report_size,
+            )),
+            ("first_seen", func.least(ClientActivity.first_seen, inserted.first_seen)),
+            ("last_seen", func.greatest(ClientActivity.last_seen, inserted.last_seen)),
+            ("report_count", ClientActivity.report_count + inserted.report_count),
+        ])
+
+    async def get_active_clients(
+        self, db: AsyncSession, since: datetime, limit: int = 1000
+    ) -> List[ClientActivity]:
+        """
+        查询在指定时间之后上报过的客户端，按最近上报时间倒序
+
+        Args:
+            db: 数据库会话
+            since: 开始时间（UTC）
+            limit: 最多返回的客户端数
+
+        Returns:
+            List[ClientActivity]: 客户端活动记录
+        """
+        query = (
+            select(ClientActivity)
+            .where(ClientActivity.last_seen >= since)
+            .order_by(ClientActivity.last_seen.desc())
+            .limit(limit)
+        )
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    def covers(self, since: datetime) -> bool:
+        """
+        判断登记是否完整覆盖从指定时间开始的窗口
+
+        Args:
+            since: 开始时间（UTC）
+
+        Returns:
+            bool: 本进程在该时间之前已开始登记时返回True
+        """
+        return (
+            settings.CLIENT_ACTIVITY_ENABLED
+            and self.enabled_since is not None
+            and self.enabled_since <= _to_utc_naive(since)
+        )
+
+    async def get_active_client_ids(self, db: AsyncSession, since: datetime) -> List[str]:
+        """
+        获取在指定时间之后上报过的客户端ID，包含尚未写入MySQL和正在写入的记录
+
+        Args:
+            db: 数据库会话
+            since: 开始时间（UTC）
+
+        Returns:
+            List[str]: 客户端ID列表
+        """
+        result = await db.execute(
+            select(ClientActivity.client_id).where(ClientActivity.last_seen >= since)
+        )
+        client_ids = set(result.scalars().all())
+        for pending in (self._pending, self._flushing):
+            client_ids.update(
+                client_id for client_id, entry in list(pending.items()) if entry[1] >= since
+            )
+        return sorted(client_ids)
+
+    async def _flush_loop(self):
+        """后台任务：定期写入活动记录"""
+        try:
+            while True:
+                await asyncio.sleep(settings.CLIENT_ACTIVITY_FLUSH_INTERVAL)
+                await self.flush()
+        except asyncio.CancelledError:
+            logger.info("Client activity flush loop cancelled")
+            raise
+
+    def get_stats(self):
+        """获取活动登记统计信息"""
+        return {
+            "enabled": settings.CLIENT_ACTIVITY_ENABLED,
+            "enabled_since": self.enabled_since.isoformat() if self.enabled_since else None,
+            "pending_clients": len(self._pending),
+            "reports_observed": self.reports_observed,
+            "rows_written": self.rows_written,
+            "flush_failures": self.flush_failures,
+        }
+
+
+# 创建全局服务实例
+client_activity_tracker = ClientActivityTracker()
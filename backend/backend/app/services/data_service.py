@@ -1,21 +1,58 @@
-from datetime import datetime
-import uuid
+import asyncio
 import logging
-from elasticsearch import AsyncElasticsearch, NotFoundError
-from ..models.data import DataReport
-from ..db.elasticsearch import ensure_index_exists
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
 from ..core.config import settings
-import asyncio
+from ..core.doc_ids import make_child_id, make_report_id
+from ..db.elasticsearch import ensure_index_exists, forget_index, get_daily_index_name
+from ..models.data import DataReport
+from .client_activity import client_activity_tracker
+from .facet_cache import facet_cache
+from .ocr_dedup import ocr_dedup_cache
+from .ocr_near_dup import ocr_near_dup_detector
+from .ui_delta import STORAGE_FULL, ui_delta_encoder
 
 logger = logging.getLogger(__name__)
 
+class BulkWriteError(Exception):
+    """bulk写入在重试后仍有失败条目"""
+
 class DataService:
     def __init__(self, es_client: AsyncElasticsearch):
         self.es_client = es_client
+        self.ocr_dedup_cache = ocr_dedup_cache
+        self.ocr_near_dup_detector = ocr_near_dup_detector
+        self.ui_delta_encoder = ui_delta_encoder
+        self.client_activity = client_activity_tracker
+        self.facet_cache = facet_cache
+    
+    def _get_report_index(self, report: DataReport) -> str:
+        """获取报告所属的主数据索引名称（按日期分片）"""
+        return get_daily_index_name(report.timestamp)
+    
+    def _build_report_document(self, report: DataReport, report_id: str) -> Dict[str, Any]:
+        """将报告转换为主数据索引中的文档"""
+        report_dict = report.model_dump()
+        report_dict["received_at"] = datetime.utcnow().isoformat()
+        report_dict["report_id"] = report_id
+        return report_dict
+    
+    @staticmethod
+    def get_report_id(report: DataReport) -> str:
+        """
+        获取报告ID
+        
+        ID由客户端ID和报告周期确定，客户端超时重试时得到相同ID，重复写入不会产生新文档。
+        """
+        period = report.metadata.reportingPeriod
+        return make_report_id(report.clientId, period.start, period.end)
     
     async def store_report(self, report: DataReport) -> str:
         """
-        将数据报告存储到Elasticsearch
+        将数据报告及其专门数据以一次bulk请求存储到Elasticsearch
         
         Args:
             report: 数据报告对象
@@ -24,63 +61,269 @@ class DataService:
             str: 报告ID
         """
         try:
-            # 生成唯一ID
-            report_id = str(uuid.uuid4())
-            
-            # 准备索引名称（按日期分片）
-            index_name = f"{settings.ES_INDEX_PREFIX}-data-{report.timestamp.strftime('%Y.%m.%d')}"
+            # 生成确定性ID
+            report_id = self.get_report_id(report)
             
-            # 确保索引存在
-            index_exists = await ensure_index_exists(index_name)
-            if not index_exists:
-                logger.error(f"Failed to ensure index exists: {index_name}")
-                raise Exception(f"Failed to ensure index exists: {index_name}")
-            
-            # 转换为字典并添加接收时间和ID
-            report_dict = report.model_dump()
-            report_dict["received_at"] = datetime.utcnow().isoformat()
-            report_dict["report_id"] = report_id
-            
-            # 写入ES
-            result = await self.es_client.index(
-                index=index_name,
-                id=report_id,
-                document=report_dict
-            )
-            
-            logger.info(f"Stored report {report_id} in index {index_name}")
+            rejected = await self.store_reports([(report, report_id)])
+            if rejected:
+                raise BulkWriteError(f"Report {report_id} rejected: {rejected[0][2]}")
             
             return report_id
             
         except Exception as e:
             logger.error(f"Error storing report: {e}")
-            # 在生产环境中，可能需要将失败的数据写入错误队列或重试
             raise
     
-    async def extract_and_store_specialized_data(self, report: DataReport, report_id: str):
+    async def store_reports(self, reports: List[Tuple[DataReport, str]], report_sizes: Optional[List[Optional[int]]] = None) -> List[Tuple[DataReport, str, Any]]:
+        """
+        批量存储多个数据报告及其专门数据
+        
+        所有报告的主数据索引文档与OCR、音频、UI监控专用索引文档合并为一个bulk请求，
+        供摄取队列的flusher使用。写入成功后登记客户端活动，并按新出现的应用/窗口失效筛选项缓存；
+        有文档被ES永久拒绝（如映射冲突）的报告不登记，返回给调用方处理。
+        
+        Args:
+            reports: (报告, 报告ID) 列表
+            report_sizes: 与 reports 一一对应的报告大小（字节），可选
+            
+        Returns:
+            List[Tuple[DataReport, str, Any]]: 被拒绝的 (报告, 报告ID, 第一条错误) 列表
+        """
+        if not reports:
+            return []
+        
+        # 确保涉及的每日索引都存在（专用索引在启动时已创建）
+        index_names = {self._get_report_index(report) for report, _ in reports}
+        for index_name in index_names:
+            if not await ensure_index_exists(index_name):
+                raise Exception(f"Failed to ensure index exists: {index_name}")
+        
+        operations = []
+        owners = []  # 每个bulk条目所属报告的下标
+        for position, (report, report_id) in enumerate(reports):
+            report_operations = self.build_report_operations(report, report_id)
+            operations.extend(report_operations)
+            owners.extend([position] * (len(report_operations) // 2))
+        
+        _, rejected_items = await self.bulk_write(operations)
+        errors: Dict[int, Any] = {}
+        for item_position, error in rejected_items:
+            errors.setdefault(owners[item_position], error)
+        
+        written = [position for position in range(len(reports)) if position not in errors]
+        logger.info(f"Stored {len(written)} report(s) with {len(operations) // 2 - len(rejected_items)} document(s)")
+        if written:
+            sizes = [report_sizes[position] for position in written] if report_sizes else None
+            self.client_activity.observe([reports[position][0] for position in written], sizes)
+            self.facet_cache.observe([reports[position][0] for position in written])
+        
+        return [(*reports[position], error) for position, error in errors.items()]
+    
+    def build_report_operations(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
         """
-        提取并存储专门数据
+        构建一个报告对应的全部bulk操作
+        
+        包括每日主数据索引中的报告文档，以及OCR文本、音频转录、UI监控专用索引中的文档。
         
         Args:
             report: 数据报告对象
             report_id: 报告ID
+            
+        Returns:
+            List[Dict[str, Any]]: 交替排列的 action / source 列表，可直接作为bulk请求体
         """
-        try:
-            # 提取OCR文本
-            await self._extract_ocr_text(report, report_id)
+        # 使用create操作：重复上报的文档返回409，视为已写入
+        operations = [
+            {"create": {"_index": self._get_report_index(report), "_id": report_id}},
+            self._build_report_document(report, report_id),
+        ]
+        
+        operations.extend(self._build_ocr_operations(report, report_id))
+        
+        audio_index = f"{settings.ES_INDEX_PREFIX}-audio-transcriptions"
+        for doc in self._build_audio_docs(report, report_id):
+            doc_id = make_child_id(
+                report.clientId, "transcription", doc["transcription_id"], datetime.fromisoformat(doc["timestamp"])
+            )
+            operations.append({"create": {"_index": audio_index, "_id": doc_id}})
+            operations.append(doc)
+        
+        operations.extend(self._build_ui_monitoring_operations(report, report_id))
+        
+        return operations
+    
+    def _build_ocr_operations(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
+        """
+        构建OCR文本专用索引的bulk操作
+        
+        与同一窗口上一帧文本完全相同的帧不再写入新文档，而是合并为对上一条文档的更新，
+        延长其 last_seen_at 并累加 repeat_count。
+        启用近似重复检测时，与同一窗口近期文本高度相似的帧只保存引用（ref_doc_id）和相似度，不保存全文。
+        """
+        ocr_index = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+        operations = []
+        repeats: Dict[str, Dict[str, Any]] = {}  # 上一帧文档ID -> 重复次数与最后出现时间
+        
+        for doc in self._build_ocr_docs(report, report_id):
+            doc_id = make_child_id(
+                report.clientId, "frame", doc["frame_id"], datetime.fromisoformat(doc["timestamp"])
+            )
             
-            # 提取音频转录
-            await self._extract_audio_transcriptions(report, report_id)
+            if settings.OCR_DEDUP_ENABLED:
+                content_hash = self.ocr_dedup_cache.content_hash(doc["text"])
+                previous_id = self.ocr_dedup_cache.check(
+                    report.clientId, doc["app_name"], doc["window_name"], content_hash, doc_id,
+                    datetime.fromisoformat(doc["timestamp"]),
+                )
+                if previous_id:
+                    repeat = repeats.setdefault(previous_id, {"count": 0, "last_seen_at": doc["timestamp"]})
+                    repeat["count"] += 1
+                    repeat["last_seen_at"] = max(repeat["last_seen_at"], doc["timestamp"])
+                    continue
+                doc["content_hash"] = content_hash
             
-            # 提取UI监控数据
-            await self._extract_ui_monitoring(report, report_id)
+            if settings.OCR_NEAR_DUP_ENABLED:
+                signature = self.ocr_near_dup_detector.signature(doc["text"])
+                match = self.ocr_near_dup_detector.find(
+                    report.clientId, doc["app_name"], doc["window_name"], signature, doc_id
+                )
+                if match:
+                    doc.pop("text")
+                    doc["ref_doc_id"], doc["similarity"] = match[0], round(match[1], 4)
+                else:
+                    self.ocr_near_dup_detector.remember(
+                        report.clientId, doc["app_name"], doc["window_name"], signature, doc_id
+                    )
             
-        except Exception as e:
-            logger.error(f"Error extracting specialized data: {e}")
-            # 这里的错误不应该影响主流程，所以我们只记录错误
+            doc["last_seen_at"] = doc["timestamp"]
+            doc["repeat_count"] = 1
+            operations.append({"create": {"_index": ocr_index, "_id": doc_id}})
+            operations.append(doc)
+        
+        # 仅当新的最后出现时间更晚时才更新，客户端重试时不会重复累加
+        for previous_id, repeat in repeats.items():
+            operations.append({"update": {"_index": ocr_index, "_id": previous_id, "retry_on_conflict": 3}})
+            operations.append({
+                "script": {
+                    "source": (
+                        "if (ctx._source.last_seen_at == null || "
+                        "ctx._source.last_seen_at.compareTo(params.last_seen_at) < 0) {"
+                        " ctx._source.last_seen_at = params.last_seen_at;"
+                        " ctx._source.repeat_count = (ctx._source.repeat_count == null ? 1 : ctx._source.repeat_count) + params.count;"
+                        " } else { ctx.op = 'noop'; }"
+                    ),
+                    "params": repeat,
+                }
+            })
+        
+        return operations
+    
+    def _build_ui_monitoring_operations(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
+        """
+        构建UI监控专用索引的bulk操作
+        
+        启用增量存储时，每个 (客户端, 应用, 窗口) 的首个事件保存为关键帧，
+        之后的事件只保存相对关键帧的行级差异（text_delta）及关键帧文档ID（base_doc_id）。
+        """
+        ui_index = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+        operations = []
+        
+        for doc in self._build_ui_monitoring_docs(report, report_id):
+            doc_id = make_child_id(
+                report.clientId, "ui", doc["monitoring_id"], datetime.fromisoformat(doc["timestamp"])
+            )
+            
+            if settings.UI_DELTA_ENABLED:
+                storage_mode, delta = self.ui_delta_encoder.encode(
+                    report.clientId, doc["app"], doc["window"], doc["text_output"], doc_id
+                )
+                doc["storage_mode"] = storage_mode
+                if delta:
+                    doc.pop("text_output")
+                    doc.update(delta)
+            else:
+                doc["storage_mode"] = STORAGE_FULL
+            
+            operations.append({"create": {"_index": ui_index, "_id": doc_id}})
+            operations.append(doc)
+        
+        return operations
     
-    async def _extract_ocr_text(self, report: DataReport, report_id: str):
-        """提取OCR文本到专用索引"""
+    async def bulk_write(self, operations: List[Dict[str, Any]]) -> Tuple[int, List[Tuple[int, Any]]]:
+        """
+        执行bulk写入，逐条解析响应并仅重试失败的条目
+        
+        429及5xx错误视为可重试，按指数退避重试；409表示文档已存在（重复上报），视为成功；
+        其余错误（如映射冲突）不重试，返回给调用方处理。
+        
+        Args:
+            operations: 交替排列的 action / source 列表
+            
+        Returns:
+            Tuple[int, List[Tuple[int, Any]]]: (成功写入的条目数, 被拒绝的 (条目序号, 错误) 列表)，
+                条目序号为该 action / source 对在 operations 中的序号
+            
+        Raises:
+            BulkWriteError: 重试耗尽后仍有可重试的失败条目
+        """
+        pending = [(i // 2, (operations[i], operations[i + 1])) for i in range(0, len(operations), 2)]
+        succeeded = 0
+        rejected = []
+        attempt = 0
+        
+        while pending:
+            body = [part for _, pair in pending for part in pair]
+            result = await self.es_client.bulk(operations=body)
+            
+            if not result.get("errors"):
+                succeeded += len(pending)
+                break
+            
+            retryable = []
+            for entry, item in zip(pending, result.get("items", [])):
+                outcome = next(iter(item.values()))
+                status = outcome.get("status", 500)
+                if not outcome.get("error") or status == 409:
+                    succeeded += 1
+                elif status == 429 or status >= 500:
+                    retryable.append(entry)
+                else:
+                    if outcome["error"].get("type") == "index_not_found_exception":
+                        forget_index(outcome.get("_index"))
+                    rejected.append((entry[0], outcome["error"]))
+            
+            if not retryable:
+                break
+            
+            attempt += 1
+            if attempt > settings.ES_BULK_MAX_RETRIES:
+                raise BulkWriteError(
+                    f"{len(retryable)} bulk item(s) still failing after {settings.ES_BULK_MAX_RETRIES} retries"
+                )
+            
+            logger.warning(f"Retrying {len(retryable)} failed bulk item(s), attempt {attempt}")
+            await asyncio.sleep(settings.ES_BULK_RETRY_BACKOFF * (2 ** (attempt - 1)))
+            pending = retryable
+        
+        if rejected:
+            logger.error(f"Bulk write rejected {len(rejected)} item(s), first error: {rejected[0][1]}")
+        
+        return succeeded, rejected
+    
+    def _build_metadata_fields(self, report: DataReport) -> Dict[str, Any]:
+        """构建专用索引文档共用的元数据字段"""
+        return {
+            "app_version": report.metadata.appVersion,
+            "platform": report.metadata.platform,
+            "reporting_period_start": report.metadata.reportingPeriod.start.isoformat(),
+            "reporting_period_end": report.metadata.reportingPeriod.end.isoformat(),
+            "os": report.metadata.systemInfo.os,
+            "os_version": report.metadata.systemInfo.osVersion,
+            "hostname": report.metadata.systemInfo.hostname
+        }
+    
+    def _build_ocr_docs(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
+        """构建OCR文本专用索引的文档"""
         ocr_docs = []
         
         for frame in report.data.frames:
@@ -97,32 +340,14 @@ class DataService:
                     "text_length": frame.ocr_text.text_length if frame.ocr_text.text_length is not None else 0,
                     "extracted_at": datetime.utcnow().isoformat(),
                     # 添加元数据信息
-                    "app_version": report.metadata.appVersion,
-                    "platform": report.metadata.platform,
-                    "reporting_period_start": report.metadata.reportingPeriod.start.isoformat(),
-                    "reporting_period_end": report.metadata.reportingPeriod.end.isoformat(),
-                    "os": report.metadata.systemInfo.os,
-                    "os_version": report.metadata.systemInfo.osVersion,
-                    "hostname": report.metadata.systemInfo.hostname
+                    **self._build_metadata_fields(report)
                 }
                 ocr_docs.append(ocr_doc)
         
-        if ocr_docs:
-            # 确保索引存在
-            ocr_index = f"{settings.ES_INDEX_PREFIX}-ocr-text"
-            await ensure_index_exists(ocr_index)
-            
-            # 批量索引
-            operations = []
-            for doc in ocr_docs:
-                operations.append({"index": {"_index": ocr_index}})
-                operations.append(doc)
-            
-            await self.es_client.bulk(operations=operations)
-            logger.info(f"Extracted {len(ocr_docs)} OCR text documents")
+        return ocr_docs
     
-    async def _extract_audio_transcriptions(self, report: DataReport, report_id: str):
-        """提取音频转录到专用索引"""
+    def _build_audio_docs(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
+        """构建音频转录专用索引的文档"""
         audio_docs = []
         
         for transcription in report.data.audioTranscriptions:
@@ -140,32 +365,14 @@ class DataService:
                 "text_length": transcription.text_length if transcription.text_length is not None else 0,
                 "extracted_at": datetime.utcnow().isoformat(),
                 # 添加元数据信息
-                "app_version": report.metadata.appVersion,
-                "platform": report.metadata.platform,
-                "reporting_period_start": report.metadata.reportingPeriod.start.isoformat(),
-                "reporting_period_end": report.metadata.reportingPeriod.end.isoformat(),
-                "os": report.metadata.systemInfo.os,
-                "os_version": report.metadata.systemInfo.osVersion,
-                "hostname": report.metadata.systemInfo.hostname
+                **self._build_metadata_fields(report)
             }
             audio_docs.append(audio_doc)
         
-        if audio_docs:
-            # 确保索引存在
-            audio_index = f"{settings.ES_INDEX_PREFIX}-audio-transcriptions"
-            await ensure_index_exists(audio_index)
-            
-            # 批量索引
-            operations = []
-            for doc in audio_docs:
-                operations.append({"index": {"_index": audio_index}})
-                operations.append(doc)
-            
-            await self.es_client.bulk(operations=operations)
-            logger.info(f"Extracted {len(audio_docs)} audio transcription documents")
+        return audio_docs
     
-    async def _extract_ui_monitoring(self, report: DataReport, report_id: str):
-        """提取UI监控数据到专用索引"""
+    def _build_ui_monitoring_docs(self, report: DataReport, report_id: str) -> List[Dict[str, Any]]:
+        """构建UI监控专用索引的文档"""
         ui_docs = []
         
         for ui_item in report.data.uiMonitoring:
@@ -181,26 +388,8 @@ class DataService:
                 "text_length": ui_item.text_length if ui_item.text_length is not None else 0,
                 "extracted_at": datetime.utcnow().isoformat(),
                 # 添加元数据信息
-                "app_version": report.metadata.appVersion,
-                "platform": report.metadata.platform,
-                "reporting_period_start": report.metadata.reportingPeriod.start.isoformat(),
-                "reporting_period_end": report.metadata.reportingPeriod.end.isoformat(),
-                "os": report.metadata.systemInfo.os,
-                "os_version": report.metadata.systemInfo.osVersion,
-                "hostname": report.metadata.systemInfo.hostname
+                **self._build_metadata_fields(report)
             }
             ui_docs.append(ui_doc)
         
-        if ui_docs:
-            # 确保索引存在
-            ui_index = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
-            await ensure_index_exists(ui_index)
-            
-            # 批量索引
-            operations = []
-            for doc in ui_docs:
-                operations.append({"index": {"_index": ui_index}})
-                operations.append(doc)
-            
-            await self.es_client.bulk(operations=operations)
-            logger.info(f"Extracted {len(ui_docs)} UI monitoring documents") 
\ No newline at end of file
+        return ui_docs
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..models.data import DataReport
+
+# (索引, 字段, 客户端ID, 应用名称)
+FacetKey = Tuple[str, str, Optional[str], Optional[str]]
+
+
+class FacetCache:
+    """
+    应用/窗口筛选项缓存
+
+    缓存 get_ui_monitoring_apps 等 terms 聚合的结果，按 (索引, 字段, 客户端ID, 应用名称) 区分，
+    条目带TTL并受LRU上限约束。相同条目的并发请求共享同一次ES查询。
+
+    摄取时由 DataService 调用 observe() 记录见过的 (客户端, 应用, 窗口) 组合，只有出现新组合时
+    才失效受影响的条目。新文档在索引刷新前不可见，失效后刷新间隔内加载的结果只缓存到刷新之后。
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        settle_seconds: Optional[float] = None,
+        max_seen_pairs: Optional[int] = None,
+    ):
+        self.max_entries = max_entries or settings.FACET_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else settings.FACET_CACHE_TTL
+        self.settle_seconds = settle_seconds if settle_seconds is not None else settings.FACET_CACHE_SETTLE_SECONDS
+        self.max_seen_pairs = max_seen_pairs or settings.FACET_CACHE_SEEN_PAIRS
+
+        self._entries: "OrderedDict[FacetKey, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+        self._inflight: Dict[FacetKey, asyncio.Task] = {}
+        # 失效的条目 -> 索引刷新完成的时间，此前加载的结果可能缺少新组合
+        self._settling: Dict[FacetKey, float] = {}
+        # 见过的 (索引, 客户端, 应用, 窗口) 组合，窗口为None表示 (客户端, 应用) 组合
+        self._seen: "OrderedDict[Tuple[str, str, str, Optional[str]], None]" = OrderedDict()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    async def get(
+        self,
+        index_name: str,
+        field: str,
+        client_id: Optional[str],
+        app: Optional[str],
+        loader: Callable[[], Awaitable[List[str]]],
+    ) -> List[str]:
+        """
+        获取筛选项，未缓存或已过期时调用 loader 加载
+
+        Args:
+            index_name: 索引名称
+            field: 聚合字段
+            client_id: 客户端ID，可选
+            app: 应用名称，可选（窗口筛选项按应用过滤时使用）
+            loader: 执行ES聚合的协程函数
+
+        Returns:
+            List[str]: 筛选项列表
+        """
+        if not settings.FACET_CACHE_ENABLED:
+            return await loader()
+
+        key = (index_name, field, client_id or None, app or None)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[1])
+            del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        else:
+            self.shared += 1
+        # 单个请求被取消时不影响其他等待同一次查询的请求
+        return list(await asyncio.shield(task))
+
+    async def _load(self, key: FacetKey, loader: Callable[[], Awaitable[List[str]]]) -> Tuple[str, ...]:
+        """执行一次加载，加载期间条目未被失效时写入缓存"""
+        task = asyncio.current_task()
+        try:
+            values = tuple(await loader())
+        except BaseException:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+            raise
+
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            now = time.monotonic()
+            expires_at = now + self.ttl
+            settle_until = self._settling.get(key)
+            if settle_until is not None:
+                if settle_until > now:
+                    expires_at = min(expires_at, settle_until)
+                else:
+                    del self._settling[key]
+            self._entries[key] = (expires_at, values)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return values
+
+    def invalidate(self, key: FacetKey):
+        """失效一个条目，正在进行的加载结果不再写入缓存"""
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+        self._settling[key] = time.monotonic() + self.settle_seconds
+        self.invalidations += 1
+
+    def _remember(self, pair: Tuple[str, str, str, Optional[str]]) -> bool:
+        """记录组合，首次出现时返回True"""
+        if pair in self._seen:
+            self._seen.move_to_end(pair)
+            return False
+        self._seen[pair] = None
+        if len(self._seen) > self.max_seen_pairs:
+            self._seen.popitem(last=False)
+        return True
+
+    def _observe_pair(self, index_name: str, app_field: str, window_field: str,
+                      client_id: str, app: str, window: str):
+        """出现新的 (客户端, 应用) 或 (客户端, 应用, 窗口) 组合时失效受影响的条目"""
+        if self._remember((index_name, client_id, app, None)):
+            for cid in (client_id, None):
+                self.invalidate((index_name, app_field, cid, None))
+        if self._remember((index_name, client_id, app, window)):
+            for cid in (client_id, None):
+                for app_filter in (app, None):
+                    self.invalidate((index_name, window_field, cid, app_filter))
+
+    def observe(self, reports: List[DataReport]):
+        """
+        登记已写入ES的报告中的应用和窗口
+
+        Args:
+            reports: 数据报告列表
+        """
+        if not settings.FACET_CACHE_ENABLED:
+            return
+
+        ui_index = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+        ocr_index = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+        for report in reports:
+            client_id = report.clientId
+            for item in report.data.uiMonitoring:
+                self._observe_pair(ui_index, "app", "window", client_id, item.app, item.window)
+            for frame in report.data.frames:
+                if frame.ocr_text:
+                    self._observe_pair(
+                        ocr_index, "app_name", "window_name",
+                        client_id, frame.ocr_text.app_name, frame.ocr_text.window_name or "",
+                    )
+
+        if len(self._settling) > self.max_entries:
+            now = time.monotonic()
+            self._settling = {key: until for key, until in self._settling.items() if until > now}
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        return {
+            "enabled": settings.FACET_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "seen_pairs": len(self._seen),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "invalidations": self.invalidations,
+        }
+
+
+# 创建全局缓存实例
+facet_cache = FacetCache()
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+from ..db.elasticsearch import get_es_client
+from ..models.data import DataReport
+from .data_service import DataService
+from .ingest_spool import IngestSpool, SpoolFullError
+from .usage_aggregation import usage_aggregator
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFullError(Exception):
+    """摄取队列已满，无法接收新的报告"""
+
+
+class IngestUnavailableError(Exception):
+    """摄取服务正在关闭，不再接收新的报告"""
+
+
+class IngestItem:
+    """摄取队列中的一条待写入报告"""
+
+    __slots__ = ("report", "report_id", "size_bytes", "enqueued_at")
+
+    def __init__(self, report: DataReport, report_id: str, size_bytes: Optional[int] = None):
+        self.report = report
+        self.report_id = report_id
+        self.size_bytes = size_bytes
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def doc_count(self) -> int:
+        """该报告写入ES时产生的文档数（主文档 + 专门数据文档）"""
+        data = self.report.data
+        return 1 + len(data.frames) + len(data.audioTranscriptions) + len(data.uiMonitoring)
+
+
+class IngestService:
+    """
+    报告摄取服务：接口只负责校验和入队，后台flusher将多个报告合并为批量写入；
+    ES不可用时报告写入本地缓冲，由回放任务在ES恢复后补写
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_MAX_SIZE)
+        self.spool = IngestSpool()
+        self._flusher_tasks: List[asyncio.Task] = []
+        self._replay_task: Optional[asyncio.Task] = None
+        self._accepting = True
+        self._es_available = True  # 最近一次写入失败后置为False，直到回放任务确认ES恢复
+        self.in_flight = 0  # 已入队但尚未完成写入的报告数
+        self._throughput: Optional[float] = None  # 单个flusher的写入吞吐（报告/秒，指数滑动平均）
+
+        # 统计信息
+        self.reports_accepted = 0
+        self.reports_flushed = 0
+        self.reports_failed = 0
+        self.reports_rejected = 0  # 被ES永久拒绝、写入死信文件的报告数
+        self.reports_spooled = 0
+        self.batches_flushed = 0
+        self._flush_latencies: Deque[float] = deque(maxlen=1000)  # 最近批次的写入耗时（毫秒）
+        self._queue_waits: Deque[float] = deque(maxlen=1000)  # 最近批次中最老报告的排队时间（毫秒）
+
+    async def start(self):
+        """启动flusher任务"""
+        self._accepting = True
+        for i in range(max(1, settings.INGEST_FLUSHER_COUNT)):
+            self._flusher_tasks.append(asyncio.create_task(self._flusher(i)))
+        self._replay_task = asyncio.create_task(self._replayer())
+        logger.info(f"IngestService started with {len(self._flusher_tasks)} flusher(s)")
+
+    async def stop(self):
+        """停止接收新报告，排空队列后停止flusher任务"""
+        self._accepting = False
+
+        if self._flusher_tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=settings.INGEST_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.error(
+                    f"Timed out draining ingest queue, {self.queue.qsize()} report(s) not flushed"
+                )
+
+        tasks = self._flusher_tasks + ([self._replay_task] if self._replay_task else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._flusher_tasks = []
+        self._replay_task = None
+
+        # 未能写入的报告转存到本地缓冲，下次启动后回放
+        leftovers = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            leftovers.append(item)
+            self.queue.task_done()
+        self.in_flight = 0
+        if leftovers:
+            await self._spool(leftovers)
+        await self.spool.close()
+
+        logger.info("IngestService stopped")
+
+    async def submit(self, report: DataReport, size_bytes: Optional[int] = None) -> str:
+        """
+        将报告放入摄取队列
+
+        Args:
+            report: 已通过校验的数据报告
+            size_bytes: 报告的请求体大小（字节），用于客户端活动登记
+
+        Returns:
+            str: 报告ID
+
+        Raises:
+            IngestUnavailableError: 服务正在关闭
+            IngestQueueFullError: 队列和本地缓冲都已满
+        """
+        if not self._accepting:
+            raise IngestUnavailableError("Ingest service is shutting down")
+
+        report_id = DataService.get_report_id(report)
+        item = IngestItem(report, report_id, size_bytes)
+        try:
+            self.queue.put_nowait(item)
+            self.in_flight += 1
+        except asyncio.QueueFull:
+            # 队列积压时直接写入本地缓冲，保持接口延迟稳定
+            try:
+                await self.spool.append([(report, report_id)])
+                self.reports_spooled += 1
+            except SpoolFullError:
+                raise IngestQueueFullError(
+                    f"Ingest queue is full ({self.queue.maxsize} reports pending)"
+                )
+
+        self.reports_accepted += 1
+        return report_id
+
+    async def _collect_batch(self) -> List[IngestItem]:
+        """从队列中凑出一批报告，达到数量/文档上限或等待超时即返回"""
+        first = await self.queue.get()
+        batch = [first]
+        doc_count = first.doc_count
+        deadline = time.monotonic() + settings.INGEST_FLUSH_INTERVAL
+
+        try:
+            while (
+                len(batch) < settings.INGEST_BATCH_MAX_REPORTS
+                and doc_count < settings.INGEST_BATCH_MAX_DOCS
+            ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                doc_count += item.doc_count
+        except asyncio.CancelledError:
+            # 停止时放回已取出的报告，由 stop() 转存到本地缓冲
+            for item in batch:
+                self.queue.put_nowait(item)
+                self.queue.task_done()
+            raise
+
+        return batch
+
+    async def _flusher(self, flusher_id: int):
+        """后台flusher：循环凑批并写入ES"""
+        try:
+            while True:
+                batch = await self._collect_batch()
+                try:
+                    await self._flush(batch)
+                finally:
+                    self.in_flight -= len(batch)
+                    for _ in batch:
+                        self.queue.task_done()
+        except asyncio.CancelledError:
+            logger.info(f"Ingest flusher {flusher_id} cancelled")
+            raise
+
+    async def _store(self, reports: List[Tuple[DataReport, str]], report_sizes: Optional[List[Optional[int]]] = None) -> int:
+        """
+        将报告批量写入ES，写入成功后累加小时应用使用统计
+
+        被ES永久拒绝的报告写入死信文件，不再回放，也不计入使用统计。
+
+        Returns:
+            int: 被拒绝的报告数
+        """
+        es_client = await get_es_client()
+        data_service = DataService(es_client)
+        rejected = await data_service.store_reports(reports, report_sizes)
+        rejected_ids = {report_id for _, report_id, _ in rejected}
+        usage_aggregator.observe([report for report, report_id in reports if report_id not in rejected_ids])
+        if rejected:
+            self.reports_rejected += len(rejected)
+            await self.spool.dead_letter(rejected)
+        return len(rejected)
+
+    async def _flush(self, batch: List[IngestItem]):
+        """将一批报告写入ES，失败时转存到本地缓冲"""
+        started = time.monotonic()
+        oldest_wait = (started - min(item.enqueued_at for item in batch)) * 1000
+
+        try:
+            if not self._es_available:
+                # ES尚未恢复，直接写入本地缓冲，避免每批都等待超时
+                await self._spool(batch)
+                return
+
+            rejected = await self._store(
+                [(item.report, item.report_id) for item in batch],
+                [item.size_bytes for item in batch],
+            )
+
+            self.reports_flushed += len(batch) - rejected
+            self.batches_flushed += 1
+            throughput = len(batch) / max(time.monotonic() - started, 0.001)
+            self._throughput = throughput if self._throughput is None else 0.8 * self._throughput + 0.2 * throughput
+        except asyncio.CancelledError:
+            # 停止超时时flusher在写入中途被取消，转存本批报告后再退出（回放时按确定性ID去重）
+            logger.warning(f"Ingest flush of {len(batch)} report(s) cancelled, spooling")
+            await self._spool(batch)
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing ingest batch of {len(batch)} report(s), spooling: {e}")
+            self._es_available = False
+            await self._spool(batch)
+        finally:
+            self._flush_latencies.append((time.monotonic() - started) * 1000)
+            self._queue_waits.append(oldest_wait)
+
+    async def _spool(self, batch: List[IngestItem]):
+        """将报告写入本地缓冲"""
+        try:
+            await self.spool.append([(item.report, item.report_id) for item in batch])
+            self.reports_spooled += len(batch)
+        except Exception as e:
+            self.reports_failed += len(batch)
+            logger.error(f"Error spooling {len(batch)} report(s), data lost: {e}")
+
+    async def _replayer(self):
+        """后台回放任务：定期检查ES是否可用，并将本地缓冲中的报告批量写回"""
+        try:
+            while True:
+                await asyncio.sleep(settings.INGEST_SPOOL_REPLAY_INTERVAL)
+                try:
+                    es_client = await get_es_client()
+                    if not await es_client.ping():
+                        self._es_available = False
+                        continue
+                    self._es_available = True
+
+                    if self.spool.has_pending():
+                        replayed = await self.spool.replay(self._store)
+                        self.reports_flushed += replayed
+                except Exception as e:
+                    self._es_available = False
+                    logger.warning(f"Spool replay failed, will retry later: {e}")
+        except asyncio.CancelledError:
+            logger.info("Spool replayer cancelled")
+            raise
+
+    @property
+    def es_available(self) -> bool:
+        """ES是否可写（最近一次写入或探测成功）"""
+        return self._es_available
+    
+    def estimate_drain_seconds(self, report_count: int) -> Optional[float]:
+        """
+        根据近期写入吞吐估算写入指定数量报告所需的时间
+        
+        Args:
+            report_count: 报告数
+            
+        Returns:
+            Optional[float]: 秒数；尚无吞吐数据时返回None
+        """
+        if not self._throughput:
+            return None
+        return max(0, report_count) / (self._throughput * max(1, len(self._flusher_tasks)))
+    
+    @staticmethod
+    def _percentile(values: Deque[float], percentile: float) -> Optional[float]:
+        """计算百分位数（最近窗口内）"""
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return round(ordered[index], 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列深度与写入延迟等统计信息"""
+        return {
+            "accepting": self._accepting,
+            "es_available": self._es_available,
+            "flushers": len(self._flusher_tasks),
+            "queue_depth": self.queue.qsize(),
+            "queue_max_size": self.queue.maxsize,
+            "in_flight": self.in_flight,
+            "reports_accepted": self.reports_accepted,
+            "reports_flushed": self.reports_flushed,
+            "reports_failed": self.reports_failed,
+            "reports_rejected": self.reports_rejected,
+            "reports_spooled": self.reports_spooled,
+            "batches_flushed": self.batches_flushed,
+            "flush_latency_ms": {
+                "p50": self._percentile(self._flush_latencies, 50),
+                "p99": self._percentile(self._flush_latencies, 99),
+                "max": round(max(self._flush_latencies), 2) if self._flush_latencies else None,
+            },
+            "queue_wait_ms": {
+                "p50": self._percentile(self._queue_waits, 50),
+                "p99": self._percentile(self._queue_waits, 99),
+            },
+            "spool": self.spool.get_stats(),
+        }
+
+
+# 创建全局服务实例
+ingest_service = IngestService()
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from ..core.config import settings
+from ..models.data import DataReport
+
+logger = logging.getLogger(__name__)
+
+
+class SpoolFullError(Exception):
+    """本地缓冲已达到磁盘用量上限"""
+
+
+class IngestSpool:
+    """
+    摄取本地缓冲：ES拒绝或超时时，报告以NDJSON追加写入分段文件，
+    ES恢复后由回放任务按段批量写回并删除已回放的分段
+    """
+
+    SEGMENT_PREFIX = "segment-"
+    SEGMENT_SUFFIX = ".ndjson"
+    DEAD_LETTER_FILE = "dead-letter.ndjson"  # ES永久拒绝的报告，不参与回放
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.INGEST_SPOOL_DIR
+        self._lock = asyncio.Lock()
+        self._active_file = None
+        self._active_path: Optional[str] = None
+        self._active_size = 0
+        self._total_bytes: Optional[int] = None
+        self._last_fsync = 0.0
+
+        # 统计信息
+        self.reports_spooled = 0
+        self.reports_replayed = 0
+        self.reports_dead_lettered = 0
+
+    def _segment_paths(self) -> List[str]:
+        """按写入顺序返回所有分段文件路径"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    @property
+    def total_bytes(self) -> int:
+        """缓冲占用的磁盘字节数"""
+        if self._total_bytes is None:
+            self._total_bytes = sum(os.path.getsize(path) for path in self._segment_paths())
+        return self._total_bytes
+
+    def has_pending(self) -> bool:
+        """是否有待回放的数据"""
+        return self.total_bytes > 0
+
+    def _open_segment(self):
+        """打开一个新的分段文件用于追加写入"""
+        os.makedirs(self.directory, exist_ok=True)
+        paths = self._segment_paths()
+        if paths:
+            last = os.path.basename(paths[-1])
+            sequence = int(last[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]) + 1
+        else:
+            sequence = 0
+        self._active_path = os.path.join(
+            self.directory, f"{self.SEGMENT_PREFIX}{sequence:012d}{self.SEGMENT_SUFFIX}"
+        )
+        self._active_file = open(self._active_path, "ab")
+        self._active_size = 0
+
+    def _seal_segment(self):
+        """关闭当前分段，之后的写入进入新分段"""
+        if self._active_file is None:
+            return
+        self._sync(force=True)
+        self._active_file.close()
+        self._active_file = None
+        self._active_path = None
+        self._active_size = 0
+
+    def _sync(self, force: bool = False):
+        """按fsync策略将当前分段落盘"""
+        if self._active_file is None:
+            return
+        self._active_file.flush()
+        policy = settings.INGEST_SPOOL_FSYNC
+        now = time.monotonic()
+        if (
+            force
+            or policy == "always"
+            or (policy == "interval" and now - self._last_fsync >= settings.INGEST_SPOOL_FSYNC_INTERVAL)
+        ):
+            os.fsync(self._active_file.fileno())
+            self._last_fsync = now
+
+    def _write(self, payload: bytes):
+        """将编码后的记录写入当前分段（在线程中执行）"""
+        total_bytes = self.total_bytes
+        if self._active_file is None:
+            self._open_segment()
+        self._active_file.write(payload)
+        self._active_size += len(payload)
+        self._total_bytes = total_bytes + len(payload)
+        self._sync()
+        if self._active_size >= settings.INGEST_SPOOL_SEGMENT_BYTES:
+            self._seal_segment()
+
+    async def append(self, reports: List[Tuple[DataReport, str]]):
+        """
+        将报告追加写入缓冲
+
+        Args:
+            reports: (报告, 报告ID) 列表
+
+        Raises:
+            SpoolFullError: 磁盘用量已达上限
+        """
+        if not reports:
+            return
+        payload = b"".join(
+            json.dumps(
+                {"report_id": report_id, "report": report.model_dump(mode="json")},
+                ensure_ascii=False,
+            ).encode("utf-8") + b"\n"
+            for report, report_id in reports
+        )
+
+        async with self._lock:
+            if self.total_bytes + len(payload) > settings.INGEST_SPOOL_MAX_BYTES:
+                raise SpoolFullError(
+                    f"Ingest spool is full ({self.total_bytes} bytes used)"
+                )
+            await asyncio.to_thread(self._write, payload)
+            self.reports_spooled += len(reports)
+
+    @staticmethod
+    def _read_segment(path: str) -> List[Tuple[DataReport, str]]:
+        """读取并解析一个分段文件，跳过损坏的行（如崩溃时未写完的最后一行）"""
+        reports = []
+        with open(path, "rb") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    reports.append((DataReport.model_validate(record["report"]), record["report_id"]))
+                except Exception as e:
+                    logger.warning(f"Skipping corrupted spool record {path}:{line_number}: {e}")
+        return reports
+
+    @staticmethod
+    def _remove_segment(path: str) -> int:
+        """删除已回放的分段文件，返回其大小（在线程中执行）"""
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    async def replay(
+        self, store: Callable[[List[Tuple[DataReport, str]]], Awaitable[None]]
+    ) -> int:
+        """
+        按写入顺序回放所有分段，每段回放成功后删除
+
+        写入失败时异常向上抛出，未完成的分段保留到下次回放；
+        已写入的部分依赖确定性ID，重复写入时不会产生新文档。
+
+        Args:
+            store: 批量写入函数，接收 (报告, 报告ID) 列表
+
+        Returns:
+            int: 本次回放的报告数
+        """
+        async with self._lock:
+            await asyncio.to_thread(self._seal_segment)
+            paths = await asyncio.to_thread(self._segment_paths)
+
+        replayed = 0
+        for path in paths:
+            reports = await asyncio.to_thread(self._read_segment, path)
+            batch_size = max(1, settings.INGEST_BATCH_MAX_REPORTS)
+            for start in range(0, len(reports), batch_size):
+                await store(reports[start:start + batch_size])
+
+            async with self._lock:
+                size = await asyncio.to_thread(self._remove_segment, path)
+                self._total_bytes = max(0, self.total_bytes - size)
+
+            replayed += len(reports)
+            self.reports_replayed += len(reports)
+            logger.info(f"Replayed {len(reports)} report(s) from spool segment {os.path.basename(path)}")
+
+        return replayed
+
+    def _write_dead_letter(self, payload: bytes):
+        """将编码后的记录追加写入死信文件（在线程中执行）"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.DEAD_LETTER_FILE), "ab") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def dead_letter(self, reports: List[Tuple[DataReport, str, Any]]):
+        """
+        将ES永久拒绝的报告写入死信文件，保留原始报告和错误信息供人工排查后重新上报
+
+        Args:
+            reports: (报告, 报告ID, 错误) 列表
+        """
+        if not reports:
+            return
+        payload = b"".join(
+            json.dumps(
+                {"report_id": report_id, "error": error, "report": report.model_dump(mode="json")},
+                ensure_ascii=False,
+                default=str,
+            ).encode("utf-8") + b"\n"
+            for report, report_id, error in reports
+        )
+        async with self._lock:
+            await asyncio.to_thread(self._write_dead_letter, payload)
+            self.reports_dead_lettered += len(reports)
+        logger.error(
+            f"Dead-lettered {len(reports)} rejected report(s) to {self.DEAD_LETTER_FILE}, "
+            f"first error: {reports[0][2]}"
+        )
+
+    async def close(self):
+        """落盘并关闭当前分段"""
+        async with self._lock:
+            await asyncio.to_thread(self._seal_segment)
+
+    def get_stats(self):
+        """获取缓冲统计信息"""
+        return {
+            "pending_bytes": self.total_bytes,
+            "max_bytes": settings.INGEST_SPOOL_MAX_BYTES,
+            "segments": len(self._segment_paths()),
+            "reports_spooled": self.reports_spooled,
+            "reports_replayed": self.reports_replayed,
+            "reports_dead_lettered": self.reports_dead_lettered,
+        }
@@ -0,0 +1,130 @@
+import zlib
+from typing import AsyncIterator, Iterator, Tuple
+
+from ..core.config import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd为可选依赖
+    zstandard = None
+
+
+# zlib每次最多解压出的字节数
+_ZLIB_OUTPUT_STEP = 1024 * 1024
+# zstd每次送入的压缩字节数：单个块最多解压出128KB，分片输入使每次解压出的数据有上限
+_ZSTD_INPUT_STEP = 256
+_ZLIB_DECOMPRESS_TYPE = type(zlib.decompressobj())
+
+
+class UnsupportedEncodingError(Exception):
+    """不支持的请求体压缩格式"""
+
+
+class NdjsonStreamError(Exception):
+    """请求体解压失败或单行超过长度上限"""
+
+
+def _make_decompressor(content_encoding: str):
+    """根据Content-Encoding创建增量解压器，未压缩时返回None"""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncodingError("zstd encoding requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise UnsupportedEncodingError(f"Unsupported content encoding: {content_encoding}")
+
+
+def _decompress_steps(decompressor, chunk: bytes) -> Iterator[bytes]:
+    """分步解压一个字节块，每一步解压出的数据量有上限，避免高压缩比的请求体一次展开占满内存"""
+    if isinstance(decompressor, _ZLIB_DECOMPRESS_TYPE):
+        data = chunk
+        while data:
+            yield decompressor.decompress(data, _ZLIB_OUTPUT_STEP)
+            data = decompressor.unconsumed_tail
+    else:
+        for offset in range(0, len(chunk), _ZSTD_INPUT_STEP):
+            yield decompressor.decompress(chunk[offset:offset + _ZSTD_INPUT_STEP])
+
+
+async def iter_ndjson_lines(
+    chunks: AsyncIterator[bytes], content_encoding: str = None
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    流式解压并按行切分NDJSON请求体，不在内存中保留完整请求体
+
+    Args:
+        chunks: 请求体字节块迭代器
+        content_encoding: Content-Encoding请求头，支持 gzip / deflate / zstd / identity
+
+    Yields:
+        Tuple[int, bytes]: (行号（从1开始，含空行计数）, 非空行内容)
+
+    Raises:
+        UnsupportedEncodingError: 不支持的压缩格式
+        NdjsonStreamError: 解压失败、单行过长或解压后总大小超过上限
+    """
+    decompressor = _make_decompressor(content_encoding)
+    max_line_bytes = settings.INGEST_BATCH_MAX_LINE_BYTES
+    max_total_bytes = settings.INGEST_BATCH_MAX_DECOMPRESSED_BYTES
+    total_bytes = 0
+    buffer = bytearray()  # 尚未遇到换行符的行首部分
+    line_number = 0
+
+    def split(data: bytes):
+        # 只在新数据中查找换行符，未完成的行先检查长度再追加，整体为线性时间
+        nonlocal line_number, total_bytes
+        total_bytes += len(data)
+        if total_bytes > max_total_bytes:
+            raise NdjsonStreamError(f"Request body exceeds {max_total_bytes} bytes after decompression")
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if len(buffer) + end - start > max_line_bytes:
+                raise NdjsonStreamError(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+            if buffer:
+                buffer.extend(memoryview(data)[start:end])
+                line = bytes(buffer)
+                buffer.clear()
+            else:
+                line = data[start:end]
+            line_number += 1
+            start = end + 1
+            if line.strip():
+                yield line_number, line
+        if len(buffer) + len(data) - start > max_line_bytes:
+            raise NdjsonStreamError(f"Line {line_number + 1} exceeds {max_line_bytes} bytes")
+        buffer.extend(memoryview(data)[start:])
+
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if decompressor is None:
+                for item in split(chunk):
+                    yield item
+                continue
+            for data in _decompress_steps(decompressor, chunk):
+                for item in split(data):
+                    yield item
+
+        if decompressor is not None and hasattr(decompressor, "flush"):
+            for item in split(decompressor.flush()):
+                yield item
+    except (zlib.error, ValueError) as e:
+        raise NdjsonStreamError(f"Failed to decompress request body: {e}")
+    except Exception as e:
+        if zstandard is not None and isinstance(e, zstandard.ZstdError):
+            raise NdjsonStreamError(f"Failed to decompress request body: {e}")
+        raise
+
+    if buffer.strip():
+        line_number += 1
+        yield line_number, bytes(buffer)
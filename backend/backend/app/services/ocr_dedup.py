@@ -0,0 +1,90 @@
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from ..core.config import settings
+
+
+class OcrDedupCache:
+    """
+    OCR文本去重缓存
+
+    按 (客户端, 应用, 窗口) 记录最近一帧OCR文本的内容哈希及其文档ID，
+    条目数量受LRU上限约束。用户停留在同一窗口时连续帧的文本通常完全相同，
+    此时只需延长上一条文档的"最后出现时间"，无需再写入新文档。
+
+    用户离开窗口后再回来时不合并：该客户端的上一帧属于其他窗口，或与上一帧相隔超过
+    OCR_DEDUP_MAX_GAP_SECONDS，都重新写入文档，避免 last_seen_at 覆盖用户不在该窗口的时间。
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_gap_seconds: Optional[float] = None):
+        self.max_entries = max_entries or settings.OCR_DEDUP_CACHE_SIZE
+        max_gap_seconds = settings.OCR_DEDUP_MAX_GAP_SECONDS if max_gap_seconds is None else max_gap_seconds
+        self.max_gap = timedelta(seconds=max_gap_seconds)
+        # (客户端, 应用, 窗口) -> (文本哈希, 文档ID, 最后一帧的时间)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, str, datetime]]" = OrderedDict()
+        # 客户端 -> 最近一帧所在的 (客户端, 应用, 窗口)
+        self._current: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """计算文本内容哈希"""
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def check(
+        self, client_id: str, app_name: str, window_name: str, content_hash: str, doc_id: str,
+        timestamp: datetime,
+    ) -> Optional[str]:
+        """
+        检查当前帧是否与该窗口上一帧文本相同
+
+        Args:
+            client_id: 客户端ID
+            app_name: 应用名称
+            window_name: 窗口名称
+            content_hash: 当前帧文本哈希
+            doc_id: 当前帧的文档ID
+            timestamp: 当前帧的时间
+
+        Returns:
+            Optional[str]: 用户一直停留在该窗口且文本相同时返回上一帧的文档ID；否则记录当前帧并返回None
+        """
+        key = (client_id, app_name, window_name)
+        previous = self._entries.get(key)
+        left_window = self._current.get(client_id, key) != key
+        self._current[client_id] = key
+        self._current.move_to_end(client_id)
+        if len(self._current) > self.max_entries:
+            self._current.popitem(last=False)
+
+        # 同一帧重复上报（客户端重试）不算重复内容
+        if (
+            previous
+            and previous[0] == content_hash
+            and previous[1] != doc_id
+            and not left_window
+            and abs(timestamp - previous[2]) <= self.max_gap
+        ):
+            self._entries[key] = (content_hash, previous[1], max(previous[2], timestamp))
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return previous[1]
+
+        self._entries[key] = (content_hash, doc_id, timestamp)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.misses += 1
+        return None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 创建全局缓存实例
+ocr_dedup_cache = OcrDedupCache()
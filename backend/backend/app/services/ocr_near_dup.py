@@ -0,0 +1,155 @@
+import hashlib
+import random
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Set, Tuple
+
+import numpy as np
+
+from ..core.config import settings
+
+# 哈希空间：Mersenne素数取模后截断为32位
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# 线性哈希的系数a不超过29位，与32位的shingle哈希相乘后仍在uint64范围内，可以用NumPy整体计算
+_MAX_MULTIPLIER = 1 << 29
+
+
+class MinHasher:
+    """
+    MinHash签名计算
+
+    将文本切分为词级shingle，用多组随机线性哈希取最小值得到定长签名，
+    两个签名相同位置取值相等的比例即为Jaccard相似度的估计。
+    所有线性哈希对全部shingle的计算用NumPy一次完成，避免在摄取的事件循环中逐个计算。
+    """
+
+    def __init__(self, num_perm: Optional[int] = None, shingle_size: Optional[int] = None, seed: int = 1):
+        self.num_perm = num_perm or settings.OCR_NEAR_DUP_NUM_PERM
+        self.shingle_size = shingle_size or settings.OCR_NEAR_DUP_SHINGLE_SIZE
+        rng = random.Random(seed)
+        permutations = [
+            (rng.randrange(1, _MAX_MULTIPLIER), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(self.num_perm)
+        ]
+        self._a = np.array([a for a, _ in permutations], dtype=np.uint64).reshape(-1, 1)
+        self._b = np.array([b for _, b in permutations], dtype=np.uint64).reshape(-1, 1)
+
+    def shingles(self, text: str) -> Set[str]:
+        """将文本切分为连续词组"""
+        tokens = text.split()
+        if len(tokens) <= self.shingle_size:
+            return {" ".join(tokens)}
+        return {
+            " ".join(tokens[i:i + self.shingle_size])
+            for i in range(len(tokens) - self.shingle_size + 1)
+        }
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """计算文本的MinHash签名"""
+        shingles = self.shingles(text)
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+                for shingle in shingles
+            ),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # (签名长度, shingle数) 的矩阵，每行取最小值
+        values = ((self._a * hashes + self._b) % np.uint64(_MERSENNE_PRIME)) & np.uint64(_MAX_HASH)
+        return tuple(values.min(axis=1).tolist())
+
+    @staticmethod
+    def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+        """估计两个签名对应文本的Jaccard相似度"""
+        if not left or len(left) != len(right):
+            return 0.0
+        return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+class NearDuplicateDetector:
+    """
+    OCR近似重复检测
+
+    为每个客户端保留最近若干条完整文本文档的签名（客户端数量受LRU上限约束），
+    新帧与同一应用窗口下的签名相似度超过阈值时视为近似重复。
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        window_size: Optional[int] = None,
+        max_clients: Optional[int] = None,
+        hasher: Optional[MinHasher] = None,
+    ):
+        self.threshold = threshold if threshold is not None else settings.OCR_NEAR_DUP_THRESHOLD
+        self.window_size = window_size or settings.OCR_NEAR_DUP_WINDOW
+        self.max_clients = max_clients or settings.OCR_DEDUP_CACHE_SIZE
+        self.hasher = hasher or MinHasher()
+        self._recent: "OrderedDict[str, Deque[Tuple[str, str, Tuple[int, ...], str]]]" = OrderedDict()
+
+        # 统计信息
+        self.matches = 0
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """计算文本签名"""
+        return self.hasher.signature(text)
+
+    def find(
+        self,
+        client_id: str,
+        app_name: str,
+        window_name: str,
+        signature: Tuple[int, ...],
+        doc_id: Optional[str] = None,
+    ) -> Optional[Tuple[str, float]]:
+        """
+        查找与当前帧最相似的近期文档
+
+        同一帧重复构建（客户端重试、本地缓冲回放）时不会与自己匹配，否则全文会被替换为指向自身的引用。
+
+        Args:
+            client_id: 客户端ID
+            app_name: 应用名称
+            window_name: 窗口名称
+            signature: 当前帧签名
+            doc_id: 当前帧的文档ID，可选
+
+        Returns:
+            Optional[Tuple[str, float]]: 相似度达到阈值时返回 (文档ID, 相似度)，否则返回None
+        """
+        recent = self._recent.get(client_id)
+        if not recent:
+            return None
+
+        best = None
+        for app, window, candidate, candidate_id in recent:
+            if app != app_name or window != window_name or candidate_id == doc_id:
+                continue
+            score = self.hasher.similarity(signature, candidate)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate_id, score)
+
+        if best:
+            self.matches += 1
+        return best
+
+    def remember(
+        self, client_id: str, app_name: str, window_name: str, signature: Tuple[int, ...], doc_id: str
+    ):
+        """记录一条完整文本文档的签名"""
+        recent = self._recent.get(client_id)
+        if recent is None:
+            recent = deque(maxlen=self.window_size)
+            self._recent[client_id] = recent
+            if len(self._recent) > self.max_clients:
+                self._recent.popitem(last=False)
+        self._recent.move_to_end(client_id)
+        # 重复构建的帧已记录过，不再重复占用窗口
+        if any(entry[3] == doc_id for entry in recent):
+            return
+        recent.append((app_name, window_name, signature, doc_id))
+
+
+# 创建全局检测器实例
+ocr_near_dup_detector = NearDuplicateDetector()
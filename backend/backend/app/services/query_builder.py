@@ -0,0 +1,232 @@
+import re
+from fnmatch import fnmatchcase
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Union
+
+from ..core.config import settings
+
+_EPOCH = datetime(1970, 1, 1)
+_ROUNDING_PATTERN = re.compile(r"^(\d+)([smhd])$")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_rounding(value: Optional[str]) -> Optional[str]:
+    """
+    校验时间取整粒度
+
+    Args:
+        value: ES date-math 形式的粒度，如 "1m"、"5m"、"1h"；空值或 "0" 表示不取整
+
+    Returns:
+        Optional[str]: 规范化的粒度，不取整时返回None
+
+    Raises:
+        ValueError: 格式不合法
+    """
+    value = (value or "").strip()
+    if value in ("", "0"):
+        return None
+    match = _ROUNDING_PATTERN.match(value)
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid time rounding: {value}")
+    return value
+
+
+def _floor_time(timestamp: datetime, rounding: str) -> str:
+    """将时间向下取整到粒度边界（按UTC对齐），返回不带时区的ISO格式"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    match = _ROUNDING_PATTERN.match(rounding)
+    bucket = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    seconds = int((timestamp - _EPOCH).total_seconds()) // bucket * bucket
+    return (_EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def time_range_clause(
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    field: str = "timestamp",
+    round_time: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    构建时间范围过滤
+
+    取整时开始时间向下取整到 QUERY_TIME_ROUNDING 的边界，结束时间取整后用 date-math 扩展到该粒度的末尾
+    （"<边界>||+5m"，不包含）。同一粒度内的重复请求得到完全相同的查询体，可以命中分片请求缓存；
+    代价是范围两端最多各扩大一个粒度。
+
+    Args:
+        start_time: 开始时间（包含），可选
+        end_time: 结束时间（包含），可选
+        field: 时间字段
+        round_time: 是否取整，流式读取等需要精确边界的查询传False
+
+    Returns:
+        Optional[Dict[str, Any]]: range 过滤，没有时间条件时返回None
+    """
+    if not start_time and not end_time:
+        return None
+
+    rounding = parse_rounding(settings.QUERY_TIME_ROUNDING) if round_time else None
+    time_range = {}
+    if rounding:
+        if start_time:
+            time_range["gte"] = _floor_time(start_time, rounding)
+        if end_time:
+            time_range["lt"] = f"{_floor_time(end_time, rounding)}||+{rounding}"
+    else:
+        if start_time:
+            time_range["gte"] = start_time.isoformat()
+        if end_time:
+            time_range["lte"] = end_time.isoformat()
+    return {"range": {field: time_range}}
+
+
+def time_overlap_clauses(
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    field: str = "timestamp",
+    end_field: str = "last_seen_at",
+    round_time: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    构建区间与时间范围重叠的过滤
+
+    文档的区间为 [field, end_field]：开始不晚于结束时间，且 end_field 不早于开始时间；
+    没有 end_field 的文档按 field 判断。取整规则同 time_range_clause。
+
+    Args:
+        start_time: 开始时间（包含），可选
+        end_time: 结束时间（包含），可选
+        field: 区间开始的时间字段
+        end_field: 区间结束的时间字段
+        round_time: 是否取整
+
+    Returns:
+        List[Dict[str, Any]]: 过滤条件列表，没有时间条件时为空
+    """
+    clauses = []
+    if end_time:
+        clauses.append(time_range_clause(None, end_time, field, round_time))
+    if start_time:
+        clauses.append({"bool": {
+            "should": [
+                time_range_clause(start_time, None, end_field, round_time),
+                {"bool": {
+                    "must_not": [{"exists": {"field": end_field}}],
+                    "filter": [time_range_clause(start_time, None, field, round_time)],
+                }},
+            ],
+            "minimum_should_match": 1,
+        }})
+    return clauses
+
+
+def build_filter_query(
+    terms: Optional[Dict[str, Any]] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    round_time: bool = True,
+    end_field: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    构建只包含过滤条件的查询
+
+    所有条件放在 bool.filter 中，不计算相关度评分，可以使用ES的过滤缓存。
+    条件按传入顺序输出，相同参数得到相同的查询体。
+
+    Args:
+        terms: 字段 -> 精确匹配的值，值为None或空时忽略（False不忽略），为列表时使用 terms 过滤
+        start_time: 开始时间，可选
+        end_time: 结束时间，可选
+        round_time: 是否按 QUERY_TIME_ROUNDING 取整时间范围
+        end_field: 文档区间结束的时间字段，给出时按区间与时间范围重叠过滤（见 time_overlap_clauses），可选
+
+    Returns:
+        Dict[str, Any]: bool 查询
+    """
+    filters: List[Dict[str, Any]] = []
+    for field, value in (terms or {}).items():
+        if value is None or (isinstance(value, (str, list, tuple, set)) and not value):
+            continue
+        if isinstance(value, (list, tuple, set)):
+            filters.append({"terms": {field: list(value)}})
+        else:
+            filters.append({"term": {field: value}})
+
+    if end_field:
+        filters.extend(time_overlap_clauses(start_time, end_time, end_field=end_field, round_time=round_time))
+    else:
+        time_range = time_range_clause(start_time, end_time, round_time=round_time)
+        if time_range:
+            filters.append(time_range)
+    return {"bool": {"filter": filters}}
+
+
+def build_source_filter(
+    fields: Optional[List[str]] = None, exclude: Optional[List[str]] = None
+) -> Optional[Dict[str, List[str]]]:
+    """
+    构建 _source 过滤
+
+    Args:
+        fields: 只返回的字段（支持通配符），可选
+        exclude: 不返回的字段（支持通配符），可选
+
+    Returns:
+        Optional[Dict[str, List[str]]]: _source 过滤，都为空时返回None（返回完整文档）
+    """
+    includes = [field for field in (fields or []) if field]
+    excludes = [field for field in (exclude or []) if field]
+    if not includes and not excludes:
+        return None
+    source = {}
+    if includes:
+        source["includes"] = includes
+    if excludes:
+        source["excludes"] = excludes
+    return source
+
+
+def source_filter_selects(source: Optional[Dict[str, List[str]]], field: str) -> bool:
+    """
+    判断 _source 过滤是否会返回某个字段，通配符按ES的规则匹配（区分大小写）
+
+    Args:
+        source: build_source_filter 构建的 _source 过滤，None表示返回完整文档
+        field: 字段名称
+
+    Returns:
+        bool: 字段会被返回时为True
+    """
+    if not source:
+        return True
+    includes = source.get("includes")
+    if includes and not any(fnmatchcase(field, pattern) for pattern in includes):
+        return False
+    return not any(fnmatchcase(field, pattern) for pattern in source.get("excludes", []))
+
+
+def parse_track_total_hits(value: Optional[str]) -> Union[bool, int, None]:
+    """
+    解析总数统计模式
+
+    Args:
+        value: "exact" 精确统计，"off" 不统计，正整数N表示最多精确统计到N；空值使用ES默认（精确统计到10000）
+
+    Returns:
+        Union[bool, int, None]: track_total_hits 参数值，None表示不传
+
+    Raises:
+        ValueError: 格式不合法
+    """
+    value = (value or "").strip().lower()
+    if not value:
+        return None
+    if value == "exact":
+        return True
+    if value == "off":
+        return False
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    raise ValueError(f"Invalid track_total_hits: {value}")
@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+
+CURSOR_VERSION = 2
+
+# 未配置 QUERY_CURSOR_SECRET 时使用进程内随机密钥，游标只在本进程内有效
+_process_key = secrets.token_bytes(32)
+
+
+class InvalidCursorError(Exception):
+    """游标无法解析、签名无效或已过期"""
+
+
+def _signing_key() -> bytes:
+    """获取游标签名密钥"""
+    secret = settings.QUERY_CURSOR_SECRET
+    return secret.encode("utf-8") if secret else _process_key
+
+
+def _b64encode(raw: bytes) -> str:
+    """URL安全的base64编码，去掉末尾的填充"""
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    """解码 _b64encode 的结果"""
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _pack(payload: Dict[str, Any]) -> str:
+    """序列化并以HMAC签名，游标格式为 <base64 JSON>.<base64 签名>"""
+    body = _b64encode(json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8"))
+    signature = hmac.new(_signing_key(), body.encode("ascii"), hashlib.sha256).digest()
+    return f"{body}.{_b64encode(signature)}"
+
+
+def _unpack(cursor: str) -> Dict[str, Any]:
+    """校验签名并解析游标内容，游标中的查询条件会原样发往ES，签名不符时拒绝"""
+    body, _, signature = cursor.partition(".")
+    try:
+        expected = hmac.new(_signing_key(), body.encode("ascii"), hashlib.sha256).digest()
+        if not signature or not hmac.compare_digest(_b64decode(signature), expected):
+            raise InvalidCursorError("Invalid cursor signature")
+        payload = json.loads(_b64decode(body))
+    except InvalidCursorError:
+        raise
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Malformed cursor: {e}")
+
+    if not isinstance(payload, dict) or payload.get("v") != CURSOR_VERSION:
+        raise InvalidCursorError("Unsupported cursor version")
+    return payload
+
+
+def encode_cursor(
+    pit_id: str,
+    search_after: List[Any],
+    query: Dict[str, Any],
+    sort: List[Any],
+    source: Optional[Dict[str, Any]] = None,
+    hidden: Optional[List[str]] = None,
+) -> str:
+    """
+    将point-in-time ID、最后一条结果的排序值及查询条件编码为不透明游标
+
+    查询条件随游标保存，后续页与第一页使用完全相同的条件（例如接口默认的时间范围不会随请求时间变化）。
+
+    Args:
+        pit_id: point-in-time ID
+        search_after: 当前页最后一条结果的sort值
+        query: 查询条件
+        sort: 排序条件
+        source: _source 过滤，可选
+        hidden: 返回前需要去掉的字段模式，可选
+
+    Returns:
+        str: 带签名的URL安全游标
+    """
+    payload = {"v": CURSOR_VERSION, "pit": pit_id, "after": search_after, "query": query, "sort": sort}
+    if source is not None:
+        payload["source"] = source
+    if hidden:
+        payload["hidden"] = hidden
+    return _pack(payload)
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """
+    解析游标
+
+    Args:
+        cursor: encode_cursor 生成的游标
+
+    Returns:
+        Dict[str, Any]: 包含 pit、after、query、sort，以及可选的 source、hidden
+
+    Raises:
+        InvalidCursorError: 游标格式错误或签名无效
+    """
+    payload = _unpack(cursor)
+    if (
+        not isinstance(payload.get("pit"), str)
+        or not isinstance(payload.get("after"), list)
+        or not isinstance(payload.get("query"), dict)
+        or not isinstance(payload.get("sort"), list)
+        or not isinstance(payload.get("source", {}), dict)
+        or not isinstance(payload.get("hidden", []), list)
+    ):
+        raise InvalidCursorError("Malformed cursor")
+    return payload
+
+
+def encode_after_key(after_key: Dict[str, Any], scope: Dict[str, Any]) -> str:
+    """
+    将筛选项分页的composite聚合after_key编码为不透明游标
+
+    游标同时保存生成它的请求范围（索引、字段及过滤条件），只能用于相同范围的下一页。
+
+    Args:
+        after_key: composite聚合返回的after_key，形如 {"value": <str>}
+        scope: 请求范围
+
+    Returns:
+        str: 带签名的URL安全游标
+    """
+    return _pack({"v": CURSOR_VERSION, "after_key": after_key, "scope": scope})
+
+
+def decode_after_key(cursor: str, scope: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    解析 encode_after_key 生成的游标
+
+    Args:
+        cursor: 游标
+        scope: 当前请求的范围，需与生成游标时的范围一致
+
+    Returns:
+        Dict[str, Any]: composite聚合的after_key
+
+    Raises:
+        InvalidCursorError: 游标格式错误、签名无效或与当前请求的范围不一致
+    """
+    payload = _unpack(cursor)
+    after_key = payload.get("after_key")
+    if not isinstance(after_key, dict) or set(after_key) != {"value"} or not isinstance(after_key["value"], str):
+        raise InvalidCursorError("Malformed cursor")
+    if payload.get("scope") != scope:
+        raise InvalidCursorError("Cursor does not match the request")
+    return after_key
@@ -1,7 +1,12 @@
 from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
 import logging
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, NotFoundError
 from ..core.config import settings
+from .facet_cache import facet_cache
+from .query_builder import build_filter_query, build_source_filter, source_filter_selects
+from .query_cursor import InvalidCursorError, decode_after_key, decode_cursor, encode_after_key, encode_cursor
+from .ui_delta import DELTA_FIELDS, STORAGE_DELTA, apply_delta
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +22,18 @@ class QueryService:
                                         window: str = None,
                                         limit: int = 100,
                                         offset: int = 0,
-                                        sort_order: str = "desc"):
+                                        sort_order: str = "desc",
+                                        reconstruct_text: bool = False,
+                                        cursor: str = None,
+                                        use_cursor: bool = False,
+                                        fields: list = None,
+                                        exclude: list = None,
+                                        track_total_hits=None):
         """
         按时间顺序获取UI监控数据
         
+        默认使用 from/size 分页；use_cursor 为True或传入cursor时使用游标分页（见 _paged_search）。
+        
         Args:
             client_id: 客户端ID，可选
             start_time: 开始时间，可选
@@ -30,107 +43,605 @@ class QueryService:
             limit: 返回结果数量限制，默认100
             offset: 分页偏移量，默认0
             sort_order: 排序顺序，"asc"或"desc"，默认"desc"
+            reconstruct_text: 是否为增量存储的文档重建完整的text_output，默认False
+            cursor: 上一页返回的 next_cursor，传入时忽略其他过滤、排序和字段参数
+            use_cursor: 第一页是否使用游标分页
+            fields: 只返回的字段，可选
+            exclude: 不返回的字段，可选
+            track_total_hits: 总数统计，True精确、False不统计、整数N最多统计到N，None使用ES默认
             
         Returns:
-            dict: 包含UI监控数据的字典
+            dict: 包含UI监控数据的字典，游标分页时 next_cursor 为下一页游标；
+                total_relation 为 "gte" 时 total 只是下限
         """
         try:
-            # 注意：ES中的时间戳直接是北京时间，而start_time和end_time是UTC时间
-            # 我们需要将UTC时间转换为北京时间进行比较
-            
-            # 构建查询
-            query = {"bool": {"must": []}}
-            
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
-            
-            # 添加时间范围过滤
-            if start_time or end_time:
-                time_range = {}
-                if start_time:
-                    time_range["gte"] = start_time.isoformat()
-                if end_time:
-                    time_range["lte"] = end_time.isoformat()
-                query["bool"]["must"].append({"range": {"timestamp": time_range}})
-            
-            # 添加应用名称过滤
-            if app:
-                query["bool"]["must"].append({"term": {"app": app}})
+            # 构建查询（过滤上下文，时间范围按 QUERY_TIME_ROUNDING 取整）
+            query = build_filter_query(
+                {"client_id": client_id, "app": app, "window": window}, start_time, end_time
+            )
             
-            # 添加窗口名称过滤
-            if window:
-                query["bool"]["must"].append({"term": {"window": window}})
+            # 只返回需要的字段；重建文本时需要同时读取增量存储的字段，读取后再去掉未请求的字段
+            source = build_source_filter(fields, exclude)
+            hidden_patterns = []
+            if reconstruct_text and not source:
+                hidden_patterns = list(DELTA_FIELDS)
+            elif reconstruct_text:
+                if not source_filter_selects(source, "text_output"):
+                    reconstruct_text = False
+                else:
+                    source, hidden_patterns = self._expand_source(source, DELTA_FIELDS)
             
             # 执行查询
             index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
             
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "sort": [{"timestamp": sort_order}],
-                    "from": offset,
-                    "size": limit
-                }
+            hits, total, total_relation, next_cursor, hidden_patterns = await self._paged_search(
+                index_name, query, sort_order, limit, offset, cursor, use_cursor, source, track_total_hits,
+                hidden_patterns
             )
             
             # 处理结果
-            total = result["hits"]["total"]["value"]
-            items = [hit["_source"] for hit in result["hits"]["hits"]]
+            items = [hit.get("_source", {}) for hit in hits]
+            
+            # 只有重建文本时才会隐藏增量字段，游标后续页据此沿用第一页的重建设置
+            if reconstruct_text or (cursor and any(
+                fnmatchcase(field, pattern) for field in DELTA_FIELDS for pattern in hidden_patterns
+            )):
+                keyframes = {
+                    hit["_id"]: hit.get("_source", {}).get("text_output")
+                    for hit in hits
+                    if hit.get("_source", {}).get("storage_mode") != STORAGE_DELTA
+                }
+                await self._reconstruct_ui_text(index_name, items, keyframes)
+            self._hide_fields(items, hidden_patterns)
             
             return {
                 "total": total,
+                "total_relation": total_relation,
                 "items": items,
                 "limit": limit,
-                "offset": offset
+                "offset": offset,
+                "next_cursor": next_cursor
             }
             
+        except InvalidCursorError:
+            raise
         except Exception as e:
             logger.error(f"Error querying UI monitoring data: {e}")
             raise
     
-    async def get_ui_monitoring_apps(self, client_id: str = None):
+    async def _paged_search(self,
+                            index_name: str,
+                            query: dict,
+                            sort_order: str,
+                            limit: int,
+                            offset: int = 0,
+                            cursor: str = None,
+                            use_cursor: bool = False,
+                            source: dict = None,
+                            track_total_hits=None,
+                            hidden: list = None):
         """
-        获取所有UI监控的应用名称列表
+        按时间排序分页查询
+        
+        from/size 模式下深分页越来越慢且受 max_result_window 限制；游标模式基于point-in-time
+        和search_after，每一页的代价相同。游标中保存PIT ID、最后一条结果的排序值和查询条件，
+        最后一页之后关闭PIT；客户端放弃翻页时PIT在 ES_CURSOR_KEEP_ALIVE 后自动过期。
         
         Args:
-            client_id: 客户端ID，可选
+            index_name: 索引名称
+            query: 查询条件
+            sort_order: 排序顺序，"asc"或"desc"
+            limit: 每页数量
+            offset: from/size 模式的偏移量
+            cursor: 上一页返回的游标，传入时使用游标中的查询条件和排序
+            use_cursor: 第一页是否使用游标模式
+            source: _source 过滤，可选；游标模式下随游标保存
+            track_total_hits: 总数统计方式，None使用ES默认
+            hidden: 为处理结果额外读取、返回前需要去掉的字段模式，可选；游标模式下随游标保存
             
         Returns:
-            list: 应用名称列表
+            tuple: (hits, total, total_relation, next_cursor, hidden)；不统计总数时total为None，
+                游标模式只在第一页统计总数；没有下一页时next_cursor为None
+            
+        Raises:
+            InvalidCursorError: 游标格式错误或PIT已过期
         """
+        if not cursor and not use_cursor:
+            # 时间范围取整后相同的查询体可以命中分片请求缓存（size > 0 时需要显式开启）
+            body = {
+                "query": query,
+                "sort": [{"timestamp": sort_order}],
+                "from": offset,
+                "size": limit
+            }
+            if source is not None:
+                body["_source"] = source
+            if track_total_hits is not None:
+                body["track_total_hits"] = track_total_hits
+            result = await self.es_client.search(index=index_name, request_cache=True, body=body)
+            return (result["hits"]["hits"], *self._total_hits(result), None, hidden or [])
+        
+        keep_alive = settings.ES_CURSOR_KEEP_ALIVE
+        if cursor:
+            state = decode_cursor(cursor)
+            pit_id, query, sort, source = state["pit"], state["query"], state["sort"], state.get("source")
+            hidden = state.get("hidden")
+            body = {"query": query, "sort": sort, "search_after": state["after"], "track_total_hits": False}
+        else:
+            # _shard_doc 保证排序唯一，翻页时不会遗漏或重复
+            sort = [{"timestamp": sort_order}, {"_shard_doc": sort_order}]
+            pit = await self.es_client.open_point_in_time(index=index_name, keep_alive=keep_alive)
+            pit_id = pit["id"]
+            body = {"query": query, "sort": sort}
+            if track_total_hits is not None:
+                body["track_total_hits"] = track_total_hits
+        if source is not None:
+            body["_source"] = source
+        body["size"] = limit
+        body["pit"] = {"id": pit_id, "keep_alive": keep_alive}
+        
+        try:
+            result = await self.es_client.search(body=body)
+        except NotFoundError as e:
+            if cursor:
+                raise InvalidCursorError(f"Cursor expired, restart from the first page: {e}")
+            raise
+        except Exception:
+            if not cursor:
+                await self._close_pit(pit_id)
+            raise
+        
+        pit_id = result.get("pit_id", pit_id)
+        hits = result["hits"]["hits"]
+        total, total_relation = self._total_hits(result)
+        
+        hidden = hidden or []
+        if len(hits) < limit:
+            await self._close_pit(pit_id)
+            return hits, total, total_relation, None, hidden
+        next_cursor = encode_cursor(pit_id, hits[-1]["sort"], query, sort, source, hidden)
+        return hits, total, total_relation, next_cursor, hidden
+    
+    @staticmethod
+    def _total_hits(result: dict):
+        """提取命中总数及其关系（"eq"精确，"gte"为下限），未统计时都为None"""
+        total = result["hits"].get("total")
+        if not total:
+            return None, None
+        return total["value"], total.get("relation", "eq")
+    
+    async def _close_pit(self, pit_id: str):
+        """关闭point-in-time，失败时只记录日志（PIT会自动过期）"""
         try:
-            # 构建查询
-            query = {"bool": {"must": []}}
+            await self.es_client.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logger.warning(f"Error closing point in time: {e}")
+    
+    @staticmethod
+    def _expand_source(requested: dict, extra_fields) -> tuple:
+        """
+        在 _source 过滤中补充处理结果所需的字段
+        
+        Args:
+            requested: 调用方请求的 _source 过滤
+            extra_fields: 需要额外读取的字段
             
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
+        Returns:
+            tuple: (实际使用的 _source 过滤, 返回前需要去掉的字段模式)
+        """
+        source = {}
+        hidden_patterns = []
+        if requested.get("includes"):
+            source["includes"] = requested["includes"] + [
+                field for field in extra_fields
+                if not any(fnmatchcase(field, pattern) for pattern in requested["includes"])
+            ]
+            hidden_patterns.extend(
+                field for field in extra_fields if not source_filter_selects(requested, field)
+            )
+        excludes = []
+        for pattern in requested.get("excludes", []):
+            if any(fnmatchcase(field, pattern) for field in extra_fields):
+                hidden_patterns.append(pattern)
+            else:
+                excludes.append(pattern)
+        if excludes:
+            source["excludes"] = excludes
+        return source or None, hidden_patterns
+    
+    @staticmethod
+    def _hide_fields(items: list, hidden_patterns: list):
+        """去掉结果中匹配 hidden_patterns 的字段，原地修改"""
+        if not hidden_patterns:
+            return
+        for item in items:
+            for key in [key for key in item if any(fnmatchcase(key, p) for p in hidden_patterns)]:
+                del item[key]
+    
+    async def _resolve_ocr_refs(self, index_name: str, items: list):
+        """
+        为近似重复的OCR文档填充被引用文档的全文
+        
+        近似重复帧只保存 ref_doc_id 和相似度，被引用的文档总是保存全文。
+        
+        Args:
+            index_name: OCR文本索引名称
+            items: 查询结果文档列表，原地修改
+        """
+        refs = {item["ref_doc_id"] for item in items if item.get("ref_doc_id") and item.get("text") is None}
+        if not refs:
+            return
+        response = await self.es_client.mget(index=index_name, ids=sorted(refs), source_includes=["text"])
+        texts = {doc["_id"]: doc["_source"].get("text") for doc in response["docs"] if doc.get("found")}
+        for item in items:
+            if item.get("ref_doc_id") and item.get("text") is None:
+                if item["ref_doc_id"] not in texts:
+                    logger.warning(f"Referenced OCR document {item['ref_doc_id']} not found")
+                item["text"] = texts.get(item["ref_doc_id"])
+    
+    async def _reconstruct_ui_text(self, index_name: str, items: list, keyframes: dict):
+        """
+        为增量存储的UI监控文档重建完整文本
+        
+        Args:
+            index_name: UI监控索引名称
+            items: 查询结果文档列表，原地修改
+            keyframes: 结果中已包含的关键帧，文档ID -> 全文
+        """
+        missing = {
+            item["base_doc_id"] for item in items
+            if item.get("storage_mode") == STORAGE_DELTA and item.get("base_doc_id") not in keyframes
+        }
+        if missing:
+            response = await self.es_client.mget(
+                index=index_name, ids=sorted(missing), source_includes=["text_output"]
+            )
+            for doc in response["docs"]:
+                if doc.get("found"):
+                    keyframes[doc["_id"]] = doc["_source"].get("text_output")
+        
+        for item in items:
+            if item.get("storage_mode") != STORAGE_DELTA:
+                continue
+            base_text = keyframes.get(item.get("base_doc_id"))
+            if base_text is None:
+                # 关键帧尚未写入（如仍在本地缓冲中等待回放）
+                logger.warning(f"Keyframe {item.get('base_doc_id')} not found, cannot reconstruct UI text")
+                item["text_output"] = None
+                continue
+            item["text_output"] = apply_delta(base_text, item.pop("text_delta", {}).get("ops", []))
+    
+    async def _iter_pit_pages(self, index_name: str, body: dict, page_size: int = None):
+        """
+        基于point-in-time和search_after逐页读取
+        
+        Args:
+            index_name: 索引名称
+            body: 查询体（query、sort、_source等），sort中需包含 _shard_doc 以保证排序唯一
+            page_size: 每页文档数，默认 ES_SEARCH_PAGE_SIZE
             
-            # 执行聚合查询
-            index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+        Yields:
+            list: 每页的hits
+        """
+        page_size = page_size or settings.ES_SEARCH_PAGE_SIZE
+        pit = await self.es_client.open_point_in_time(
+            index=index_name, keep_alive=settings.ES_PIT_KEEP_ALIVE
+        )
+        pit_id = pit["id"]
+        search_after = None
+        
+        try:
+            while True:
+                page_body = {
+                    **body,
+                    "size": page_size,
+                    "pit": {"id": pit_id, "keep_alive": settings.ES_PIT_KEEP_ALIVE},
+                    "track_total_hits": False,
+                }
+                if search_after:
+                    page_body["search_after"] = search_after
+                
+                result = await self.es_client.search(body=page_body)
+                pit_id = result.get("pit_id", pit_id)
+                hits = result["hits"]["hits"]
+                
+                if hits:
+                    yield hits
+                
+                if len(hits) < page_size:
+                    break
+                search_after = hits[-1]["sort"]
+        finally:
+            await self._close_pit(pit_id)
+    
+    async def iter_ui_monitoring_columns(self,
+                                         client_id: str = None,
+                                         start_time: datetime = None,
+                                         end_time: datetime = None,
+                                         page_size: int = None):
+        """
+        按时间升序流式读取UI监控事件的时间戳和应用名称（精简模式）
+        
+        不返回 _source，只通过 docvalue_fields 读取 timestamp（epoch_millis）和 app，
+        避免传输和解析 text_output 等大字段，适合使用时间统计。
+        
+        Args:
+            client_id: 客户端ID，可选
+            start_time: 开始时间，可选
+            end_time: 结束时间，可选
+            page_size: 每页文档数，默认 ES_SEARCH_PAGE_SIZE
             
+        Yields:
+            tuple: 每页的 (毫秒时间戳列表, 应用名称列表)
+        """
+        body = {
+            "query": build_filter_query({"client_id": client_id}, start_time, end_time, round_time=False),
+            "sort": [{"timestamp": "asc"}, {"monitoring_id": "asc"}, {"_shard_doc": "asc"}],
+            "_source": False,
+            "docvalue_fields": [{"field": "timestamp", "format": "epoch_millis"}, {"field": "app"}],
+        }
+        
+        index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+        async for hits in self._iter_pit_pages(index_name, body, page_size):
+            timestamps = []
+            apps = []
+            for hit in hits:
+                fields = hit.get("fields", {})
+                timestamps.append(int(float(fields["timestamp"][0])))
+                apps.append(fields.get("app", [""])[0])
+            yield timestamps, apps
+    
+    async def get_ui_monitoring_event_before(self,
+                                             client_id: str,
+                                             before: datetime,
+                                             not_before: datetime = None):
+        """
+        获取客户端在指定时间之前的最后一个UI监控事件
+        
+        重算从整点开始读取事件时，用于补上从上一个事件延续到该小时的区间。
+        
+        Args:
+            client_id: 客户端ID
+            before: 时间上限（不包含）
+            not_before: 时间下限（包含），可选
+            
+        Returns:
+            Optional[tuple]: (毫秒时间戳, 应用名称)，没有事件时为None
+        """
+        query = build_filter_query({"client_id": client_id})
+        time_range = {"lt": before.isoformat()}
+        if not_before is not None:
+            time_range["gte"] = not_before.isoformat()
+        query["bool"]["filter"].append({"range": {"timestamp": time_range}})
+        
+        result = await self.es_client.search(
+            index=f"{settings.ES_INDEX_PREFIX}-ui-monitoring",
+            body={
+                "query": query,
+                "sort": [{"timestamp": "desc"}, {"monitoring_id": "desc"}],
+                "size": 1,
+                "_source": False,
+                "docvalue_fields": [{"field": "timestamp", "format": "epoch_millis"}, {"field": "app"}],
+            },
+        )
+        hits = result["hits"]["hits"]
+        if not hits:
+            return None
+        fields = hits[0].get("fields", {})
+        return int(float(fields["timestamp"][0])), fields.get("app", [""])[0]
+    
+    async def _composite_page(self,
+                              index_name: str,
+                              query: dict,
+                              sources: list,
+                              aggs: dict = None,
+                              page_size: int = None,
+                              after_key: dict = None):
+        """
+        读取composite聚合的一页桶
+        
+        Args:
+            index_name: 索引名称
+            query: 查询条件
+            sources: composite聚合的sources
+            aggs: 每个桶的子聚合，可选
+            page_size: 每页桶数，默认 ES_COMPOSITE_PAGE_SIZE
+            after_key: 上一页的after_key，可选
+            
+        Returns:
+            tuple: (本页buckets, 下一页的after_key)，没有更多桶时after_key为None
+        """
+        page_size = page_size or settings.ES_COMPOSITE_PAGE_SIZE
+        composite = {"size": page_size, "sources": sources}
+        if after_key:
+            composite["after"] = after_key
+        paged = {"composite": composite}
+        if aggs:
+            paged["aggs"] = aggs
+        
+        result = await self.es_client.search(
+            index=index_name,
+            body={"query": query, "aggs": {"paged": paged}, "size": 0, "track_total_hits": False},
+        )
+        agg = result.get("aggregations", {}).get("paged", {})
+        buckets = agg.get("buckets", [])
+        
+        next_after_key = agg.get("after_key")
+        if len(buckets) < page_size:
+            next_after_key = None
+        return buckets, next_after_key
+    
+    async def _iter_composite_buckets(self,
+                                      index_name: str,
+                                      query: dict,
+                                      sources: list,
+                                      aggs: dict = None,
+                                      page_size: int = None):
+        """
+        基于composite聚合和after_key逐页读取所有桶，桶数量不受terms聚合size的限制
+        
+        Args:
+            index_name: 索引名称
+            query: 查询条件
+            sources: composite聚合的sources
+            aggs: 每个桶的子聚合，可选
+            page_size: 每页桶数，默认 ES_COMPOSITE_PAGE_SIZE
+            
+        Yields:
+            list: 每页的buckets
+        """
+        after_key = None
+        
+        while True:
+            buckets, after_key = await self._composite_page(index_name, query, sources, aggs, page_size, after_key)
+            
+            if buckets:
+                yield buckets
+            
+            if not after_key:
+                break
+    
+    async def iter_ui_monitoring_client_latest(self,
+                                               start_time: datetime = None,
+                                               end_time: datetime = None,
+                                               client_id: str = None,
+                                               page_size: int = None,
+                                               client_ids: list = None):
+        """
+        流式列出时间范围内有UI监控事件的客户端及其最新事件
+        
+        使用composite聚合按 client_id 分页，客户端数量没有上限。
+        
+        Args:
+            start_time: 开始时间，可选
+            end_time: 结束时间，可选
+            client_id: 客户端ID，可选
+            page_size: 每页客户端数，默认 ES_COMPOSITE_PAGE_SIZE
+            client_ids: 只在这些客户端中查找，可选
+            
+        Yields:
+            tuple: (客户端ID, (最新事件的毫秒时间戳, 最新事件的monitoring_id))
+        """
+        query = build_filter_query(
+            {"client_id": client_id or client_ids}, start_time, end_time, round_time=False
+        )
+        sources = [{"client_id": {"terms": {"field": "client_id"}}}]
+        # 时间戳相同时按monitoring_id区分最新事件
+        aggs = {
+            "latest": {
+                "top_hits": {
+                    "size": 1,
+                    "sort": [{"timestamp": "desc"}, {"monitoring_id": "desc"}],
+                    "_source": False,
+                }
+            }
+        }
+        
+        index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+        async for buckets in self._iter_composite_buckets(index_name, query, sources, aggs, page_size):
+            for bucket in buckets:
+                hit = bucket["latest"]["hits"]["hits"][0]
+                yield bucket["key"]["client_id"], (int(hit["sort"][0]), int(hit["sort"][1]))
+    
+    async def _get_facet(self, index_name: str, field: str, client_id: str = None,
+                         app_field: str = None, app: str = None):
+        """
+        获取字段的筛选项（terms聚合），结果由 facet_cache 缓存
+        
+        Args:
+            index_name: 索引名称
+            field: 聚合字段
+            client_id: 客户端ID，可选
+            app_field: 应用名称字段，按应用过滤时使用
+            app: 应用名称，可选
+            
+        Returns:
+            list: 筛选项列表
+        """
+        async def load():
+            terms = {"client_id": client_id}
+            if app_field:
+                terms[app_field] = app
+            query = build_filter_query(terms)
             result = await self.es_client.search(
                 index=index_name,
+                request_cache=True,
                 body={
                     "query": query,
                     "size": 0,
                     "aggs": {
-                        "apps": {
+                        "facet": {
                             "terms": {
-                                "field": "app",
+                                "field": field,
                                 "size": 1000
                             }
                         }
                     }
                 }
             )
+            return [bucket["key"] for bucket in result["aggregations"]["facet"]["buckets"]]
+        
+        return await facet_cache.get(index_name, field, client_id, app, load)
+    
+    async def _get_facet_page(self, index_name: str, field: str, client_id: str = None,
+                              app_field: str = None, app: str = None, prefix: str = None,
+                              after: str = None, size: int = 100):
+        """
+        分页获取字段的筛选项及文档数（composite聚合），按取值排序
+        
+        每页只返回 size 个桶，取值数量不受 terms 聚合 size 的限制。
+        
+        Args:
+            index_name: 索引名称
+            field: 聚合字段
+            client_id: 客户端ID，可选
+            app_field: 应用名称字段，按应用过滤时使用
+            app: 应用名称，可选
+            prefix: 取值前缀（不区分大小写），可选
+            after: 上一页返回的 next_after，可选
+            size: 每页数量
             
-            # 处理结果
-            apps = [bucket["key"] for bucket in result["aggregations"]["apps"]["buckets"]]
+        Returns:
+            dict: items 为 {"value", "count"} 列表，next_after 为下一页游标，没有更多时为None
             
-            return apps
+        Raises:
+            InvalidCursorError: after 格式错误或与当前请求的字段和过滤条件不一致
+        """
+        # 游标只能用于生成它的字段和过滤条件
+        scope = {
+            "index": index_name, "field": field, "client_id": client_id or None,
+            "app": (app or None) if app_field else None, "prefix": prefix or None,
+        }
+        after_key = decode_after_key(after, scope) if after else None
+        
+        terms = {"client_id": client_id}
+        if app_field:
+            terms[app_field] = app
+        query = build_filter_query(terms)
+        if prefix:
+            query["bool"]["filter"].append({"prefix": {field: {"value": prefix, "case_insensitive": True}}})
+        
+        buckets, next_after_key = await self._composite_page(
+            index_name, query, [{"value": {"terms": {"field": field}}}], page_size=size, after_key=after_key
+        )
+        return {
+            "items": [{"value": bucket["key"]["value"], "count": bucket["doc_count"]} for bucket in buckets],
+            "next_after": encode_after_key(next_after_key, scope) if next_after_key else None
+        }
+    
+    async def get_ui_monitoring_apps(self, client_id: str = None):
+        """
+        获取所有UI监控的应用名称列表
+        
+        Args:
+            client_id: 客户端ID，可选
+            
+        Returns:
+            list: 应用名称列表
+        """
+        try:
+            index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+            return await self._get_facet(index_name, "app", client_id)
             
         except Exception as e:
             logger.error(f"Error querying UI monitoring apps: {e}")
@@ -148,43 +659,67 @@ class QueryService:
             list: 窗口名称列表
         """
         try:
-            # 构建查询
-            query = {"bool": {"must": []}}
-            
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
+            index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+            return await self._get_facet(index_name, "window", client_id, "app", app)
             
-            # 添加应用名称过滤
-            if app:
-                query["bool"]["must"].append({"term": {"app": app}})
+        except Exception as e:
+            logger.error(f"Error querying UI monitoring windows: {e}")
+            raise
+
+    async def get_ui_monitoring_apps_page(self,
+                                          client_id: str = None,
+                                          prefix: str = None,
+                                          after: str = None,
+                                          size: int = 100):
+        """
+        分页获取UI监控的应用名称及文档数，适用于数量超过 get_ui_monitoring_apps 上限的情况
+        
+        Args:
+            client_id: 客户端ID，可选
+            prefix: 名称前缀（不区分大小写），可选
+            after: 上一页返回的 next_after，可选
+            size: 每页数量，默认100
             
-            # 执行聚合查询
+        Returns:
+            dict: 包含 items（value、count）和 next_after 的字典
+        """
+        try:
             index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+            return await self._get_facet_page(index_name, "app", client_id, prefix=prefix, after=after, size=size)
             
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "size": 0,
-                    "aggs": {
-                        "windows": {
-                            "terms": {
-                                "field": "window",
-                                "size": 1000
-                            }
-                        }
-                    }
-                }
-            )
-            
-            # 处理结果
-            windows = [bucket["key"] for bucket in result["aggregations"]["windows"]["buckets"]]
+        except InvalidCursorError:
+            raise
+        except Exception as e:
+            logger.error(f"Error querying UI monitoring apps page: {e}")
+            raise
+
+    async def get_ui_monitoring_windows_page(self,
+                                             client_id: str = None,
+                                             app: str = None,
+                                             prefix: str = None,
+                                             after: str = None,
+                                             size: int = 100):
+        """
+        分页获取UI监控的窗口名称及文档数，适用于数量超过 get_ui_monitoring_windows 上限的情况
+        
+        Args:
+            client_id: 客户端ID，可选
+            app: 应用名称，可选
+            prefix: 名称前缀（不区分大小写），可选
+            after: 上一页返回的 next_after，可选
+            size: 每页数量，默认100
             
-            return windows
+        Returns:
+            dict: 包含 items（value、count）和 next_after 的字典
+        """
+        try:
+            index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+            return await self._get_facet_page(index_name, "window", client_id, "app", app, prefix, after, size)
             
+        except InvalidCursorError:
+            raise
         except Exception as e:
-            logger.error(f"Error querying UI monitoring windows: {e}")
+            logger.error(f"Error querying UI monitoring windows page: {e}")
             raise
 
     async def get_ocr_text_by_time(self, 
@@ -196,13 +731,20 @@ class QueryService:
                                   focused: bool = None,
                                   limit: int = 100,
                                   offset: int = 0,
-                                  sort_order: str = "desc"):
+                                  sort_order: str = "desc",
+                                  cursor: str = None,
+                                  use_cursor: bool = False,
+                                  fields: list = None,
+                                  exclude: list = None,
+                                  track_total_hits=None):
         """
         按时间顺序获取OCR文本数据
         
+        默认使用 from/size 分页；use_cursor 为True或传入cursor时使用游标分页（见 _paged_search）。
+        
         Args:
             client_id: 客户端ID，可选
-            start_time: 开始时间，可选
+            start_time: 开始时间，可选（文本在屏幕上的区间与时间范围重叠即返回）
             end_time: 结束时间，可选
             app_name: 应用名称，可选
             window_name: 窗口名称，可选
@@ -210,63 +752,64 @@ class QueryService:
             limit: 返回结果数量限制，默认100
             offset: 分页偏移量，默认0
             sort_order: 排序顺序，"asc"或"desc"，默认"desc"
+            cursor: 上一页返回的 next_cursor，传入时忽略其他过滤、排序和字段参数
+            use_cursor: 第一页是否使用游标分页
+            fields: 只返回的字段，可选
+            exclude: 不返回的字段，可选
+            track_total_hits: 总数统计，True精确、False不统计、整数N最多统计到N，None使用ES默认
             
         Returns:
-            dict: 包含OCR文本数据的字典
+            dict: 包含OCR文本数据的字典，游标分页时 next_cursor 为下一页游标；
+                total_relation 为 "gte" 时 total 只是下限
         """
         try:
-            # 构建查询
-            query = {"bool": {"must": []}}
-            
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
-            
-            # 添加时间范围过滤
-            if start_time or end_time:
-                time_range = {}
-                if start_time:
-                    time_range["gte"] = start_time.isoformat()
-                if end_time:
-                    time_range["lte"] = end_time.isoformat()
-                query["bool"]["must"].append({"range": {"timestamp": time_range}})
-            
-            # 添加应用名称过滤
-            if app_name:
-                query["bool"]["must"].append({"term": {"app_name": app_name}})
-            
-            # 添加窗口名称过滤
-            if window_name:
-                query["bool"]["must"].append({"term": {"window_name": window_name}})
-            
-            # 添加聚焦状态过滤
-            if focused is not None:
-                query["bool"]["must"].append({"term": {"focused": focused}})
+            # 构建查询（过滤上下文，时间范围按 QUERY_TIME_ROUNDING 取整）
+            # 重复帧合并后一条文档覆盖 [timestamp, last_seen_at]，按区间与时间范围重叠匹配
+            query = build_filter_query(
+                {
+                    "client_id": client_id,
+                    "app_name": app_name,
+                    "window_name": window_name,
+                    "focused": focused,
+                },
+                start_time,
+                end_time,
+                end_field="last_seen_at",
+            )
+            
+            # 近似重复帧只保存 ref_doc_id，返回文本时需要同时读取引用，读取后再去掉未请求的字段
+            source = build_source_filter(fields, exclude)
+            hidden_patterns = []
+            if source and source_filter_selects(source, "text"):
+                source, hidden_patterns = self._expand_source(source, ["ref_doc_id"])
             
             # 执行查询
             index_name = f"{settings.ES_INDEX_PREFIX}-ocr-text"
             
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "sort": [{"timestamp": sort_order}],
-                    "from": offset,
-                    "size": limit
-                }
+            hits, total, total_relation, next_cursor, hidden_patterns = await self._paged_search(
+                index_name, query, sort_order, limit, offset, cursor, use_cursor, source, track_total_hits,
+                hidden_patterns
             )
             
             # 处理结果
-            total = result["hits"]["total"]["value"]
-            items = [hit["_source"] for hit in result["hits"]["hits"]]
+            items = [hit.get("_source", {}) for hit in hits]
+            if cursor:
+                source = decode_cursor(cursor).get("source")
+            if source is None or source_filter_selects(source, "text"):
+                await self._resolve_ocr_refs(index_name, items)
+            self._hide_fields(items, hidden_patterns)
             
             return {
                 "total": total,
+                "total_relation": total_relation,
                 "items": items,
                 "limit": limit,
-                "offset": offset
+                "offset": offset,
+                "next_cursor": next_cursor
             }
             
+        except InvalidCursorError:
+            raise
         except Exception as e:
             logger.error(f"Error querying OCR text data: {e}")
             raise
@@ -282,36 +825,8 @@ class QueryService:
             list: 应用名称列表
         """
         try:
-            # 构建查询
-            query = {"bool": {"must": []}}
-            
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
-            
-            # 执行聚合查询
             index_name = f"{settings.ES_INDEX_PREFIX}-ocr-text"
-            
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "size": 0,
-                    "aggs": {
-                        "apps": {
-                            "terms": {
-                                "field": "app_name",
-                                "size": 1000
-                            }
-                        }
-                    }
-                }
-            )
-            
-            # 处理结果
-            apps = [bucket["key"] for bucket in result["aggregations"]["apps"]["buckets"]]
-            
-            return apps
+            return await self._get_facet(index_name, "app_name", client_id)
             
         except Exception as e:
             logger.error(f"Error querying OCR text apps: {e}")
@@ -329,41 +844,65 @@ class QueryService:
             list: 窗口名称列表
         """
         try:
-            # 构建查询
-            query = {"bool": {"must": []}}
-            
-            # 添加客户端ID过滤
-            if client_id:
-                query["bool"]["must"].append({"term": {"client_id": client_id}})
+            index_name = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+            return await self._get_facet(index_name, "window_name", client_id, "app_name", app_name)
             
-            # 添加应用名称过滤
-            if app_name:
-                query["bool"]["must"].append({"term": {"app_name": app_name}})
+        except Exception as e:
+            logger.error(f"Error querying OCR text windows: {e}")
+            raise
+
+    async def get_ocr_text_apps_page(self,
+                                     client_id: str = None,
+                                     prefix: str = None,
+                                     after: str = None,
+                                     size: int = 100):
+        """
+        分页获取OCR文本的应用名称及文档数，适用于数量超过 get_ocr_text_apps 上限的情况
+        
+        Args:
+            client_id: 客户端ID，可选
+            prefix: 名称前缀（不区分大小写），可选
+            after: 上一页返回的 next_after，可选
+            size: 每页数量，默认100
             
-            # 执行聚合查询
+        Returns:
+            dict: 包含 items（value、count）和 next_after 的字典
+        """
+        try:
             index_name = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+            return await self._get_facet_page(index_name, "app_name", client_id, prefix=prefix, after=after, size=size)
             
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "size": 0,
-                    "aggs": {
-                        "windows": {
-                            "terms": {
-                                "field": "window_name",
-                                "size": 1000
-                            }
-                        }
-                    }
-                }
-            )
-            
-            # 处理结果
-            windows = [bucket["key"] for bucket in result["aggregations"]["windows"]["buckets"]]
+        except InvalidCursorError:
+            raise
+        except Exception as e:
+            logger.error(f"Error querying OCR text apps page: {e}")
+            raise
+
+    async def get_ocr_text_windows_page(self,
+                                        client_id: str = None,
+                                        app_name: str = None,
+                                        prefix: str = None,
+                                        after: str = None,
+                                        size: int = 100):
+        """
+        分页获取OCR文本的窗口名称及文档数，适用于数量超过 get_ocr_text_windows 上限的情况
+        
+        Args:
+            client_id: 客户端ID，可选
+            app_name: 应用名称，可选
+            prefix: 名称前缀（不区分大小写），可选
+            after: 上一页返回的 next_after，可选
+            size: 每页数量，默认100
             
-            return windows
+        Returns:
+            dict: 包含 items（value、count）和 next_after 的字典
+        """
+        try:
+            index_name = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+            return await self._get_facet_page(index_name, "window_name", client_id, "app_name", app_name, prefix, after, size)
             
+        except InvalidCursorError:
+            raise
         except Exception as e:
-            logger.error(f"Error querying OCR text windows: {e}")
+            logger.error(f"Error querying OCR text windows page: {e}")
             raise 
\ No newline at end of file
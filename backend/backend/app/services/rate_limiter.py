@@ -0,0 +1,162 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..core.config import settings
+from .ingest_service import ingest_service
+
+
+class RateLimitExceededError(Exception):
+    """请求超过了客户端限速或全局在途预算"""
+
+    def __init__(self, message: str, retry_after: int, scope: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.scope = scope  # client / global
+
+
+class TokenBucket:
+    """单个客户端的令牌桶"""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class IngestRateLimiter:
+    """
+    摄取限速
+
+    每个客户端一个令牌桶（按 clientId，桶数量受LRU上限约束），防止单个客户端占满写入能力；
+    另有全局在途预算：队列中尚未写入ES的报告数超过预算时拒绝所有新报告，
+    并根据近期写入吞吐估算 Retry-After。
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_clients: Optional[int] = None,
+        ingest=None,
+    ):
+        self.rate = rate or settings.INGEST_RATE_LIMIT_PER_CLIENT
+        self.burst = burst or settings.INGEST_RATE_LIMIT_BURST
+        self.max_clients = max_clients or settings.INGEST_RATE_LIMIT_MAX_CLIENTS
+        self.ingest = ingest or ingest_service
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+        # 统计信息
+        self.client_rejections = 0
+        self.global_rejections = 0
+
+    def check_global(self):
+        """
+        检查全局在途预算
+
+        Raises:
+            RateLimitExceededError: 在途报告数超过预算
+        """
+        if not settings.INGEST_RATE_LIMIT_ENABLED:
+            return
+
+        in_flight = self.ingest.in_flight
+        budget = settings.INGEST_GLOBAL_INFLIGHT_MAX
+        if in_flight < budget:
+            return
+
+        drain_seconds = self.ingest.estimate_drain_seconds(in_flight - budget // 2)
+        retry_after = settings.INGEST_RATE_LIMIT_DEFAULT_RETRY if drain_seconds is None else drain_seconds
+        self.global_rejections += 1
+        raise RateLimitExceededError(
+            f"Ingest is busy ({in_flight} reports in flight)",
+            retry_after=min(settings.INGEST_UPLOAD_INTERVAL_MAX, max(1, math.ceil(retry_after))),
+            scope="global",
+        )
+
+    def acquire(self, client_id: str, cost: float = 1.0):
+        """
+        为一个报告申请写入配额
+
+        Args:
+            client_id: 客户端ID
+            cost: 消耗的令牌数，默认每个报告1个
+
+        Raises:
+            RateLimitExceededError: 超过全局预算或客户端限速
+        """
+        if not settings.INGEST_RATE_LIMIT_ENABLED:
+            return
+
+        self.check_global()
+
+        now = time.monotonic()
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[client_id] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+            bucket.updated_at = now
+        self._buckets.move_to_end(client_id)
+
+        if bucket.tokens < cost:
+            self.client_rejections += 1
+            raise RateLimitExceededError(
+                f"Rate limit exceeded for client {client_id}",
+                retry_after=max(1, math.ceil((cost - bucket.tokens) / self.rate)),
+                scope="client",
+            )
+        bucket.tokens -= cost
+
+    def refund(self, client_id: str, cost: float = 1.0):
+        """
+        退还 acquire 申请到的配额，用于报告在入队前被拒绝（队列已满、服务正在关闭）的情况
+
+        Args:
+            client_id: 客户端ID
+            cost: 退还的令牌数，应与 acquire 时相同
+        """
+        if not settings.INGEST_RATE_LIMIT_ENABLED:
+            return
+
+        bucket = self._buckets.get(client_id)
+        if bucket is not None:
+            bucket.tokens = min(self.burst, bucket.tokens + cost)
+
+    def next_upload_interval(self) -> int:
+        """
+        根据当前写入压力建议客户端下次上报的间隔
+
+        在途报告数低于预算一半时返回基础间隔，之后随压力线性增加到上限；ES不可用时直接返回上限。
+
+        Returns:
+            int: 建议的上报间隔（秒）
+        """
+        base = settings.INGEST_UPLOAD_INTERVAL
+        maximum = settings.INGEST_UPLOAD_INTERVAL_MAX
+        if not self.ingest.es_available:
+            return maximum
+
+        pressure = self.ingest.in_flight / max(1, settings.INGEST_GLOBAL_INFLIGHT_MAX)
+        if pressure <= 0.5:
+            return base
+        return int(min(maximum, base + (maximum - base) * (pressure - 0.5) * 2))
+
+    def get_stats(self):
+        """获取限速统计信息"""
+        return {
+            "enabled": settings.INGEST_RATE_LIMIT_ENABLED,
+            "tracked_clients": len(self._buckets),
+            "client_rejections": self.client_rejections,
+            "global_rejections": self.global_rejections,
+            "next_upload_interval": self.next_upload_interval(),
+        }
+
+
+# 创建全局限速实例
+ingest_rate_limiter = IngestRateLimiter()
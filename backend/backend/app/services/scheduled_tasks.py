@@ -6,16 +6,21 @@ from ..core.config import settings
 from ..db.elasticsearch import get_es_client
 from ..db.mysql import AsyncSessionLocal
 from ..services.usage_analysis_service import UsageAnalysisService
+from ..services.usage_aggregation import usage_aggregator
 
 logger = logging.getLogger(__name__)
 
 
-async def recalculate_hourly_app_usage_statistics(hours_back: int = 24):
+async def recalculate_hourly_app_usage_statistics(
+    hours_back: int = 24, use_watermark: bool = True, until: datetime = None
+):
     """
     重新计算小时应用使用统计
 
     Args:
         hours_back: 重新计算多少小时前的数据
+        use_watermark: 是否按客户端水位增量重算
+        until: 只替换该整点（UTC）之前的小时，可选
     """
     try:
         # 使用异步上下文管理器获取数据库会话
@@ -28,7 +33,9 @@ async def recalculate_hourly_app_usage_statistics(hours_back: int = 24):
                 usage_analysis_service = UsageAnalysisService(db, es_client)
 
                 # 重新计算小时统计
-                await usage_analysis_service.recalculate_hourly_statistics(hours_back)
+                await usage_analysis_service.recalculate_hourly_statistics(
+                    hours_back, use_watermark=use_watermark, until=until
+                )
 
                 logger.info(
                     f"Completed recalculating hourly app usage statistics from the past {hours_back} hours"
@@ -46,17 +53,50 @@ async def recalculate_hourly_app_usage_statistics(hours_back: int = 24):
         )
 
 
+async def repair_hourly_app_usage_statistics(hours_back: int):
+    """
+    从ES修复摄取时增量统计的最近几个小时
+
+    当前小时之前的小时先交给修复任务（增量统计写入已累加的增量，之后不再写入这些小时），
+    再从ES重算并替换这些小时；当前小时仍只由增量统计写入，两者不会重复计入同一批事件。
+
+    Args:
+        hours_back: 重新计算多少小时前的数据
+    """
+    until = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    await usage_aggregator.hand_over(until)
+    await recalculate_hourly_app_usage_statistics(hours_back=hours_back, use_watermark=False, until=until)
+
+
 async def schedule_tasks():
     """
     调度定时任务
+
+    启用摄取时增量统计（USAGE_INGEST_AGGREGATION_ENABLED）后，小时统计在报告写入时累加，
+    这里只按 USAGE_REPAIR_INTERVAL 低频从ES重算最近几个小时，修复乱序回放、服务重启等未计入的数据；
+    未启用时保持每分钟重算最近一小时。
     """
     while True:
+        if settings.USAGE_INGEST_AGGREGATION_ENABLED:
+            interval = settings.USAGE_REPAIR_INTERVAL
+            hours_back = settings.USAGE_REPAIR_HOURS_BACK
+            if interval <= 0:
+                logger.info("小时应用使用统计修复任务已禁用")
+                return
+        else:
+            interval = 60
+            hours_back = 1
+
         try:
             logger.info("开始执行定时任务")
 
             # 重新计算小时应用使用统计
-            # 这个任务会从ES中获取原始数据并重新计算统计信息
-            await recalculate_hourly_app_usage_statistics(hours_back=1)
+            # 这个任务会从ES中获取原始数据并重新计算统计信息；
+            # 修复模式下重算整个窗口以纳入迟到的数据，否则只处理水位之后的新事件
+            if settings.USAGE_INGEST_AGGREGATION_ENABLED:
+                await repair_hourly_app_usage_statistics(hours_back)
+            else:
+                await recalculate_hourly_app_usage_statistics(hours_back=hours_back, use_watermark=True)
 
             logger.info("定时任务执行完成")
 
@@ -65,4 +105,4 @@ async def schedule_tasks():
             # 这里可以添加错误通知逻辑
 
         # 等待一段时间后再次执行
-        await asyncio.sleep(60)  # 60秒 = 1分钟
+        await asyncio.sleep(interval)
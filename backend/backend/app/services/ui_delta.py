@@ -0,0 +1,142 @@
+import difflib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import settings
+
+# 文档存储模式
+STORAGE_FULL = "full"
+STORAGE_KEYFRAME = "keyframe"
+STORAGE_DELTA = "delta"
+
+# 从增量存储的文档重建完整文本需要的字段
+DELTA_FIELDS = ("storage_mode", "base_doc_id", "text_delta")
+
+
+def diff_lines(base_lines: List[str], lines: List[str]) -> List[List[Any]]:
+    """
+    计算行级差异
+
+    Args:
+        base_lines: 关键帧文本行
+        lines: 当前文本行
+
+    Returns:
+        List[List[Any]]: 操作列表，每项为 [起始行, 结束行, 替换内容]，表示将关键帧中该区间替换为新内容
+    """
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    return [
+        [i1, i2, lines[j1:j2]]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_delta(base_text: str, ops: List[List[Any]]) -> str:
+    """
+    将行级差异应用到关键帧文本上
+
+    Args:
+        base_text: 关键帧全文
+        ops: diff_lines 生成的操作列表
+
+    Returns:
+        str: 重建后的全文
+    """
+    base_lines = base_text.split("\n")
+    result = []
+    position = 0
+    for start, end, replacement in ops:
+        result.extend(base_lines[position:start])
+        result.extend(replacement)
+        position = end
+    result.extend(base_lines[position:])
+    return "\n".join(result)
+
+
+class UiDeltaEncoder:
+    """
+    UI监控文本的增量编码
+
+    按 (客户端, 应用, 窗口) 记录最近的关键帧，之后的事件只保存相对关键帧的行级差异；
+    差异过大或连续差异数达到上限时重新写入关键帧，保证任何一条文档最多依赖一个关键帧即可重建。
+    缓存的关键帧按数量和文本总字节数两个上限淘汰最久未使用的条目。
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        keyframe_interval: Optional[int] = None,
+        max_delta_ratio: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.max_entries = max_entries or settings.UI_DELTA_CACHE_SIZE
+        self.max_bytes = max_bytes or settings.UI_DELTA_CACHE_MAX_BYTES
+        self.keyframe_interval = keyframe_interval or settings.UI_DELTA_KEYFRAME_INTERVAL
+        self.max_delta_ratio = max_delta_ratio if max_delta_ratio is not None else settings.UI_DELTA_MAX_RATIO
+        # (客户端, 应用, 窗口) -> [关键帧文档ID, 关键帧文本行, 之后的差异数, 关键帧文本字节数]
+        self._keyframes: "OrderedDict[Tuple[str, str, str], List[Any]]" = OrderedDict()
+        self._keyframe_bytes = 0
+        # 已编码过的文档ID，数量上限与关键帧缓存相同
+        self._issued: "OrderedDict[str, None]" = OrderedDict()
+
+        # 统计信息
+        self.keyframes = 0
+        self.deltas = 0
+
+    def encode(
+        self, client_id: str, app: str, window: str, text: str, doc_id: str
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        决定当前事件以关键帧还是差异保存
+
+        Args:
+            client_id: 客户端ID
+            app: 应用名称
+            window: 窗口名称
+            text: 当前事件的完整文本
+            doc_id: 当前事件的文档ID
+
+        Returns:
+            Tuple[str, Optional[Dict[str, Any]]]: (存储模式, 差异字段)，关键帧时差异字段为None
+        """
+        # 同一事件重复构建（客户端重试、本地缓冲回放）时以完整文本保存且不改变编码状态：
+        # 文档已写入时重复的create返回409被忽略，未写入时完整文本不依赖任何关键帧
+        if doc_id in self._issued:
+            self._issued.move_to_end(doc_id)
+            self.keyframes += 1
+            return STORAGE_KEYFRAME, None
+        self._issued[doc_id] = None
+        if len(self._issued) > self.max_entries:
+            self._issued.popitem(last=False)
+
+        key = (client_id, app, window)
+        lines = text.split("\n")
+        entry = self._keyframes.get(key)
+
+        if entry and entry[2] < self.keyframe_interval:
+            ops = diff_lines(entry[1], lines)
+            changed = sum(len(line) for _, _, replacement in ops for line in replacement)
+            if changed <= len(text) * self.max_delta_ratio:
+                entry[2] += 1
+                self._keyframes.move_to_end(key)
+                self.deltas += 1
+                return STORAGE_DELTA, {"base_doc_id": entry[0], "text_delta": {"ops": ops}}
+
+        size = len(text.encode("utf-8"))
+        if entry:
+            self._keyframe_bytes -= entry[3]
+        self._keyframes[key] = [doc_id, lines, 0, size]
+        self._keyframes.move_to_end(key)
+        self._keyframe_bytes += size
+        while self._keyframes and (
+            len(self._keyframes) > self.max_entries or self._keyframe_bytes > self.max_bytes
+        ):
+            _, evicted = self._keyframes.popitem(last=False)
+            self._keyframe_bytes -= evicted[3]
+        self.keyframes += 1
+        return STORAGE_KEYFRAME, None
+
+
+# 创建全局编码器实例
+ui_delta_encoder = UiDeltaEncoder()
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..core.config import settings
+from ..db.mysql import AsyncSessionLocal
+from ..models.data import DataReport
+from .usage_analysis_service import UsageAnalysisService
+from .usage_engine import HourlyUsageEngine, to_epoch_ms
+
+logger = logging.getLogger(__name__)
+
+
+class HourlyUsageAccumulator:
+    """
+    小时应用使用时间的增量累加器
+
+    每个客户端一个 HourlyUsageEngine，计算规则与修复任务的全量重算一致：相邻事件的时间差计入前一个应用，
+    按小时边界切分，锁屏和空闲间隔不计时。每个客户端的最后一个事件作为未结束区间保留，
+    在下一批事件到达时结算。
+
+    超过空闲阈值没有新事件的客户端（此后到达的事件与未结束区间的间隔必然超过阈值，不再计时）
+    在 drain() 时移除其引擎；客户端数超过 USAGE_ACCUMULATOR_MAX_CLIENTS 时移除最久未上报的客户端。
+    移除前已结算的增量保留到下次写入，之后到达的重复事件不再被跳过，由修复任务纠正。
+    """
+
+    def __init__(self, idle_gap_seconds: Optional[float] = None, max_clients: Optional[int] = None):
+        self.idle_gap_seconds = settings.USAGE_IDLE_GAP_SECONDS if idle_gap_seconds is None else idle_gap_seconds
+        self.max_clients = max_clients or settings.USAGE_ACCUMULATOR_MAX_CLIENTS
+        # 客户端ID -> (引擎, 最近送入事件的时间)，按最近送入事件的时间排序
+        self._engines: "OrderedDict[str, Tuple[HourlyUsageEngine, float]]" = OrderedDict()
+        # (客户端ID, 小时时间戳, 应用名称) -> [使用秒数, 切换次数]，写入失败后放回的增量
+        self._restored: Dict[Tuple[str, datetime, str], List[float]] = {}
+
+        # 统计信息
+        self.events_applied = 0
+        self.events_skipped = 0
+        self.engines_evicted = 0
+
+    def add_events(self, client_id: str, events: Iterable[Tuple[int, str]]):
+        """
+        累加一个客户端的UI事件
+
+        早于或等于该客户端已处理的最后事件时间的事件（重复上报、乱序回放）会被跳过，由修复任务补算。
+
+        Args:
+            client_id: 客户端ID
+            events: (毫秒时间戳（UTC）, 应用名称) 列表
+        """
+        entry = self._engines.get(client_id)
+        if entry is None:
+            engine = HourlyUsageEngine(self.idle_gap_seconds)
+        else:
+            engine = entry[0]
+            self._engines.move_to_end(client_id)
+        self._engines[client_id] = (engine, time.monotonic())
+        while len(self._engines) > self.max_clients:
+            self._evict(next(iter(self._engines)))
+
+        events = list(events)
+        last_ms = engine.last_timestamp_ms
+        fresh = sorted(
+            (event for event in events if last_ms is None or event[0] > last_ms),
+            key=lambda event: event[0],
+        )
+        self.events_skipped += len(events) - len(fresh)
+        if fresh:
+            engine.feed([event[0] for event in fresh], [event[1] for event in fresh])
+            self.events_applied += len(fresh)
+
+    def add_report(self, report: DataReport):
+        """累加一个报告中的UI监控事件"""
+        self.add_events(
+            report.clientId,
+            [(to_epoch_ms(item.timestamp), item.app) for item in report.data.uiMonitoring],
+        )
+
+    def _evict(self, client_id: str):
+        """移除客户端的引擎，已结算的增量保留到下次写入"""
+        engine, _ = self._engines.pop(client_id)
+        self.restore({
+            (client_id, hour, app_name): [seconds, switches]
+            for hour, app_name, seconds, switches in engine.drain()
+        })
+        self.engines_evicted += 1
+
+    def drain(self) -> Dict[Tuple[str, datetime, str], List[float]]:
+        """取出并清空待写入的增量，移除空闲超过阈值的客户端"""
+        if self.idle_gap_seconds > 0:
+            idle_before = time.monotonic() - self.idle_gap_seconds
+            while self._engines and next(iter(self._engines.values()))[1] < idle_before:
+                self._evict(next(iter(self._engines)))
+
+        pending, self._restored = self._restored, {}
+        for client_id, (engine, _) in self._engines.items():
+            for hour, app_name, seconds, switches in engine.drain():
+                entry = pending.setdefault((client_id, hour, app_name), [0.0, 0])
+                entry[0] += seconds
+                entry[1] += switches
+        return pending
+
+    def restore(self, pending: Dict[Tuple[str, datetime, str], List[float]]):
+        """写入失败时将增量放回，等待下次写入"""
+        for key, (seconds, switches) in pending.items():
+            entry = self._restored.setdefault(key, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += switches
+
+
+class IncrementalUsageAggregator:
+    """
+    摄取时的小时应用使用统计
+
+    报告写入ES后由摄取服务调用 observe() 累加使用时间，后台任务定期将各小时的增量
+    累加写入 hourly_app_usage，不再每分钟从ES全量重算。
+
+    修复任务从ES替换写入前通过 hand_over() 接管某个整点之前的小时：先写入已累加的增量，
+    此后这些小时的增量不再写入（迟到的事件由下一次修复计入），避免同一批事件既被替换写入又被累加。
+    """
+
+    def __init__(self):
+        self.accumulator = HourlyUsageAccumulator()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        # 修复任务接管的整点（北京时间），早于该整点的增量不再写入
+        self.repair_horizon: Optional[datetime] = None
+
+        # 统计信息
+        self.rows_written = 0
+        self.flush_failures = 0
+        self.deltas_dropped = 0
+
+    async def start(self):
+        """启动定期写入任务"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("IncrementalUsageAggregator started")
+
+    async def stop(self):
+        """停止定期写入任务，并写入剩余的增量"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+        logger.info("IncrementalUsageAggregator stopped")
+
+    def observe(self, reports: List[DataReport]):
+        """
+        累加已写入ES的报告中的UI监控事件
+
+        Args:
+            reports: 数据报告列表
+        """
+        if not settings.USAGE_INGEST_AGGREGATION_ENABLED:
+            return
+        for report in reports:
+            try:
+                self.accumulator.add_report(report)
+            except Exception as e:
+                logger.error(f"Error aggregating usage for client {report.clientId}: {e}")
+
+    async def flush(self):
+        """将待写入的增量累加到 hourly_app_usage"""
+        async with self._flush_lock:
+            await self._flush_pending()
+
+    async def hand_over(self, until: datetime):
+        """
+        将指定整点之前的小时交给修复任务
+
+        写入已累加的增量后推进接管的整点，与 flush() 互斥，返回之后写入的增量都不早于该整点。
+
+        Args:
+            until: 整点（UTC）
+        """
+        async with self._flush_lock:
+            await self._flush_pending()
+            horizon = until + timedelta(hours=8)
+            if self.repair_horizon is None or horizon > self.repair_horizon:
+                self.repair_horizon = horizon
+
+    async def _flush_pending(self):
+        """写入待写入的增量，调用方需持有写入锁"""
+        pending = self.accumulator.drain()
+        if self.repair_horizon is not None:
+            stale = [key for key in pending if key[1] < self.repair_horizon]
+            for key in stale:
+                del pending[key]
+            self.deltas_dropped += len(stale)
+        if not pending:
+            return
+
+        try:
+            async with AsyncSessionLocal() as db:
+                usage_analysis_service = UsageAnalysisService(db, None)
+                records = []
+                for (client_id, hour, app_name), (seconds, switches) in pending.items():
+                    if seconds <= 0:
+                        continue
+                    records.append({
+                        "app_name": app_name,
+                        "category_id": await usage_analysis_service._match_app_category(app_name),
+                        "usage_date": hour.date(),
+                        "hour": hour.hour,
+                        "duration_minutes": round(seconds / 60, 2),
+                        "switch_count": switches,
+                        "client_id": client_id,
+                    })
+                self.rows_written += await usage_analysis_service.app_usage_service.batch_record_hourly_app_usage(
+                    records
+                )
+        except Exception as e:
+            self.flush_failures += 1
+            self.accumulator.restore(pending)
+            logger.error(f"Error writing incremental hourly usage, will retry: {e}")
+
+    async def _flush_loop(self):
+        """后台任务：定期写入增量"""
+        try:
+            while True:
+                await asyncio.sleep(settings.USAGE_AGGREGATION_FLUSH_INTERVAL)
+                await self.flush()
+        except asyncio.CancelledError:
+            logger.info("Usage aggregation flush loop cancelled")
+            raise
+
+    def get_stats(self):
+        """获取增量统计信息"""
+        return {
+            "enabled": settings.USAGE_INGEST_AGGREGATION_ENABLED,
+            "events_applied": self.accumulator.events_applied,
+            "events_skipped": self.accumulator.events_skipped,
+            "clients": len(self.accumulator._engines),
+            "engines_evicted": self.accumulator.engines_evicted,
+            "rows_written": self.rows_written,
+            "flush_failures": self.flush_failures,
+            "deltas_dropped": self.deltas_dropped,
+            "repair_horizon": self.repair_horizon.isoformat() if self.repair_horizon else None,
+        }
+
+
+# 创建全局服务实例
+usage_aggregator = IncrementalUsageAggregator()
@@ -1,15 +1,20 @@
+import asyncio
 import logging
 from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 from elasticsearch import AsyncElasticsearch
-from sqlalchemy import delete, select
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core.config import settings
-from ..models.app_usage import AppCategory, HourlyAppUsage
+from ..db.mysql import AsyncSessionLocal
+from ..models.app_usage import HourlyAppUsage, UsageWatermark
 from ..models.data import DataReport
+from ..services.app_category_matcher import DEFAULT_CATEGORY_NAME, app_category_matcher
 from ..services.app_usage_service import AppUsageService, ProductivityType
+from ..services.client_activity import client_activity_tracker
+from ..services.usage_engine import HourlyUsageEngine, PooledHourlyUsage
 
 logger = logging.getLogger(__name__)
 
@@ -20,132 +25,37 @@ class UsageAnalysisService:
         self.es_client = es_client
         self.app_usage_service = AppUsageService(db, es_client)
 
-    def _calculate_app_usage_duration(self, app_usage_data: List[Dict]) -> List[Dict]:
-        """
-        计算应用使用时间，按时间顺序处理，将应用切换间隔时间全部分配给前一个应用
-        识别loginwindow作为锁屏状态，不计入应用使用时间
-
-        Args:
-            app_usage_data: 应用使用数据列表
-
-        Returns:
-            List[Dict]: 更新后的应用使用数据列表，包含使用时间
-        """
-        # 按时间戳排序
-        app_usage_data.sort(key=lambda x: x["timestamp"])
-
-        # 如果没有记录或只有一条记录，直接返回
-        if len(app_usage_data) <= 1:
-            if app_usage_data:
-                app_usage_data[0]["duration"] = 0
-            return app_usage_data
-
-        # 定义参数
-        lock_screen_app = "loginwindow"  # 锁屏状态的应用名称
-
-        # 遍历记录计算持续时间
-        for i in range(len(app_usage_data) - 1):
-            current = app_usage_data[i]
-            next_record = app_usage_data[i + 1]
-
-            # 计算时间差（秒）
-            time_diff = (next_record["timestamp"] - current["timestamp"]).total_seconds()
-            
-            # 锁屏状态处理
-            if current["app_name"] == lock_screen_app:
-                # 如果当前是锁屏状态，不计算使用时间
-                current["duration"] = 0
-                continue
-                
-            # 切换到锁屏状态或其他应用的处理
-            # 无论切换到什么应用（包括锁屏），都将时间差全部分配给当前应用
-            current["duration"] = time_diff
-
-        # 处理最后一条记录
-        last_record = app_usage_data[-1]
-        
-        # 如果最后一条记录，设置持续时间为0
-        last_record["duration"] = 0
-
-        return app_usage_data
-
-    async def _generate_hourly_usage_records(
-        self,
-        client_id: str,
-        app_usage_data: List[Dict],
+    async def _build_hourly_usage_records(
+        self, client_id: str, hourly_usage: List[Tuple[datetime, str, float, int]]
     ) -> List[Dict]:
         """
-        生成小时级别的应用使用统计记录
+        将小时级别的使用时间转换为统计记录
 
         Args:
             client_id: 客户端ID
-            app_usage_data: 应用使用数据列表，其中timestamp字段是北京时间
+            hourly_usage: HourlyUsageEngine.drain() 的结果，(北京时间整点, 应用名称, 使用秒数, 切换次数)
 
         Returns:
             List[Dict]: 小时级别的应用使用统计记录
         """
-        hourly_app_data = {}
-        lock_screen_app = "loginwindow"  # 锁屏状态的应用名称
-
-        # 按应用和小时聚合数据
-        for item in app_usage_data:
-            # 跳过锁屏应用
-            if item["app_name"] == lock_screen_app:
-                continue
-                
-            # 跳过持续时间为0的记录
-            if item["duration"] <= 0:
-                continue
-                
-            timestamp = item["timestamp"]  # 这里的timestamp是北京时间
-            app_name = item["app_name"]
-            duration = item["duration"]
-            is_active = item["is_active"]
-
-            # 生成小时键（应用名+时间戳的小时部分）
-            hour_key = f"{app_name}_{timestamp.strftime('%Y-%m-%d_%H')}"
-            hour_timestamp = datetime(
-                timestamp.year, timestamp.month, timestamp.day, timestamp.hour
-            )
-
-            # 初始化该小时的应用数据
-            if hour_key not in hourly_app_data:
-                hourly_app_data[hour_key] = {
-                    "app_name": app_name,
-                    "timestamp": hour_timestamp,  # 这是北京时间的小时时间戳
-                    "hour_of_day": timestamp.hour,
-                    "day_of_week": timestamp.weekday(),
-                    "is_working_hour": self._is_working_hour(timestamp),
-                    "total_time_seconds": 0,
-                    "last_timestamp": None,
-                }
-
-            # 更新统计数据
-            hourly_data = hourly_app_data[hour_key]
-            hourly_data["total_time_seconds"] += duration
-
-            hourly_data["last_timestamp"] = timestamp
-
-        # 转换为最终的记录格式
         hourly_records = []
 
-        for hour_key, hourly_data in hourly_app_data.items():
+        for hour_timestamp, app_name, total_time_seconds, switch_count in hourly_usage:
             # 跳过总时间为0的记录
-            if hourly_data["total_time_seconds"] <= 0:
+            if total_time_seconds <= 0:
                 continue
-                
+
             # 匹配应用类别 - 这里已经返回类别ID
-            app_category_id = await self._match_app_category(hourly_data["app_name"])
+            app_category_id = await self._match_app_category(app_name)
 
             # 创建记录 - 注意timestamp是北京时间
             record = {
-                "app_name": hourly_data["app_name"],
+                "app_name": app_name,
                 "category_id": app_category_id,
-                "usage_date": hourly_data["timestamp"].date(),  # 使用北京时间的日期
-                "hour": hourly_data["hour_of_day"],  # 使用北京时间的小时
-                "duration_minutes": round(
-                    hourly_data["total_time_seconds"] / 60, 2
-                ),  # 转换为分钟
+                "usage_date": hour_timestamp.date(),  # 使用北京时间的日期
+                "hour": hour_timestamp.hour,  # 使用北京时间的小时
+                "duration_minutes": round(total_time_seconds / 60, 2),  # 转换为分钟
+                "switch_count": switch_count,
                 "client_id": client_id,
             }
 
@@ -153,29 +63,12 @@ class UsageAnalysisService:
 
         return hourly_records
 
-    def _is_working_hour(self, timestamp: datetime) -> bool:
-        """
-        判断是否是工作时间（默认工作日9:00-18:00）
-
-        Args:
-            timestamp: 时间戳 (北京时间)
-
-        Returns:
-            bool: 是否是工作时间
-        """
-        # 注意：timestamp是北京时间，直接使用它进行工作时间判断
-
-        # 工作日（周一到周五）
-        is_weekday = timestamp.weekday() < 5
-        # 工作时间（9:00-18:00）
-        is_work_time = 9 <= timestamp.hour < 18
-
-        return is_weekday and is_work_time
-
     async def _match_app_category(self, app_name: str) -> int:
         """
         匹配应用类别
 
+        使用全局的 app_category_matcher，类别只在首次使用或变更后加载一次，匹配结果按应用名称缓存。
+
         Args:
             app_name: 应用名称
 
@@ -183,30 +76,11 @@ class UsageAnalysisService:
             int: 类别ID
         """
         try:
-            # 直接查询精确匹配的类别
-            exact_query = select(AppCategory).where(AppCategory.name.ilike(app_name))
-            result = await self.db.execute(exact_query)
-            category = result.scalars().first()
-
-            if category:
-                return category.id
-
-            # 尝试部分匹配
-            # 由于SQLAlchemy不支持直接的包含查询，我们获取所有类别然后在Python中过滤
-            all_query = select(AppCategory)
-            result = await self.db.execute(all_query)
-            all_categories = result.scalars().all()
-
-            app_name_lower = app_name.lower()
-            for category in all_categories:
-                category_name_lower = category.name.lower()
-                if (
-                    category_name_lower in app_name_lower
-                    or app_name_lower in category_name_lower
-                ):
-                    return category.id
-
-            # 如果没有匹配，获取默认类别ID
+            category_id = await app_category_matcher.match(self.db, app_name)
+            if category_id is not None:
+                return category_id
+
+            # 如果没有匹配且默认类别不存在，创建默认类别
             default_category_id = await self._get_or_create_default_category()
             return default_category_id
 
@@ -230,16 +104,13 @@ class UsageAnalysisService:
         """
         try:
             # 尝试获取"未分类"类别
-            query = select(AppCategory).where(AppCategory.name == "未分类")
-            result = await self.db.execute(query)
-            category = result.scalars().first()
-
-            if category:
-                return category.id  # 返回类别ID
+            default_category_id = await app_category_matcher.default_category_id(self.db)
+            if default_category_id is not None:
+                return default_category_id
 
-            # 如果不存在，创建默认类别
+            # 如果不存在，创建默认类别（创建后匹配器会重新加载类别）
             default_category = await self.app_usage_service.create_app_category(
-                name="未分类", productivity_type=ProductivityType.NEUTRAL
+                name=DEFAULT_CATEGORY_NAME, productivity_type=ProductivityType.NEUTRAL
             )
 
             return default_category.id  # 返回类别ID
@@ -250,14 +121,19 @@ class UsageAnalysisService:
             return 1
 
     async def recalculate_hourly_statistics(
-        self, hours_back: int = 24, client_id: str = None
+        self, hours_back: int = 24, client_id: str = None, use_watermark: bool = True, until: datetime = None
     ):
         """
         重新计算过去几个小时的应用使用统计
 
+        启用水位时，每个客户端只从其水位（上次处理到的最后一个事件）所在小时开始重算，
+        最新事件未超过水位的客户端直接跳过；水位不存在时从 hours_back 小时前开始。
+
         Args:
             hours_back: 重新计算多少小时前的数据
             client_id: 客户端ID，如果为None则处理所有客户端
+            use_watermark: 是否按水位增量重算；为False时重算整个时间窗口（用于修复迟到的数据）
+            until: 只替换该整点（UTC）之前的小时，之后的小时由摄取时增量统计负责，可选
         """
         try:
             # 计算时间范围 - 使用UTC时间
@@ -275,202 +151,254 @@ class UsageAnalysisService:
 
             query_service = QueryService(self.es_client)
 
-            # 获取需要处理的客户端列表
-            client_ids = (
-                [client_id]
-                if client_id
-                else await self._get_active_client_ids(start_time_utc, end_time_utc)
-            )
-
-            for cid in client_ids:
-                logger.info(f"处理客户端 {cid} 的数据")
+            watermarks = await self._load_watermarks(client_id) if use_watermark else {}
 
-                # 获取该客户端在时间范围内的所有UI监控数据
-                ui_data = await query_service.get_ui_monitoring_by_time(
-                    client_id=cid,
-                    start_time=start_time_utc,
-                    end_time=end_time_utc,
-                    limit=10000,  # 设置一个较大的限制以获取所有数据
-                )
+            # 获取时间窗口内有事件的客户端及其最新事件，优先用活动登记缩小ES查询范围
+            active_client_ids = None if client_id else await self._get_active_client_ids(start_time_utc)
+            latest_events = await self._get_client_latest_events(
+                start_time_utc, end_time_utc, client_id, active_client_ids
+            )
 
-                if not ui_data or "items" not in ui_data or not ui_data["items"]:
-                    logger.info(f"客户端 {cid} 在指定时间范围内没有UI监控数据")
-                    continue
-
-                # 提取并处理UI监控数据
-                app_usage_data = []
-                for item in ui_data["items"]:
-                    timestamp_str = item["timestamp"]
-                    # 解析时间戳
-                    try:
-                        if isinstance(timestamp_str, str):
-                            if "T" in timestamp_str or "+" in timestamp_str:
-                                # ISO格式
-                                timestamp = datetime.fromisoformat(
-                                    timestamp_str.replace("Z", "+00:00")
-                                )
-                            elif "@" in timestamp_str:
-                                # ES特有格式 "Mar 2, 2025 @ 15:20:24.000"
-                                clean_ts = timestamp_str.replace(" @ ", " ")
-                                timestamp = datetime.strptime(
-                                    clean_ts, "%b %d, %Y %H:%M:%S.%f"
-                                )
-                            else:
-                                # 尝试其他格式
-                                timestamp = datetime.fromisoformat(timestamp_str)
-                        elif isinstance(timestamp_str, datetime):
-                            timestamp = timestamp_str
-                        else:
-                            logger.warning(
-                                f"未知时间戳类型: {type(timestamp_str)}，使用当前北京时间"
-                            )
-                            timestamp = datetime.utcnow()
-                    except ValueError as e:
-                        logger.warning(
-                            f"无法解析时间戳: {timestamp_str}，错误: {e}，使用当前北京时间"
-                        )
-                        timestamp = datetime.utcnow()
-
-                    app_usage_data.append(
-                        {
-                            "timestamp": timestamp + timedelta(hours=8),  # 这里的timestamp是北京时间
-                            "app_name": item["app"],
-                            "duration": 0,  # 初始化持续时间为0
-                            "is_active": True,  # 假设所有记录的UI都是活跃的
-                        }
+            units = []
+            skipped = 0
+            for cid, latest in latest_events.items():
+                client_start = start_time_utc
+                watermark = watermarks.get(cid)
+                if watermark:
+                    if latest <= watermark:
+                        # 水位之后没有新事件
+                        skipped += 1
+                        continue
+                    client_start = self._watermark_time(watermark).replace(
+                        minute=0, second=0, microsecond=0
                     )
+                units.append((cid, client_start, latest))
 
-                # 计算持续时间
-                app_usage_data = self._calculate_app_usage_duration(app_usage_data)
+            # 各客户端并发重算，并发数受信号量限制
+            semaphore = asyncio.Semaphore(max(1, settings.USAGE_RECALC_CONCURRENCY))
 
-                # 生成小时级别的应用使用统计
-                hourly_usage_records = await self._generate_hourly_usage_records(
-                    cid, app_usage_data
-                )
-
-                # 清除该客户端在时间范围内的现有记录
-                await self._clear_existing_hourly_records(
-                    cid, start_time_utc, end_time_utc
-                )
-
-                # 批量保存新的统计记录
-                if hourly_usage_records:
-                    await self.app_usage_service.batch_record_hourly_app_usage(
-                        hourly_usage_records
-                    )
-                    logger.info(
-                        f"为客户端 {cid} 重新计算并保存了 {len(hourly_usage_records)} 条小时应用使用统计"
+            async def run_unit(cid: str, client_start: datetime, latest: Tuple[int, int]) -> bool:
+                async with semaphore:
+                    return await self._process_client(
+                        query_service, cid, client_start, end_time_utc, latest, until
                     )
-                else:
-                    logger.info(f"客户端 {cid} 没有生成小时应用使用统计记录")
 
-            logger.info("小时应用使用统计重新计算完成")
+            results = await asyncio.gather(*(run_unit(*unit) for unit in units))
+            failed = results.count(False)
+
+            logger.info(
+                f"小时应用使用统计重新计算完成，处理 {len(units) - failed} 个客户端，"
+                f"失败 {failed} 个，跳过 {skipped} 个没有新事件的客户端"
+            )
 
         except Exception as e:
             logger.error(f"重新计算小时应用使用统计时出错: {e}")
             raise
 
-    async def _get_active_client_ids(
-        self, start_time: datetime, end_time: datetime
-    ) -> List[str]:
+    async def _process_client(
+        self,
+        query_service,
+        client_id: str,
+        start_time_utc: datetime,
+        end_time_utc: datetime,
+        latest: Tuple[int, int],
+        until: datetime = None,
+    ) -> bool:
         """
-        获取在指定时间范围内活跃的客户端ID列表
+        单个客户端的重算单元：使用独立的数据库会话重算并保存水位，错误不影响其他客户端
 
         Args:
-            start_time: 开始时间 (UTC)
-            end_time: 结束时间 (UTC)
+            query_service: 查询服务（各单元共享同一个ES客户端）
+            client_id: 客户端ID
+            start_time_utc: 开始时间 (UTC)
+            end_time_utc: 结束时间 (UTC)
+            latest: 该客户端的最新事件，重算成功后作为水位保存
+            until: 只替换该整点（UTC）之前的小时，可选
 
         Returns:
-            List[str]: 客户端ID列表
+            bool: 是否成功
         """
         try:
+            async with AsyncSessionLocal() as db:
+                unit = UsageAnalysisService(db, self.es_client)
+                await unit._recalculate_client(query_service, client_id, start_time_utc, end_time_utc, until)
+                await unit._save_watermark(client_id, latest)
+            return True
+        except Exception as e:
+            logger.error(f"重新计算客户端 {client_id} 的小时应用使用统计时出错: {e}")
+            return False
 
-            # 构建查询
-            query = {
-                "bool": {
-                    "must": [
-                        {
-                            "range": {
-                                "timestamp": {
-                                    "gte": start_time.isoformat(),
-                                    "lte": end_time.isoformat(),
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
+    async def _recalculate_client(
+        self, query_service, client_id: str, start_time_utc: datetime, end_time_utc: datetime,
+        until: datetime = None,
+    ):
+        """
+        重新计算单个客户端在时间范围内的小时应用使用统计，替换该范围内的现有记录
 
-            # 使用聚合查询获取唯一的客户端ID
-            aggs = {
-                "client_ids": {
-                    "terms": {
-                        "field": "client_id",
-                        "size": 1000,  # 设置一个较大的值以获取所有客户端
-                    }
-                }
-            }
+        Args:
+            query_service: 查询服务
+            client_id: 客户端ID
+            start_time_utc: 开始时间 (UTC)，应为整点
+            end_time_utc: 结束时间 (UTC)
+            until: 只替换该整点（UTC）之前的小时，可选；事件仍读取到 end_time_utc，跨越该整点的区间可以结算
+        """
+        logger.info(f"处理客户端 {client_id} 的数据")
+
+        # 按时间顺序流式读取UI监控事件的时间戳和应用名称
+        columns = query_service.iter_ui_monitoring_columns(
+            client_id=client_id,
+            start_time=start_time_utc,
+            end_time=end_time_utc,
+        )
+        # 开始时间之前的最后一个事件作为起点，其区间延续到开始的小时；超过空闲阈值的区间本就不计时
+        idle_gap = settings.USAGE_IDLE_GAP_SECONDS
+        seed = await query_service.get_ui_monitoring_event_before(
+            client_id, start_time_utc, start_time_utc - timedelta(seconds=idle_gap) if idle_gap > 0 else None
+        )
+        seed_page = ([seed[0]], [seed[1]]) if seed else ([], [])
+
+        event_count = 0
+        if settings.USAGE_RECALC_PROCESS_WORKERS > 0:
+            # 分块交给进程池计算，内存中只保留一块事件
+            pooled = PooledHourlyUsage()
+            await pooled.feed(*seed_page)
+            async for page_timestamps, page_apps in columns:
+                await pooled.feed(page_timestamps, page_apps)
+                event_count += len(page_timestamps)
+            hourly_usage = await pooled.drain()
+        else:
+            # 逐页送入向量化计算
+            engine = HourlyUsageEngine()
+            engine.feed(*seed_page)
+            async for page_timestamps, page_apps in columns:
+                engine.feed(page_timestamps, page_apps)
+                event_count += len(page_timestamps)
+            hourly_usage = engine.drain()
+
+        if not event_count:
+            logger.info(f"客户端 {client_id} 在指定时间范围内没有UI监控数据")
+            return
+
+        # 注意：数据库中的timestamp字段存储的是北京时间，而start_time和end_time是UTC时间
+        # 起点事件的区间在开始的小时之前的部分不属于本次替换的范围
+        replace_start = start_time_utc + timedelta(hours=8)
+        hourly_usage = [record for record in hourly_usage if record[0] >= replace_start]
+        replace_end = end_time_utc + timedelta(hours=8)
+        if until is not None:
+            # 整点之后的小时由增量统计写入，不替换
+            until_beijing = until + timedelta(hours=8)
+            hourly_usage = [record for record in hourly_usage if record[0] < until_beijing]
+            replace_end = min(replace_end, until_beijing - timedelta(seconds=1))
+            if replace_end < replace_start:
+                return
+
+        # 生成小时级别的应用使用统计（最后一个事件没有结束时间，不计时）
+        hourly_usage_records = await self._build_hourly_usage_records(
+            client_id, hourly_usage
+        )
+
+        # 在一个事务中用新的统计记录替换该客户端在时间范围内的现有记录
+        written = await self.app_usage_service.replace_hourly_app_usage(
+            client_id,
+            replace_start,
+            replace_end,
+            hourly_usage_records,
+        )
+        if written:
+            logger.info(f"为客户端 {client_id} 重新计算并保存了 {written} 条小时应用使用统计")
+        else:
+            logger.info(f"客户端 {client_id} 没有生成小时应用使用统计记录")
+
+    @staticmethod
+    def _watermark_time(watermark: Tuple[int, int]) -> datetime:
+        """将水位的毫秒时间戳转换为不带时区的UTC时间"""
+        return datetime.utcfromtimestamp(watermark[0] / 1000)
+
+    async def _load_watermarks(self, client_id: str = None) -> Dict[str, Tuple[int, int]]:
+        """
+        读取客户端水位
 
-            # 执行查询
-            index_name = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
-            result = await self.es_client.search(
-                index=index_name,
-                body={
-                    "query": query,
-                    "aggs": aggs,
-                    "size": 0,  # 我们只需要聚合结果，不需要具体文档
-                },
+        Args:
+            client_id: 客户端ID，如果为None则读取所有客户端
+
+        Returns:
+            Dict[str, Tuple[int, int]]: 客户端ID -> (最后事件的毫秒时间戳, 最后事件的monitoring_id)
+        """
+        query = select(UsageWatermark)
+        if client_id:
+            query = query.where(UsageWatermark.client_id == client_id)
+        result = await self.db.execute(query)
+        return {
+            mark.client_id: (mark.last_event_ms, mark.last_monitoring_id)
+            for mark in result.scalars().all()
+        }
+
+    async def _save_watermark(self, client_id: str, latest: Tuple[int, int]):
+        """
+        保存客户端水位
+
+        Args:
+            client_id: 客户端ID
+            latest: (最后事件的毫秒时间戳, 最后事件的monitoring_id)
+        """
+        await self.db.merge(
+            UsageWatermark(
+                client_id=client_id,
+                last_event_ms=latest[0],
+                last_monitoring_id=latest[1],
             )
+        )
+        await self.db.commit()
 
-            # 提取客户端ID
-            client_ids = []
-            if "aggregations" in result and "client_ids" in result["aggregations"]:
-                for bucket in result["aggregations"]["client_ids"]["buckets"]:
-                    client_ids.append(bucket["key"])
+    async def _get_active_client_ids(self, since: datetime) -> Optional[List[str]]:
+        """
+        从客户端活动登记中获取在指定时间之后上报过的客户端
 
-            print(client_ids)
-            return client_ids
+        Args:
+            since: 开始时间 (UTC)
 
+        Returns:
+            Optional[List[str]]: 客户端ID列表；未启用、登记尚未覆盖整个窗口（如刚启用或进程刚启动时）、登记为空、
+                客户端过多或查询失败时返回None，由ES聚合列出所有客户端
+        """
+        if not client_activity_tracker.covers(since):
+            return None
+        try:
+            client_ids = await client_activity_tracker.get_active_client_ids(self.db, since)
         except Exception as e:
-            logger.error(f"获取活跃客户端ID时出错: {e}")
-            return []
-
-    async def _clear_existing_hourly_records(
-        self, client_id: str, start_time: datetime, end_time: datetime
-    ):
+            logger.warning(f"读取客户端活动登记失败，改为从ES列出客户端: {e}")
+            return None
+        if not client_ids or len(client_ids) > settings.CLIENT_ACTIVITY_MAX_FILTER_IDS:
+            return None
+        return client_ids
+
+    async def _get_client_latest_events(
+        self, start_time: datetime, end_time: datetime, client_id: str = None, client_ids: List[str] = None
+    ) -> Dict[str, Tuple[int, int]]:
         """
-        清除指定客户端在时间范围内的现有小时应用使用统计记录
+        获取在指定时间范围内活跃的客户端及其最新事件
 
         Args:
-            client_id: 客户端ID
             start_time: 开始时间 (UTC)
             end_time: 结束时间 (UTC)
+            client_id: 客户端ID，如果为None则查询所有客户端
+            client_ids: 只在这些客户端中查找，可选
+
+        Returns:
+            Dict[str, Tuple[int, int]]: 客户端ID -> (最新事件的毫秒时间戳, 最新事件的monitoring_id)
         """
         try:
-            # 注意：数据库中的timestamp字段存储的是北京时间，而start_time和end_time是UTC时间
-            # 我们需要将UTC时间转换为北京时间进行比较
-
-            # 将UTC时间转换为北京时间（UTC+8）
-            beijing_start_time = start_time + timedelta(hours=8)
-            beijing_end_time = end_time + timedelta(hours=8)
-
-            # 构建删除语句
-            stmt = delete(HourlyAppUsage).where(
-                HourlyAppUsage.user_id == client_id,
-                HourlyAppUsage.timestamp >= beijing_start_time,
-                HourlyAppUsage.timestamp <= beijing_end_time,
-            )
-
-            # 执行删除
-            await self.db.execute(stmt)
-            await self.db.commit()
+            from ..services.query_service import QueryService
 
-            logger.info(
-                f"已清除客户端 {client_id} 在 {start_time} 到 {end_time} 之间的现有记录"
-            )
+            # composite聚合分页列出所有客户端，不受terms聚合size的限制
+            query_service = QueryService(self.es_client)
+            return {
+                cid: latest
+                async for cid, latest in query_service.iter_ui_monitoring_client_latest(
+                    start_time, end_time, client_id, client_ids=client_ids
+                )
+            }
 
         except Exception as e:
-            logger.error(f"清除现有记录时出错: {e}")
-            # 回滚事务
-            await self.db.rollback()
-            raise
+            logger.error(f"获取活跃客户端ID时出错: {e}")
+            return {}
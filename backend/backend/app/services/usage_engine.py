@@ -0,0 +1,298 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..core.config import settings
+
+HOUR_MS = 3600 * 1000
+BEIJING_OFFSET_MS = 8 * HOUR_MS  # 统计按北京时间的小时分桶
+LOCK_SCREEN_APP = "loginwindow"  # 锁屏状态的应用名称，不计入使用时间
+
+# 分组键 = 小时序号 << _APP_BITS | 应用编码
+_APP_BITS = 24
+_APP_MASK = (1 << _APP_BITS) - 1
+_EPOCH = datetime(1970, 1, 1)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def to_epoch_ms(timestamp: datetime) -> int:
+    """将datetime转换为毫秒时间戳，无时区信息的按UTC处理"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+class HourlyUsageEngine:
+    """
+    向量化的小时应用使用时间计算
+
+    相邻两个事件之间的时间全部计入前一个事件的应用，按小时边界精确切分；
+    锁屏（loginwindow）区间以及超过空闲阈值的区间不计时。区间的应用与上一个区间不同时
+    计为一次切换，记入区间开始所在的小时。
+
+    事件可以分多次按时间顺序送入，最后一个事件作为未结束区间保留到下一次送入。
+    """
+
+    def __init__(self, idle_gap_seconds: Optional[float] = None):
+        idle_gap_seconds = settings.USAGE_IDLE_GAP_SECONDS if idle_gap_seconds is None else idle_gap_seconds
+        self.idle_gap_ms = int(idle_gap_seconds * 1000) if idle_gap_seconds > 0 else None
+        self._app_codes: Dict[str, int] = {}
+        self.app_names: List[str] = []
+        self._lock_code = self.intern(LOCK_SCREEN_APP)
+
+        # 未结束区间：最后一个事件（已换算为北京时间）及上一个区间的应用
+        self._last_ms: Optional[int] = None
+        self._last_code: Optional[int] = None
+        self._previous_interval_code = -1
+
+        self._seconds: Dict[int, float] = {}
+        self._switches: Dict[int, int] = {}
+
+    @property
+    def last_timestamp_ms(self) -> Optional[int]:
+        """已送入的最后一个事件的毫秒时间戳（UTC）"""
+        return None if self._last_ms is None else self._last_ms - BEIJING_OFFSET_MS
+
+    def get_state(self) -> Optional[Tuple[int, str, Optional[str]]]:
+        """
+        获取未结束区间的状态，可交给另一个引擎继续计算后续事件
+
+        Returns:
+            Optional[Tuple[int, str, Optional[str]]]: (最后事件的毫秒时间戳（UTC）, 最后事件的应用, 上一个区间的应用)，
+                未送入事件时为None
+        """
+        if self._last_ms is None:
+            return None
+        previous_app = self.app_names[self._previous_interval_code] if self._previous_interval_code >= 0 else None
+        return self.last_timestamp_ms, self.app_names[self._last_code], previous_app
+
+    def set_state(self, state: Optional[Tuple[int, str, Optional[str]]]):
+        """恢复 get_state() 返回的未结束区间状态"""
+        if state is None:
+            return
+        last_ms, last_app, previous_app = state
+        self._last_ms = last_ms + BEIJING_OFFSET_MS
+        self._last_code = self.intern(last_app)
+        self._previous_interval_code = -1 if previous_app is None else self.intern(previous_app)
+
+    def intern(self, app_name: str) -> int:
+        """获取应用名称的整数编码"""
+        code = self._app_codes.get(app_name)
+        if code is None:
+            code = len(self.app_names)
+            if code > _APP_MASK:
+                raise ValueError("Too many distinct app names")
+            self._app_codes[app_name] = code
+            self.app_names.append(app_name)
+        return code
+
+    def feed(self, timestamps_ms: Sequence[int], apps: Sequence[str]):
+        """
+        送入一批按时间升序排列的事件
+
+        Args:
+            timestamps_ms: 毫秒时间戳（UTC）
+            apps: 应用名称
+        """
+        if len(timestamps_ms) == 0:
+            return
+
+        timestamps = np.asarray(timestamps_ms, dtype=np.int64) + BEIJING_OFFSET_MS
+        codes = np.fromiter((self.intern(app) for app in apps), dtype=np.int64, count=len(apps))
+        if self._last_ms is not None:
+            timestamps = np.concatenate(([self._last_ms], timestamps))
+            codes = np.concatenate(([self._last_code], codes))
+
+        self._last_ms = int(timestamps[-1])
+        self._last_code = int(codes[-1])
+        if len(timestamps) < 2:
+            return
+
+        starts = timestamps[:-1]
+        ends = timestamps[1:]
+        interval_codes = codes[:-1]
+        durations = ends - starts
+
+        previous_codes = np.concatenate(([self._previous_interval_code], interval_codes[:-1]))
+        self._previous_interval_code = int(interval_codes[-1])
+
+        mask = (interval_codes != self._lock_code) & (durations > 0)
+        if self.idle_gap_ms is not None:
+            mask &= durations <= self.idle_gap_ms
+        if not mask.any():
+            return
+
+        starts = starts[mask]
+        ends = ends[mask]
+        interval_codes = interval_codes[mask]
+        is_switch = (interval_codes != previous_codes[mask])
+
+        # 按小时边界切分：每个区间展开为其跨越的各个小时段
+        start_hours = starts // HOUR_MS
+        hour_counts = (ends - 1) // HOUR_MS - start_hours + 1
+        interval_index = np.repeat(np.arange(len(starts)), hour_counts)
+        hour_offsets = np.arange(len(interval_index)) - np.repeat(np.cumsum(hour_counts) - hour_counts, hour_counts)
+        segment_hours = start_hours[interval_index] + hour_offsets
+        segment_starts = np.maximum(starts[interval_index], segment_hours * HOUR_MS)
+        segment_ends = np.minimum(ends[interval_index], (segment_hours + 1) * HOUR_MS)
+
+        # 按 (小时, 应用) 分组求和
+        keys = (segment_hours << _APP_BITS) | interval_codes[interval_index]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        seconds = np.bincount(inverse, weights=(segment_ends - segment_starts) / 1000.0)
+        for key, value in zip(unique_keys.tolist(), seconds.tolist()):
+            self._seconds[key] = self._seconds.get(key, 0.0) + value
+
+        switch_keys, switch_counts = np.unique(
+            (start_hours[is_switch] << _APP_BITS) | interval_codes[is_switch], return_counts=True
+        )
+        for key, value in zip(switch_keys.tolist(), switch_counts.tolist()):
+            self._switches[key] = self._switches.get(key, 0) + value
+
+    def drain(self) -> List[Tuple[datetime, str, float, int]]:
+        """
+        取出并清空已结算的统计，未结束区间保留
+
+        Returns:
+            List[Tuple[datetime, str, float, int]]: (北京时间整点, 应用名称, 使用秒数, 切换次数) 列表
+        """
+        results = [
+            (
+                _EPOCH + timedelta(hours=key >> _APP_BITS),
+                self.app_names[key & _APP_MASK],
+                seconds,
+                self._switches.get(key, 0),
+            )
+            for key, seconds in sorted(self._seconds.items())
+        ]
+        self._seconds = {}
+        self._switches = {}
+        return results
+
+
+def compute_hourly_usage(
+    timestamps_ms: Sequence[int], apps: Sequence[str], idle_gap_seconds: Optional[float] = None
+) -> List[Tuple[datetime, str, float, int]]:
+    """
+    一次性计算一组按时间升序排列的事件的小时使用统计，可在子进程中执行
+
+    Args:
+        timestamps_ms: 毫秒时间戳（UTC）
+        apps: 应用名称
+        idle_gap_seconds: 空闲阈值（秒），None时使用配置
+
+    Returns:
+        List[Tuple[datetime, str, float, int]]: 同 HourlyUsageEngine.drain()
+    """
+    engine = HourlyUsageEngine(idle_gap_seconds)
+    engine.feed(timestamps_ms, apps)
+    return engine.drain()
+
+
+def compute_hourly_usage_chunk(
+    timestamps_ms: Sequence[int],
+    apps: Sequence[str],
+    idle_gap_seconds: Optional[float] = None,
+    state: Optional[Tuple[int, str, Optional[str]]] = None,
+) -> Tuple[List[Tuple[datetime, str, float, int]], Optional[Tuple[int, str, Optional[str]]]]:
+    """
+    从上一块的未结束区间继续计算一块事件，可在子进程中执行
+
+    Args:
+        timestamps_ms: 毫秒时间戳（UTC）
+        apps: 应用名称
+        idle_gap_seconds: 空闲阈值（秒），None时使用配置
+        state: 上一块计算后的未结束区间状态，第一块为None
+
+    Returns:
+        Tuple[list, Optional[tuple]]: (同 HourlyUsageEngine.drain() 的结果, 本块计算后的未结束区间状态)
+    """
+    engine = HourlyUsageEngine(idle_gap_seconds)
+    engine.set_state(state)
+    engine.feed(timestamps_ms, apps)
+    return engine.drain(), engine.get_state()
+
+
+async def compute_hourly_usage_in_pool(
+    timestamps_ms: Sequence[int],
+    apps: Sequence[str],
+    state: Optional[Tuple[int, str, Optional[str]]] = None,
+) -> Tuple[List[Tuple[datetime, str, float, int]], Optional[Tuple[int, str, Optional[str]]]]:
+    """
+    在进程池中计算一块事件的小时使用统计，避免大批量计算阻塞事件循环
+
+    进程池按 USAGE_RECALC_PROCESS_WORKERS 懒创建，为0时直接在当前进程计算。参数和返回值同 compute_hourly_usage_chunk。
+    """
+    global _process_pool
+    workers = settings.USAGE_RECALC_PROCESS_WORKERS
+    if workers <= 0:
+        return compute_hourly_usage_chunk(timestamps_ms, apps, state=state)
+
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=workers)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _process_pool, compute_hourly_usage_chunk, timestamps_ms, apps, settings.USAGE_IDLE_GAP_SECONDS, state
+    )
+
+
+class PooledHourlyUsage:
+    """
+    分块在进程池中计算小时使用统计
+
+    送入的事件攒够 USAGE_RECALC_POOL_CHUNK_EVENTS 个后交给进程池计算，块之间传递未结束区间的状态，
+    内存中只保留一块事件和按 (小时, 应用) 合并的结果。
+    """
+
+    def __init__(self, chunk_events: Optional[int] = None):
+        self.chunk_events = chunk_events or settings.USAGE_RECALC_POOL_CHUNK_EVENTS
+        self._timestamps: List[int] = []
+        self._apps: List[str] = []
+        self._state: Optional[Tuple[int, str, Optional[str]]] = None
+        # (北京时间整点, 应用名称) -> [使用秒数, 切换次数]
+        self._totals: Dict[Tuple[datetime, str], list] = {}
+
+    async def feed(self, timestamps_ms: Sequence[int], apps: Sequence[str]):
+        """送入一批按时间升序排列的事件，攒够一块时交给进程池计算"""
+        self._timestamps.extend(timestamps_ms)
+        self._apps.extend(apps)
+        if len(self._timestamps) >= self.chunk_events:
+            await self._compute()
+
+    async def _compute(self):
+        """计算已攒下的事件并合并结果"""
+        if not self._timestamps:
+            return
+        timestamps, apps = self._timestamps, self._apps
+        self._timestamps, self._apps = [], []
+        results, self._state = await compute_hourly_usage_in_pool(timestamps, apps, self._state)
+        for hour, app, seconds, switches in results:
+            entry = self._totals.setdefault((hour, app), [0.0, 0])
+            entry[0] += seconds
+            entry[1] += switches
+
+    async def drain(self) -> List[Tuple[datetime, str, float, int]]:
+        """
+        计算剩余事件，取出并清空合并后的统计
+
+        Returns:
+            List[Tuple[datetime, str, float, int]]: 同 HourlyUsageEngine.drain()
+        """
+        await self._compute()
+        totals, self._totals = self._totals, {}
+        return sorted(
+            ((hour, app, seconds, switches) for (hour, app), (seconds, switches) in totals.items()),
+            key=lambda record: record[0],
+        )
+
+
+def shutdown_process_pool():
+    """关闭计算进程池"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
@@ -5,13 +5,17 @@ import os
 import sys
 from datetime import datetime, timedelta
 import uuid
-from unittest.mock import patch
+import gzip
+from unittest.mock import AsyncMock, patch
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # 导入应用
+from backend.app.core.config import settings
 from backend.app.main import app
+from backend.app.services.ingest_service import IngestQueueFullError
+from backend.app.services.rate_limiter import RateLimitExceededError
 
 # 创建测试客户端
 client = TestClient(app)
@@ -118,13 +122,13 @@ async def test_data_report_api(mock_get_es_client):
     # 发送POST请求
     response = client.post("/api/v1/data/report", json=test_data)
     
-    # 检查响应
-    assert response.status_code == 200
+    # 检查响应 - 报告入队后立即返回202 Accepted
+    assert response.status_code == 202
     
     # 验证响应内容
     response_data = response.json()
-    assert response_data["status"] == "success"
-    assert "Data report received and processed successfully" in response_data["message"]
+    assert response_data["status"] == "accepted"
+    assert "Data report accepted for processing" in response_data["message"]
     assert "report_id" in response_data
     assert "received_at" in response_data
 
@@ -149,8 +153,8 @@ async def test_data_report_api_server_error(mock_get_es_client):
     # 生成测试数据
     test_data = generate_test_data()
     
-    # 模拟Elasticsearch客户端抛出异常
-    with patch('backend.app.services.data_service.DataService.store_report', 
+    # 模拟摄取服务抛出异常
+    with patch('backend.app.services.ingest_service.IngestService.submit', 
                side_effect=Exception("Test server error")):
         
         # 发送POST请求
@@ -160,6 +164,117 @@ async def test_data_report_api_server_error(mock_get_es_client):
         assert response.status_code == 500
         assert "Error processing data report" in response.json()["detail"]
 
+@pytest.mark.asyncio
+async def test_data_report_api_queue_full():
+    """测试数据报告API - 摄取队列已满"""
+    test_data = generate_test_data()
+    
+    with patch('backend.app.services.ingest_service.IngestService.submit',
+               side_effect=IngestQueueFullError("queue full")):
+        response = client.post("/api/v1/data/report", json=test_data)
+        
+        # 检查响应 - 应该返回503并带有Retry-After
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+def test_data_report_api_refunds_rate_limit_when_not_queued():
+    """测试数据报告API - 报告未入队时退还限速配额"""
+    test_data = generate_test_data()
+    
+    with patch('backend.app.services.ingest_service.IngestService.submit',
+               side_effect=IngestQueueFullError("queue full")), \
+         patch('backend.app.api.endpoints.data.ingest_rate_limiter') as limiter:
+        response = client.post("/api/v1/data/report", json=test_data)
+        
+        assert response.status_code == 503
+        limiter.acquire.assert_called_once_with(test_data["clientId"])
+        limiter.refund.assert_called_once_with(test_data["clientId"])
+
+def test_data_report_api_rate_limited():
+    """测试数据报告API - 超过客户端限速"""
+    test_data = generate_test_data()
+    
+    with patch('backend.app.services.rate_limiter.IngestRateLimiter.acquire',
+               side_effect=RateLimitExceededError("slow down", retry_after=7, scope="client")):
+        response = client.post("/api/v1/data/report", json=test_data)
+        
+        # 检查响应 - 应该返回429并带有计算出的Retry-After
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "7"
+
+def test_data_report_batch_api():
+    """测试批量上报API - gzip压缩的NDJSON，逐行返回处理结果"""
+    lines = [json.dumps(generate_test_data()), json.dumps({"clientId": "broken"}), "", json.dumps(generate_test_data())]
+    body = gzip.compress("\n".join(lines).encode("utf-8"))
+    
+    with patch('backend.app.services.ingest_service.IngestService.submit',
+               new=AsyncMock(side_effect=["report-1", "report-2"])):
+        response = client.post(
+            "/api/v1/data/report/batch",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+    
+    assert response.status_code == 202
+    response_data = response.json()
+    assert response_data["status"] == "partial"
+    assert (response_data["accepted"], response_data["invalid"]) == (2, 1)
+    assert [(r["line"], r["status"]) for r in response_data["results"]] == [
+        (1, "accepted"), (2, "invalid"), (4, "accepted")
+    ]
+    assert response_data["results"][2]["report_id"] == "report-2"
+
+def test_data_report_batch_api_unsupported_encoding():
+    """测试批量上报API - 不支持的压缩格式返回415"""
+    with patch('backend.app.services.ndjson_stream.zstandard', None):
+        response = client.post(
+            "/api/v1/data/report/batch",
+            content=b"{}",
+            headers={"Content-Encoding": "zstd"}
+        )
+    assert response.status_code == 415
+
+def test_data_report_batch_api_decompressed_size_limit():
+    """测试批量上报API - 解压后超过总大小上限的请求体被拒绝"""
+    body = gzip.compress(b"\n" * (4 * 1024 * 1024))
+    with patch.object(settings, 'INGEST_BATCH_MAX_DECOMPRESSED_BYTES', 1024 * 1024):
+        response = client.post(
+            "/api/v1/data/report/batch",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+    assert response.status_code == 400
+
+def test_data_report_batch_api_lines_split_across_chunks():
+    """测试批量上报API - 行被拆分到多个字节块中时正确拼接，未完成的行超过上限时拒绝"""
+    body = (json.dumps(generate_test_data()) + "\n\n" + json.dumps(generate_test_data())).encode("utf-8")
+    
+    with patch('backend.app.services.ingest_service.IngestService.submit',
+               new=AsyncMock(side_effect=["report-1", "report-2"])):
+        response = client.post(
+            "/api/v1/data/report/batch",
+            content=iter([body[i:i + 7] for i in range(0, len(body), 7)]),
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+    assert response.status_code == 202
+    assert [(r["line"], r["status"]) for r in response.json()["results"]] == [(1, "accepted"), (3, "accepted")]
+    
+    with patch.object(settings, 'INGEST_BATCH_MAX_LINE_BYTES', 64):
+        response = client.post(
+            "/api/v1/data/report/batch",
+            content=iter([b"x" * 40, b"x" * 40]),
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+    assert response.status_code == 400
+
+def test_ingest_stats():
+    """测试摄取统计端点"""
+    response = client.get("/api/v1/data/ingest/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert "queue_depth" in stats
+    assert "flush_latency_ms" in stats
+
 if __name__ == "__main__":
     # 运行测试
     pytest.main(["-xvs", __file__]) 
\ No newline at end of file
@@ -0,0 +1,72 @@
+import pytest
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.services.app_category_matcher import AhoCorasickAutomaton, AppCategoryMatcher
+
+def make_db(*names):
+    """创建返回指定类别的模拟数据库会话，类别ID从1开始"""
+    categories = []
+    for index, name in enumerate(names, start=1):
+        category = MagicMock()
+        category.id = index
+        category.name = name
+        categories.append(category)
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = categories
+    db = MagicMock()
+    db.execute = AsyncMock(return_value=result)
+    return db
+
+class TestAhoCorasickAutomaton:
+    """AhoCorasickAutomaton类的测试"""
+    
+    def test_first_match_returns_lowest_pattern_index(self):
+        """测试返回文本中出现的下标最小的模式，包括经由失败指针命中的模式"""
+        automaton = AhoCorasickAutomaton(["xyz", "code", "de", "visual"])
+        assert automaton.first_match("visual studio code") == 1
+        assert automaton.first_match("cde") == 2
+        assert automaton.first_match("chrome") == -1
+
+class TestAppCategoryMatcher:
+    """AppCategoryMatcher类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_matches_like_sequential_scan(self):
+        """测试精确匹配优先，其次取包含关系成立的第一个类别，否则返回默认类别"""
+        matcher = AppCategoryMatcher()
+        db = make_db("Chrome", "Code", "未分类", "Microsoft Word")
+        
+        assert await matcher.match(db, "code") == 2
+        assert await matcher.match(db, "Google Chrome") == 1
+        assert await matcher.match(db, "Word") == 4
+        assert await matcher.match(db, "Finder") == 3
+        assert db.execute.await_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_memoizes_and_invalidates(self):
+        """测试匹配结果被缓存，类别变更后重新加载"""
+        matcher = AppCategoryMatcher()
+        db = make_db("Code")
+        
+        assert await matcher.match(db, "Code") == 1
+        assert await matcher.match(db, "Code") == 1
+        assert matcher.hits == 1
+        
+        # 没有默认类别时不缓存未命中的结果
+        assert await matcher.match(db, "Finder") is None
+        assert "Finder" not in matcher._memo
+        
+        matcher.invalidate()
+        db = make_db("Finder", "Code")
+        assert await matcher.match(db, "Finder") == 1
+        assert await matcher.match(db, "Code") == 2
+        assert matcher.loads == 2
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,76 @@
+import pytest
+import os
+import sys
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock
+
+from sqlalchemy.dialects import mysql
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.services.app_usage_service import AppUsageService
+
+def make_record(app_name, hour, minutes, switches=1):
+    return {
+        "app_name": app_name, "category_id": 2, "usage_date": date(2025, 3, 3),
+        "hour": hour, "duration_minutes": minutes, "switch_count": switches, "client_id": "c1",
+    }
+
+def compile_sql(stmt) -> str:
+    return str(stmt.compile(dialect=mysql.dialect()))
+
+class TestHourlyUsageUpsert:
+    """小时应用使用统计批量写入的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_batch_record_uses_single_upsert_and_commit(self):
+        """测试整批记录合并后以一条多行 ON DUPLICATE KEY UPDATE 写入并只提交一次"""
+        db = MagicMock()
+        db.execute = AsyncMock()
+        db.commit = AsyncMock()
+        service = AppUsageService(db)
+        
+        written = await service.batch_record_hourly_app_usage([
+            make_record("Code", 9, 1.5), make_record("Code", 9, 0.5), make_record("Chrome", 9, 2.0),
+        ])
+        
+        assert written == 2
+        assert db.execute.await_count == 1
+        db.commit.assert_awaited_once()
+        stmt = db.execute.call_args.args[0]
+        sql = compile_sql(stmt)
+        assert "ON DUPLICATE KEY UPDATE" in sql
+        assert "total_time_seconds = (hourly_app_usage.total_time_seconds + VALUES(total_time_seconds))" in sql
+        params = stmt.compile(dialect=mysql.dialect()).params
+        assert params["total_time_seconds_m0"] == 120.0
+        assert params["switch_count_m0"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_replace_overwrites_and_deletes_stale_rows_in_one_transaction(self):
+        """测试替换模式覆盖写入并删除范围内不再出现的记录，失败时回滚"""
+        db = MagicMock()
+        db.execute = AsyncMock()
+        db.commit = AsyncMock()
+        db.rollback = AsyncMock()
+        service = AppUsageService(db)
+        
+        await service.replace_hourly_app_usage(
+            "c1", datetime(2025, 3, 3, 9), datetime(2025, 3, 3, 11), [make_record("Code", 9, 1.0)]
+        )
+        upsert_sql, delete_sql = [compile_sql(call.args[0]) for call in db.execute.call_args_list]
+        assert "total_time_seconds = VALUES(total_time_seconds)" in upsert_sql
+        assert delete_sql.startswith("DELETE FROM hourly_app_usage")
+        assert "NOT IN" in delete_sql
+        db.commit.assert_awaited_once()
+        
+        db.execute = AsyncMock(side_effect=Exception("deadlock"))
+        with pytest.raises(Exception):
+            await service.replace_hourly_app_usage(
+                "c1", datetime(2025, 3, 3, 9), datetime(2025, 3, 3, 11), []
+            )
+        db.rollback.assert_awaited_once()
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
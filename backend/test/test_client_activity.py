@@ -0,0 +1,127 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch, MagicMock
+
+from sqlalchemy.dialects import mysql
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.services.client_activity import ClientActivityTracker
+from backend.app.services.usage_analysis_service import UsageAnalysisService
+from test_data_service_simple import create_test_report
+
+def make_session():
+    session = MagicMock()
+    db = MagicMock()
+    db.execute = AsyncMock()
+    db.commit = AsyncMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+    return session, db
+
+class TestClientActivityTracker:
+    """ClientActivityTracker类的测试"""
+    
+    def test_observe_merges_reports_per_client(self):
+        """测试同一客户端的多个报告合并为一条记录，最近的报告决定最后应用和大小"""
+        tracker = ClientActivityTracker()
+        newer = create_test_report()
+        older = newer.model_copy(update={"timestamp": newer.timestamp - timedelta(minutes=10)}, deep=True)
+        older.data.uiMonitoring = []
+        
+        tracker.observe([newer, older], [2048, 512])
+        
+        first_seen, last_seen, last_app, size, count = tracker._pending[newer.clientId]
+        assert first_seen == older.timestamp.replace(tzinfo=None)
+        assert last_seen == newer.timestamp.replace(tzinfo=None)
+        assert (last_app, size, count) == ("TestApp", 2048, 2)
+    
+    @pytest.mark.asyncio
+    async def test_flush_upserts_in_order_and_restores_on_failure(self):
+        """测试批量upsert在更新last_seen之前比较最后应用，写入失败时保留记录"""
+        tracker = ClientActivityTracker()
+        report = create_test_report()
+        tracker.observe([report], [100])
+        
+        with patch("backend.app.services.client_activity.AsyncSessionLocal", side_effect=Exception("db down")):
+            await tracker.flush()
+        assert tracker.flush_failures == 1
+        assert tracker._pending[report.clientId][4] == 1
+        
+        session, db = make_session()
+        with patch("backend.app.services.client_activity.AsyncSessionLocal", return_value=session):
+            await tracker.flush()
+        
+        sql = str(db.execute.call_args.args[0].compile(dialect=mysql.dialect()))
+        update = sql[sql.index("ON DUPLICATE KEY UPDATE"):]
+        assert update.index("last_app =") < update.index("last_seen =")
+        assert "greatest(client_activity.last_seen, VALUES(last_seen))" in update
+        db.commit.assert_awaited_once()
+        assert tracker._pending == {}
+        assert tracker.rows_written == 1
+    
+    @pytest.mark.asyncio
+    async def test_active_client_ids_include_pending(self):
+        """测试活跃客户端查询包含尚未写入MySQL的记录"""
+        tracker = ClientActivityTracker()
+        report = create_test_report()
+        tracker.observe([report])
+        
+        result = MagicMock()
+        result.scalars.return_value.all.return_value = ["stored-client"]
+        db = MagicMock()
+        db.execute = AsyncMock(return_value=result)
+        
+        since = report.timestamp.replace(tzinfo=None) - timedelta(hours=1)
+        assert await tracker.get_active_client_ids(db, since) == sorted(["stored-client", report.clientId])
+        assert await tracker.get_active_client_ids(db, since + timedelta(hours=2)) == ["stored-client"]
+
+    @pytest.mark.asyncio
+    async def test_flushing_rows_stay_visible_until_commit(self):
+        """测试正在写入的记录在提交成功之前仍包含在活跃客户端中"""
+        tracker = ClientActivityTracker()
+        report = create_test_report()
+        tracker.observe([report])
+        since = report.timestamp.replace(tzinfo=None) - timedelta(hours=1)
+        
+        result = MagicMock()
+        result.scalars.return_value.all.return_value = []
+        reader = MagicMock()
+        reader.execute = AsyncMock(return_value=result)
+        seen_during_commit = []
+        
+        session, db = make_session()
+        async def commit():
+            seen_during_commit.extend(await tracker.get_active_client_ids(reader, since))
+        db.commit = AsyncMock(side_effect=commit)
+        with patch("backend.app.services.client_activity.AsyncSessionLocal", return_value=session):
+            await tracker.flush()
+        
+        assert seen_during_commit == [report.clientId]
+        assert tracker._flushing == {}
+    
+    @pytest.mark.asyncio
+    async def test_registry_covers_only_windows_after_start(self):
+        """测试登记只在启动之后的窗口内用于缩小重算范围"""
+        tracker = ClientActivityTracker()
+        now = datetime.now(timezone.utc)
+        assert not tracker.covers(now)
+        
+        with patch.object(tracker, "_flush_loop", AsyncMock()):
+            await tracker.start()
+        assert not tracker.covers(now - timedelta(hours=1))
+        assert tracker.covers(now + timedelta(seconds=1))
+        
+        with patch("backend.app.services.usage_analysis_service.client_activity_tracker", tracker):
+            service = UsageAnalysisService(MagicMock(), MagicMock())
+            tracker.get_active_client_ids = AsyncMock(return_value=["c1"])
+            assert await service._get_active_client_ids(now - timedelta(hours=1)) is None
+            assert await service._get_active_client_ids(now + timedelta(seconds=1)) == ["c1"]
+        await tracker.stop()
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -93,12 +93,12 @@ def create_test_report():
     return DataReport(**test_data)
 
 @pytest.mark.asyncio
-@patch('backend.app.db.elasticsearch.ensure_index_exists', new_callable=AsyncMock, return_value=True)
+@patch('backend.app.services.data_service.ensure_index_exists', new_callable=AsyncMock, return_value=True)
 async def test_store_report(mock_ensure_index, mock_es_client):
     """测试存储报告功能"""
     # 创建数据服务
     mock_es_client = MagicMock()
-    mock_es_client.index = AsyncMock(return_value={"_id": "test-doc-id-12345", "result": "created"})
+    mock_es_client.bulk = AsyncMock(return_value={"errors": False, "items": []})
     service = DataService(mock_es_client)
     
     # 创建测试报告
@@ -112,39 +112,29 @@ async def test_store_report(mock_ensure_index, mock_es_client):
     assert isinstance(report_id, str)
     assert len(report_id) > 0
     
-    # 验证index方法被调用
-    assert mock_es_client.index.called
+    # 验证bulk方法只被调用一次
+    assert mock_es_client.bulk.call_count == 1
     
     # 验证ensure_index_exists被调用
     assert mock_ensure_index.called
 
-@pytest.mark.asyncio
-@patch('backend.app.db.elasticsearch.ensure_index_exists', new_callable=AsyncMock, return_value=True)
-async def test_extract_and_store_specialized_data(mock_ensure_index, mock_es_client):
-    """测试提取和存储专门数据功能"""
+def test_build_report_operations():
+    """测试构建报告的全部bulk操作"""
     # 创建数据服务
-    mock_es_client = MagicMock()
-    mock_es_client.bulk = AsyncMock(return_value={"errors": False})
-    service = DataService(mock_es_client)
+    service = DataService(MagicMock())
     
     # 创建测试报告
     report = create_test_report()
     report_id = "test-report-id-12345"
     
-    # 调用提取和存储专门数据方法
-    await service.extract_and_store_specialized_data(report, report_id)
-    
-    # 验证bulk方法被调用
-    assert mock_es_client.bulk.called
+    # 构建bulk操作
+    operations = service.build_report_operations(report, report_id)
     
-    # 获取bulk方法的调用参数
-    call_args = mock_es_client.bulk.call_args_list
+    # 主文档 + OCR + 音频 + UI监控 = 4个文档
+    assert len(operations) == 8
     
-    # 验证至少有一次调用
-    assert len(call_args) > 0
-    
-    # 验证ensure_index_exists被调用
-    assert mock_ensure_index.called
+    # 验证每个文档都关联到报告ID
+    assert all(doc["report_id"] == report_id for doc in operations[1::2])
 
 if __name__ == "__main__":
     # 运行测试
@@ -1,7 +1,7 @@
 import pytest
 import os
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import uuid
 import json
 from unittest.mock import AsyncMock, patch, MagicMock
@@ -12,6 +12,9 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 # 导入应用相关模块
 from backend.app.services.data_service import DataService
 from backend.app.models.data import DataReport
+from backend.app.core.doc_ids import decode_id_timestamp
+from backend.app.services.ocr_dedup import OcrDedupCache
+from backend.app.services.ocr_near_dup import NearDuplicateDetector
 
 def create_test_report():
     """创建测试报告数据"""
@@ -97,10 +100,10 @@ class TestDataService:
     
     @pytest.mark.asyncio
     async def test_store_report(self):
-        """测试存储报告功能"""
+        """测试存储报告功能 - 主数据与专门数据在一次bulk请求中写入"""
         # 创建模拟ES客户端
         mock_es_client = MagicMock()
-        mock_es_client.index = AsyncMock(return_value={"_id": "test-doc-id-12345", "result": "created"})
+        mock_es_client.bulk = AsyncMock(return_value={"errors": False, "items": []})
         
         # 创建数据服务
         service = DataService(mock_es_client)
@@ -109,7 +112,7 @@ class TestDataService:
         report = create_test_report()
         
         # 模拟ensure_index_exists函数
-        with patch('backend.app.db.elasticsearch.ensure_index_exists', AsyncMock(return_value=True)):
+        with patch('backend.app.services.data_service.ensure_index_exists', AsyncMock(return_value=True)):
             # 调用存储报告方法
             report_id = await service.store_report(report)
             
@@ -118,36 +121,222 @@ class TestDataService:
             assert isinstance(report_id, str)
             assert len(report_id) > 0
             
-            # 验证index方法被调用
-            assert mock_es_client.index.called
+            # 验证只发出了一次bulk请求
+            assert mock_es_client.bulk.call_count == 1
+            
+            # 主文档 + OCR + 音频 + UI监控 = 4个文档
+            operations = mock_es_client.bulk.call_args.kwargs["operations"]
+            assert len(operations) == 8
+    
+    def test_build_report_operations(self):
+        """测试构建报告的全部bulk操作"""
+        service = DataService(MagicMock())
+        report = create_test_report()
+        report_id = "test-report-id-12345"
+        
+        operations = service.build_report_operations(report, report_id)
+        indices = [op["create"]["_index"] for op in operations[::2]]
+        
+        assert indices[0].startswith("timeglass-data-")
+        assert operations[0]["create"]["_id"] == report_id
+        assert "timeglass-ocr-text" in indices
+        assert "timeglass-audio-transcriptions" in indices
+        assert "timeglass-ui-monitoring" in indices
+        assert all(doc["report_id"] == report_id for doc in operations[1::2])
+    
+    def test_repeated_ocr_text_becomes_update(self):
+        """测试同一窗口连续相同的OCR文本合并为对上一条文档的更新"""
+        service = DataService(MagicMock())
+        service.ocr_dedup_cache = OcrDedupCache(max_entries=10)
+        report = create_test_report()
+        first_frame = report.data.frames[0]
+        for i in range(1, 3):
+            report.data.frames.append(first_frame.model_copy(update={
+                "id": first_frame.id + i,
+                "timestamp": first_frame.timestamp + timedelta(seconds=i),
+            }))
+        report_id = service.get_report_id(report)
+        
+        operations = service._build_ocr_operations(report, report_id)
+        
+        # 一条新文档 + 一条更新
+        assert len(operations) == 4
+        created_id = operations[0]["create"]["_id"]
+        assert operations[1]["repeat_count"] == 1
+        assert operations[2]["update"]["_id"] == created_id
+        assert operations[3]["script"]["params"]["count"] == 2
+        
+        # 客户端重试同一报告时，首帧仍以create写入（409视为已写入），不会被当作重复
+        retried = service._build_ocr_operations(report, report_id)
+        assert retried[0]["create"]["_id"] == created_id
+    
+    def test_near_duplicate_ocr_text_stores_reference(self):
+        """测试启用近似重复检测时，仅时钟等少量文字变化的帧只保存引用"""
+        service = DataService(MagicMock())
+        service.ocr_dedup_cache = OcrDedupCache(max_entries=10)
+        service.ocr_near_dup_detector = NearDuplicateDetector(threshold=0.8, window_size=4, max_clients=10)
+        report = create_test_report()
+        first_frame = report.data.frames[0]
+        body = " ".join(f"line{i} of the editor" for i in range(50))
+        report.data.frames = [
+            first_frame.model_copy(update={
+                "id": first_frame.id + i,
+                "timestamp": first_frame.timestamp + timedelta(seconds=i),
+                "ocr_text": first_frame.ocr_text.model_copy(update={"text": f"{body} 10:0{i}"}),
+            })
+            for i in range(2)
+        ]
+        
+        with patch("backend.app.services.data_service.settings.OCR_NEAR_DUP_ENABLED", True):
+            operations = service._build_ocr_operations(report, service.get_report_id(report))
+        
+        assert len(operations) == 4
+        full_doc, ref_doc = operations[1], operations[3]
+        assert "text" in full_doc and "ref_doc_id" not in full_doc
+        assert "text" not in ref_doc
+        assert ref_doc["ref_doc_id"] == operations[0]["create"]["_id"]
+        assert 0.8 <= ref_doc["similarity"] <= 1.0
+    
+    def test_rebuilt_report_keeps_near_duplicate_source_text(self):
+        """测试同一报告重复构建时，帧不会与自身匹配而丢失全文"""
+        service = DataService(MagicMock())
+        service.ocr_dedup_cache = OcrDedupCache(max_entries=10)
+        service.ocr_near_dup_detector = NearDuplicateDetector(threshold=0.8, window_size=4, max_clients=10)
+        report = create_test_report()
+        report_id = service.get_report_id(report)
+        
+        with patch("backend.app.services.data_service.settings.OCR_NEAR_DUP_ENABLED", True):
+            first = service._build_ocr_operations(report, report_id)
+            second = service._build_ocr_operations(report, report_id)
+        
+        assert second[0]["create"]["_id"] == first[0]["create"]["_id"]
+        assert second[1]["text"] == report.data.frames[0].ocr_text.text
+        assert "ref_doc_id" not in second[1]
+    
+    def test_ocr_dedup_cache_lru(self):
+        """测试去重缓存按LRU淘汰"""
+        cache = OcrDedupCache(max_entries=2)
+        text_hash = cache.content_hash("same text")
+        now = datetime.now()
+        
+        assert cache.check("client-1", "app", "window", text_hash, "doc-1", now) is None
+        assert cache.check("client-2", "app", "window", text_hash, "doc-2", now) is None
+        assert cache.check("client-3", "app", "window", text_hash, "doc-3", now) is None
+        assert len(cache) == 2
+        
+        # client-1 已被淘汰，client-3 仍能命中
+        assert cache.check("client-1", "app", "window", text_hash, "doc-4", now) is None
+        assert cache.check("client-3", "app", "window", text_hash, "doc-5", now) == "doc-3"
+    
+    def test_ocr_dedup_resets_after_leaving_window(self):
+        """测试离开窗口后回来或间隔过长时，相同文本不再合并到之前的文档"""
+        cache = OcrDedupCache(max_entries=10, max_gap_seconds=60)
+        text_hash = cache.content_hash("same text")
+        other_hash = cache.content_hash("other text")
+        now = datetime.now()
+        
+        assert cache.check("client", "app", "editor", text_hash, "doc-1", now) is None
+        assert cache.check("client", "app", "editor", text_hash, "doc-2", now + timedelta(seconds=30)) == "doc-1"
+        # 中间看过其他窗口
+        assert cache.check("client", "app", "browser", other_hash, "doc-3", now + timedelta(seconds=40)) is None
+        assert cache.check("client", "app", "editor", text_hash, "doc-4", now + timedelta(seconds=50)) is None
+        assert cache.check("client", "app", "editor", text_hash, "doc-5", now + timedelta(seconds=100)) == "doc-4"
+        # 与上一帧相隔超过上限
+        assert cache.check("client", "app", "editor", text_hash, "doc-6", now + timedelta(seconds=200)) is None
+    
+    def test_report_ids_are_deterministic(self):
+        """测试重复上报同一报告得到相同的文档ID"""
+        service = DataService(MagicMock())
+        report = create_test_report()
+        report_id = service.get_report_id(report)
+        
+        assert report_id == service.get_report_id(DataReport(**report.model_dump()))
+        
+        first = service.build_report_operations(report, report_id)
+        second = service.build_report_operations(report, report_id)
+        assert [op["create"]["_id"] for op in first[::2]] == [op["create"]["_id"] for op in second[::2]]
+        
+        # ID前缀可解析出报告周期开始时间
+        period_start = report.metadata.reportingPeriod.start.replace(tzinfo=timezone.utc)
+        assert abs((decode_id_timestamp(report_id) - period_start).total_seconds()) < 0.001
+    
+    def test_report_ids_are_time_ordered(self):
+        """测试报告ID按报告周期开始时间排序"""
+        earlier = create_test_report()
+        later = create_test_report()
+        later.metadata.reportingPeriod.start = earlier.metadata.reportingPeriod.start + timedelta(seconds=1)
+        
+        assert DataService.get_report_id(earlier) < DataService.get_report_id(later)
     
     @pytest.mark.asyncio
-    async def test_extract_and_store_specialized_data(self):
-        """测试提取和存储专门数据功能"""
-        # 创建模拟ES客户端
+    async def test_bulk_write_treats_conflicts_as_written(self):
+        """测试重复写入返回的409视为成功"""
         mock_es_client = MagicMock()
-        mock_es_client.bulk = AsyncMock(return_value={"errors": False})
+        mock_es_client.bulk = AsyncMock(return_value={"errors": True, "items": [
+            {"create": {"status": 409, "error": {"type": "version_conflict_engine_exception"}}},
+        ]})
+        service = DataService(mock_es_client)
         
-        # 创建数据服务
+        succeeded, rejected = await service.bulk_write([{"create": {"_index": "test-index", "_id": "1"}}, {"value": 1}])
+        
+        assert (succeeded, rejected) == (1, [])
+        assert mock_es_client.bulk.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_bulk_write_retries_only_failed_items(self):
+        """测试bulk写入只重试失败的条目"""
+        mock_es_client = MagicMock()
+        mock_es_client.bulk = AsyncMock(side_effect=[
+            {"errors": True, "items": [
+                {"index": {"status": 201}},
+                {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}},
+                {"index": {"status": 400, "error": {"type": "mapper_parsing_exception"}}},
+            ]},
+            {"errors": False, "items": [{"index": {"status": 201}}]},
+        ])
         service = DataService(mock_es_client)
         
-        # 创建测试报告
-        report = create_test_report()
-        report_id = "test-report-id-12345"
+        operations = []
+        for i in range(3):
+            operations.append({"index": {"_index": "test-index", "_id": str(i)}})
+            operations.append({"value": i})
         
-        # 模拟ensure_index_exists函数
-        with patch('backend.app.db.elasticsearch.ensure_index_exists', AsyncMock(return_value=True)):
-            # 调用提取和存储专门数据方法
-            await service.extract_and_store_specialized_data(report, report_id)
-            
-            # 验证bulk方法被调用
-            assert mock_es_client.bulk.called
-            
-            # 获取bulk方法的调用参数
-            call_args = mock_es_client.bulk.call_args_list
-            
-            # 验证至少有一次调用
-            assert len(call_args) > 0
+        with patch('backend.app.services.data_service.settings.ES_BULK_RETRY_BACKOFF', 0):
+            succeeded, rejected = await service.bulk_write(operations)
+        
+        assert succeeded == 2
+        assert rejected == [(2, {"type": "mapper_parsing_exception"})]
+        assert mock_es_client.bulk.call_count == 2
+        
+        # 第二次请求只包含被429拒绝的条目
+        retried = mock_es_client.bulk.call_args_list[1].kwargs["operations"]
+        assert retried == [{"index": {"_index": "test-index", "_id": "1"}}, {"value": 1}]
+
+    @pytest.mark.asyncio
+    async def test_rejected_report_is_returned_and_not_observed(self):
+        """测试被映射冲突拒绝的报告返回给调用方，且不登记客户端活动和筛选项"""
+        rejected_report, written_report = create_test_report(), create_test_report()
+        mock_es_client = MagicMock()
+        
+        async def bulk(operations):
+            # 第一个报告的OCR文档被拒绝（400），其余写入成功
+            items = [{"create": {"status": 201}} for _ in range(len(operations) // 2)]
+            items[1] = {"create": {"status": 400, "error": {"type": "mapper_parsing_exception"}}}
+            return {"errors": True, "items": items}
+        
+        mock_es_client.bulk = AsyncMock(side_effect=bulk)
+        service = DataService(mock_es_client)
+        service.client_activity = MagicMock()
+        service.facet_cache = MagicMock()
+        reports = [(rejected_report, "report-1"), (written_report, "report-2")]
+        
+        with patch('backend.app.services.data_service.ensure_index_exists', AsyncMock(return_value=True)):
+            rejected = await service.store_reports(reports, [10, 20])
+        
+        assert rejected == [(rejected_report, "report-1", {"type": "mapper_parsing_exception"})]
+        service.client_activity.observe.assert_called_once_with([written_report], [20])
+        service.facet_cache.observe.assert_called_once_with([written_report])
+        assert mock_es_client.bulk.call_count == 1
 
 if __name__ == "__main__":
     # 运行测试
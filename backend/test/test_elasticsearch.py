@@ -0,0 +1,82 @@
+import pytest
+import os
+import sys
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.db import elasticsearch as es_module
+
+@pytest.fixture
+def mock_index_client():
+    """模拟ES客户端的索引API，并清空已知索引集合"""
+    mock_client = MagicMock()
+    mock_client.indices = MagicMock()
+    mock_client.indices.exists = AsyncMock(return_value=False)
+    mock_client.indices.create = AsyncMock(return_value={"acknowledged": True})
+    mock_client.indices.put_mapping = AsyncMock(return_value={"acknowledged": True})
+    mock_client.indices.get_alias = AsyncMock(return_value={"timeglass-ocr-text": {"aliases": {}}})
+    
+    with patch.object(es_module, 'es_client', mock_client), \
+         patch.object(es_module, '_known_indices', set()):
+        yield mock_client
+
+class TestKnownIndexCache:
+    """已知索引缓存的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_ensure_index_exists_checks_cluster_once(self, mock_index_client):
+        """测试同一索引只在第一次时访问集群"""
+        assert await es_module.ensure_index_exists("timeglass-data-2025.03.01")
+        assert await es_module.ensure_index_exists("timeglass-data-2025.03.01")
+        
+        assert mock_index_client.indices.exists.call_count == 1
+        assert mock_index_client.indices.create.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_seeded_indices_skip_existence_check(self, mock_index_client):
+        """测试启动时加载的索引不再发送exists请求"""
+        await es_module.seed_known_indices()
+        
+        assert "timeglass-ocr-text" in es_module._known_indices
+        assert await es_module.ensure_index_exists("timeglass-ocr-text")
+        assert not mock_index_client.indices.exists.called
+    
+    @pytest.mark.asyncio
+    async def test_existing_index_gets_new_mapping_fields(self, mock_index_client):
+        """测试已存在的索引不重新创建，但会补充映射中新增的字段"""
+        mappings = {"properties": {"last_seen_at": {"type": "date"}}}
+        await es_module.seed_known_indices()
+        await es_module.create_index_if_not_exists("timeglass-ocr-text", {"mappings": mappings})
+        
+        mock_index_client.indices.exists = AsyncMock(return_value=True)
+        await es_module.create_index_if_not_exists("timeglass-ui-monitoring", {"mappings": mappings})
+        
+        assert not mock_index_client.indices.create.called
+        assert [call.kwargs for call in mock_index_client.indices.put_mapping.call_args_list] == [
+            {"index": "timeglass-ocr-text", "body": mappings},
+            {"index": "timeglass-ui-monitoring", "body": mappings},
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_precreate_daily_indices(self, mock_index_client):
+        """测试预创建今天和明天的数据索引"""
+        await es_module.precreate_daily_indices()
+        
+        created = {call.kwargs["index"] for call in mock_index_client.indices.create.call_args_list}
+        assert len(created) == 2
+        assert all(name.startswith("timeglass-data-") for name in created)
+    
+    @pytest.mark.asyncio
+    async def test_forget_index(self, mock_index_client):
+        """测试移除已知索引后会重新检查"""
+        await es_module.ensure_index_exists("timeglass-data-2025.03.01")
+        es_module.forget_index("timeglass-data-2025.03.01")
+        
+        assert "timeglass-data-2025.03.01" not in es_module._known_indices
+
+if __name__ == "__main__":
+    # 运行测试
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,141 @@
+import pytest
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.core.config import settings
+from backend.app.services.facet_cache import FacetCache
+from backend.app.services.query_service import QueryService
+from test_data_service_simple import create_test_report
+
+UI_INDEX = f"{settings.ES_INDEX_PREFIX}-ui-monitoring"
+OCR_INDEX = f"{settings.ES_INDEX_PREFIX}-ocr-text"
+
+class TestFacetCache:
+    """FacetCache类的测试"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_one_load(self):
+        """测试并发的相同请求只加载一次，之后命中缓存"""
+        cache = FacetCache(max_entries=10, ttl=60, settle_seconds=0)
+        release = asyncio.Event()
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return ["Chrome", "Code"]
+
+        tasks = [asyncio.ensure_future(cache.get(UI_INDEX, "app", "c1", None, loader)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert all(result == ["Chrome", "Code"] for result in results)
+        assert await cache.get(UI_INDEX, "app", "c1", None, loader) == ["Chrome", "Code"]
+        assert len(calls) == 1
+        assert cache.get_stats()["shared"] == 4
+        assert cache.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_and_evicted_entries_are_reloaded(self):
+        """测试过期和超出LRU上限的条目重新加载，加载失败不缓存"""
+        cache = FacetCache(max_entries=1, ttl=60, settle_seconds=0)
+        loader = AsyncMock(return_value=["a"])
+
+        await cache.get(UI_INDEX, "app", "c1", None, loader)
+        await cache.get(UI_INDEX, "app", "c2", None, loader)
+        await cache.get(UI_INDEX, "app", "c1", None, loader)
+        assert loader.await_count == 3
+
+        with patch("backend.app.services.facet_cache.time.monotonic", return_value=10 ** 9):
+            await cache.get(UI_INDEX, "app", "c1", None, loader)
+        assert loader.await_count == 4
+
+        failing = AsyncMock(side_effect=RuntimeError("es down"))
+        with pytest.raises(RuntimeError):
+            await cache.get(UI_INDEX, "app", "c3", None, failing)
+        assert cache.get_stats()["inflight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_only_new_pairs_invalidate_affected_entries(self):
+        """测试只有新的 (客户端, 应用/窗口) 组合才失效对应客户端和全局的条目"""
+        cache = FacetCache(max_entries=100, ttl=60, settle_seconds=0)
+        report = create_test_report()
+        client_id = report.clientId
+        loader = AsyncMock(return_value=["x"])
+        keys = [
+            (UI_INDEX, "app", client_id, None),
+            (UI_INDEX, "app", None, None),
+            (UI_INDEX, "window", client_id, "TestApp"),
+            (UI_INDEX, "app", "other-client", None),
+            (OCR_INDEX, "window_name", None, "TestBrowser"),
+        ]
+
+        async def load_all():
+            for index_name, field, cid, app in keys:
+                await cache.get(index_name, field, cid, app, loader)
+
+        await load_all()
+        cache.observe([report])
+        loader.reset_mock()
+        await load_all()
+        # 其他客户端的条目不受影响
+        assert loader.await_count == 4
+
+        cache.observe([report])
+        loader.reset_mock()
+        await load_all()
+        assert loader.await_count == 0
+
+    @pytest.mark.asyncio
+    async def test_load_racing_invalidation_is_not_cached(self):
+        """测试加载期间条目被失效时结果不写入缓存，刷新间隔内加载的结果提前过期"""
+        cache = FacetCache(max_entries=10, ttl=60, settle_seconds=30)
+        release = asyncio.Event()
+
+        async def slow_loader():
+            await release.wait()
+            return ["old"]
+
+        key = (UI_INDEX, "app", "c1", None)
+        pending = asyncio.ensure_future(cache.get(*key, slow_loader))
+        await asyncio.sleep(0)
+        cache.invalidate(key)
+        release.set()
+        assert await pending == ["old"]
+        assert cache.get_stats()["entries"] == 0
+
+        await cache.get(*key, AsyncMock(return_value=["new"]))
+        expires_at = cache._entries[key][0]
+        assert expires_at <= cache._settling[key]
+
+class TestQueryServiceFacets:
+    """QueryService筛选项查询的测试"""
+
+    @pytest.mark.asyncio
+    async def test_windows_facet_uses_cache(self):
+        """测试窗口筛选项只查询一次ES"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"aggregations": {"facet": {"buckets": [{"key": "Main"}]}}})
+        service = QueryService(es_client)
+
+        with patch("backend.app.services.query_service.facet_cache", FacetCache(ttl=60, settle_seconds=0)):
+            assert await service.get_ocr_text_windows(client_id="c1", app_name="Code") == ["Main"]
+            assert await service.get_ocr_text_windows(client_id="c1", app_name="Code") == ["Main"]
+
+        es_client.search.assert_awaited_once()
+        call = es_client.search.call_args.kwargs
+        assert call["index"] == OCR_INDEX
+        assert call["body"]["aggs"]["facet"]["terms"]["field"] == "window_name"
+        assert call["body"]["query"]["bool"]["filter"] == [
+            {"term": {"client_id": "c1"}}, {"term": {"app_name": "Code"}},
+        ]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
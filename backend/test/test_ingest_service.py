@@ -0,0 +1,248 @@
+import pytest
+import os
+import sys
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.services.ingest_service import IngestService, IngestQueueFullError, IngestUnavailableError
+from backend.app.services.ingest_spool import IngestSpool
+from backend.app.services.rate_limiter import IngestRateLimiter, RateLimitExceededError
+from backend.app.core.config import settings
+from test_data_service_simple import create_test_report
+
+class TestIngestService:
+    """IngestService类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_submit_returns_report_id(self):
+        """测试提交报告后返回报告ID并入队"""
+        service = IngestService()
+        report_id = await service.submit(create_test_report())
+        
+        assert isinstance(report_id, str)
+        assert service.queue.qsize() == 1
+        assert service.get_stats()["reports_accepted"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_submit_queue_full_spools(self, tmp_path):
+        """测试队列满时写入本地缓冲，缓冲也满时拒绝报告"""
+        service = IngestService()
+        service.queue = asyncio.Queue(maxsize=1)
+        service.spool = IngestSpool(str(tmp_path))
+        await service.submit(create_test_report())
+        
+        # 队列已满，写入本地缓冲
+        await service.submit(create_test_report())
+        assert service.spool.has_pending()
+        assert service.get_stats()["reports_spooled"] == 1
+        
+        # 缓冲也已满，拒绝报告
+        with patch.object(settings, 'INGEST_SPOOL_MAX_BYTES', service.spool.total_bytes):
+            with pytest.raises(IngestQueueFullError):
+                await service.submit(create_test_report())
+    
+    @pytest.mark.asyncio
+    async def test_flush_batches_and_drains_on_stop(self):
+        """测试flusher合并多个报告为一批写入，并在停止时排空队列"""
+        service = IngestService()
+        store_reports = AsyncMock(return_value=[])
+        
+        with patch('backend.app.services.ingest_service.DataService.store_reports', store_reports), \
+             patch('backend.app.services.ingest_service.get_es_client', AsyncMock(return_value=MagicMock())), \
+             patch.object(settings, 'INGEST_FLUSHER_COUNT', 1), \
+             patch.object(settings, 'INGEST_FLUSH_INTERVAL', 0.1):
+            for _ in range(3):
+                await service.submit(create_test_report())
+            
+            await service.start()
+            await service.stop()
+        
+        # 三个报告应在同一批中写入
+        flushed = sum(len(call.args[0]) for call in store_reports.call_args_list)
+        assert flushed == 3
+        assert store_reports.call_count == 1
+        assert service.queue.qsize() == 0
+        assert service.get_stats()["reports_flushed"] == 3
+        
+        # 停止后不再接收新报告
+        with pytest.raises(IngestUnavailableError):
+            await service.submit(create_test_report())
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_is_spooled(self, tmp_path):
+        """测试写入ES失败时报告转存到本地缓冲"""
+        service = IngestService()
+        service.spool = IngestSpool(str(tmp_path))
+        
+        with patch.object(IngestService, '_store', AsyncMock(side_effect=Exception("ES unavailable"))):
+            await service.submit(create_test_report())
+            await service._flush([service.queue.get_nowait()])
+        
+        stats = service.get_stats()
+        assert stats["es_available"] is False
+        assert stats["reports_spooled"] == 1
+        assert stats["reports_failed"] == 0
+        assert service.spool.has_pending()
+
+    @pytest.mark.asyncio
+    async def test_rejected_reports_are_dead_lettered(self, tmp_path):
+        """测试被ES永久拒绝的报告写入死信文件，不进入回放缓冲，也不计入使用统计"""
+        service = IngestService()
+        service.spool = IngestSpool(str(tmp_path))
+        rejected, written = create_test_report(), create_test_report()
+        rejected_id = await service.submit(rejected)
+        await service.submit(written)
+        store_reports = AsyncMock(return_value=[(rejected, rejected_id, {"type": "mapper_parsing_exception"})])
+        
+        with patch('backend.app.services.ingest_service.DataService.store_reports', store_reports), \
+             patch('backend.app.services.ingest_service.get_es_client', AsyncMock(return_value=MagicMock())), \
+             patch('backend.app.services.ingest_service.usage_aggregator') as aggregator:
+            await service._flush([service.queue.get_nowait() for _ in range(2)])
+        
+        aggregator.observe.assert_called_once_with([written])
+        stats = service.get_stats()
+        assert (stats["reports_flushed"], stats["reports_rejected"]) == (1, 1)
+        assert stats["spool"]["reports_dead_lettered"] == 1
+        assert not service.spool.has_pending()
+        with open(tmp_path / IngestSpool.DEAD_LETTER_FILE, "rb") as f:
+            record = json.loads(f.readline())
+        assert record["report_id"] == rejected_id
+        assert record["error"] == {"type": "mapper_parsing_exception"}
+
+    @pytest.mark.asyncio
+    async def test_shutdown_timeout_spools_in_flight_batch(self, tmp_path):
+        """测试停止超时时，正在写入的批次在flusher取消后转存到本地缓冲"""
+        service = IngestService()
+        service.spool = IngestSpool(str(tmp_path))
+        writing = asyncio.Event()
+        
+        async def slow_store(self, reports, report_sizes=None):
+            writing.set()
+            await asyncio.sleep(3600)
+        
+        with patch.object(IngestService, '_store', slow_store), \
+             patch.object(settings, 'INGEST_FLUSHER_COUNT', 1), \
+             patch.object(settings, 'INGEST_FLUSH_INTERVAL', 0.01), \
+             patch.object(settings, 'INGEST_SHUTDOWN_TIMEOUT', 0.05):
+            report_ids = [await service.submit(create_test_report()) for _ in range(2)]
+            await service.start()
+            await writing.wait()
+            await service.stop()
+        
+        assert service.get_stats()["reports_spooled"] == 2
+        replayed = AsyncMock()
+        await IngestSpool(str(tmp_path)).replay(replayed)
+        assert sorted(report_id for call in replayed.call_args_list for _, report_id in call.args[0]) == sorted(report_ids)
+
+class TestIngestSpool:
+    """IngestSpool类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_append_and_replay(self, tmp_path):
+        """测试写入缓冲后回放并删除分段"""
+        spool = IngestSpool(str(tmp_path))
+        reports = [(create_test_report(), f"report-{i}") for i in range(3)]
+        
+        with patch.object(settings, 'INGEST_SPOOL_SEGMENT_BYTES', 1):
+            await spool.append(reports[:2])
+            await spool.append(reports[2:])
+        assert spool.get_stats()["segments"] == 2
+        
+        store = AsyncMock()
+        replayed = await spool.replay(store)
+        
+        assert replayed == 3
+        assert [report_id for call in store.call_args_list for _, report_id in call.args[0]] == [
+            "report-0", "report-1", "report-2"
+        ]
+        assert not spool.has_pending()
+        assert spool.get_stats()["segments"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_failed_replay_keeps_segment(self, tmp_path):
+        """测试回放失败时保留分段"""
+        spool = IngestSpool(str(tmp_path))
+        await spool.append([(create_test_report(), "report-0")])
+        
+        with pytest.raises(Exception):
+            await spool.replay(AsyncMock(side_effect=Exception("ES unavailable")))
+        
+        assert spool.has_pending()
+        assert spool.get_stats()["segments"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_corrupted_record_is_skipped(self, tmp_path):
+        """测试跳过损坏的记录"""
+        spool = IngestSpool(str(tmp_path))
+        await spool.append([(create_test_report(), "report-0")])
+        await spool.close()
+        with open(spool._segment_paths()[0], "ab") as f:
+            f.write(b'{"report_id": "truncated"')
+        
+        store = AsyncMock()
+        assert await spool.replay(store) == 1
+
+class TestIngestRateLimiter:
+    """IngestRateLimiter类的测试"""
+    
+    def test_client_bucket_limits_and_computes_retry_after(self):
+        """测试单个客户端超过突发配额后被拒绝，其他客户端不受影响"""
+        ingest = MagicMock(in_flight=0, es_available=True)
+        limiter = IngestRateLimiter(rate=0.5, burst=2, max_clients=10, ingest=ingest)
+        
+        limiter.acquire("noisy")
+        limiter.acquire("noisy")
+        with pytest.raises(RateLimitExceededError) as exc_info:
+            limiter.acquire("noisy")
+        assert exc_info.value.scope == "client"
+        assert exc_info.value.retry_after == 2
+        
+        limiter.acquire("quiet")
+    
+    def test_refund_restores_token(self):
+        """测试退还的配额可以再次使用，且不超过突发上限"""
+        ingest = MagicMock(in_flight=0, es_available=True)
+        limiter = IngestRateLimiter(rate=0.001, burst=1, max_clients=10, ingest=ingest)
+        
+        limiter.acquire("client")
+        limiter.refund("client")
+        limiter.acquire("client")
+        with pytest.raises(RateLimitExceededError):
+            limiter.acquire("client")
+        
+        limiter.refund("client")
+        limiter.refund("client")
+        assert limiter._buckets["client"].tokens <= 1
+    
+    def test_global_budget_and_upload_interval_hint(self):
+        """测试全局在途预算耗尽时拒绝所有客户端，并随压力延长建议上报间隔"""
+        ingest = MagicMock(in_flight=0, es_available=True)
+        ingest.estimate_drain_seconds.return_value = 12.3
+        limiter = IngestRateLimiter(rate=1, burst=10, max_clients=10, ingest=ingest)
+        
+        with patch.object(settings, "INGEST_GLOBAL_INFLIGHT_MAX", 100), \
+             patch.object(settings, "INGEST_UPLOAD_INTERVAL", 60), \
+             patch.object(settings, "INGEST_UPLOAD_INTERVAL_MAX", 600):
+            assert limiter.next_upload_interval() == 60
+            
+            ingest.in_flight = 75
+            assert limiter.next_upload_interval() == 330
+            
+            ingest.in_flight = 100
+            with pytest.raises(RateLimitExceededError) as exc_info:
+                limiter.acquire("client")
+            assert exc_info.value.scope == "global"
+            assert exc_info.value.retry_after == 13
+            ingest.estimate_drain_seconds.assert_called_with(50)
+            
+            ingest.es_available = False
+            assert limiter.next_upload_interval() == 600
+
+if __name__ == "__main__":
+    # 运行测试
+    pytest.main(["-xvs", __file__])
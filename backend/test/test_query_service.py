@@ -0,0 +1,500 @@
+import pytest
+import base64
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, patch, MagicMock
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.services.query_service import QueryService
+from backend.app.services.ui_delta import UiDeltaEncoder, apply_delta
+from backend.app.services.query_cursor import (
+    InvalidCursorError, decode_after_key, decode_cursor, encode_after_key, encode_cursor
+)
+from backend.app.services.query_builder import build_filter_query, parse_rounding, parse_track_total_hits
+
+class TestQueryService:
+    """QueryService类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_ui_monitoring_reconstructs_delta_text(self):
+        """测试按需根据关键帧重建增量存储的UI文本"""
+        encoder = UiDeltaEncoder(max_entries=10, keyframe_interval=10, max_delta_ratio=0.5)
+        keyframe_text = "\n".join(f"button {i}" for i in range(20))
+        changed_text = keyframe_text.replace("button 7", "button seven")
+        
+        assert encoder.encode("client", "app", "window", keyframe_text, "doc-1") == ("keyframe", None)
+        mode, delta = encoder.encode("client", "app", "window", changed_text, "doc-2")
+        assert mode == "delta" and delta["base_doc_id"] == "doc-1"
+        
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"hits": {"total": {"value": 1}, "hits": [
+            {"_id": "doc-2", "_source": {"storage_mode": "delta", **delta}},
+        ]}})
+        es_client.mget = AsyncMock(return_value={"docs": [
+            {"_id": "doc-1", "found": True, "_source": {"text_output": keyframe_text}},
+        ]})
+        service = QueryService(es_client)
+        
+        # 默认不重建，不访问关键帧
+        result = await service.get_ui_monitoring_by_time(client_id="client")
+        assert "text_output" not in result["items"][0]
+        es_client.mget.assert_not_called()
+        
+        result = await service.get_ui_monitoring_by_time(client_id="client", reconstruct_text=True)
+        assert result["items"][0] == {"text_output": changed_text}
+        assert es_client.mget.call_args.kwargs["ids"] == ["doc-1"]
+    
+    @pytest.mark.asyncio
+    async def test_reconstruct_hides_delta_fields_on_cursor_pages(self):
+        """测试重建文本时每一页都去掉增量存储的内部字段"""
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(side_effect=[
+            {"hits": {"hits": [
+                {"_id": "k", "_source": {"app": "a", "text_output": "hello", "storage_mode": "keyframe"}, "sort": [2, 1]},
+            ]}},
+            {"hits": {"hits": [
+                {"_id": "d", "_source": {
+                    "app": "a", "storage_mode": "delta", "base_doc_id": "k",
+                    "text_delta": {"ops": [[1, 1, ["world"]]]},
+                }, "sort": [1, 1]},
+            ]}},
+        ])
+        es_client.mget = AsyncMock(return_value={"docs": [
+            {"_id": "k", "found": True, "_source": {"text_output": "hello"}},
+        ]})
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        first = await service.get_ui_monitoring_by_time(limit=1, use_cursor=True, reconstruct_text=True)
+        assert first["items"] == [{"app": "a", "text_output": "hello"}]
+        
+        second = await service.get_ui_monitoring_by_time(limit=1, cursor=first["next_cursor"])
+        assert second["items"] == [{"app": "a", "text_output": "hello\nworld"}]
+    
+    @pytest.mark.asyncio
+    async def test_iter_ui_monitoring_columns_pages_with_search_after(self):
+        """测试基于PIT和search_after逐页读取全部数据，结束后关闭PIT"""
+        def hit(ms, app, sort):
+            return {"fields": {"timestamp": [str(ms)], "app": [app]}, "sort": sort}
+        pages = [
+            {"pit_id": "pit-2", "hits": {"hits": [hit(1, "A", [1, 1, 0]), hit(2, "B", [2, 2, 1])]}},
+            {"pit_id": "pit-3", "hits": {"hits": [hit(3, "C", [3, 3, 2])]}},
+        ]
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(side_effect=pages)
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        columns = [page async for page in service.iter_ui_monitoring_columns(client_id="client", page_size=2)]
+        
+        assert columns == [([1, 2], ["A", "B"]), ([3], ["C"])]
+        second_body = es_client.search.call_args_list[1].kwargs["body"]
+        assert second_body["search_after"] == [2, 2, 1]
+        assert second_body["pit"]["id"] == "pit-2"
+        es_client.close_point_in_time.assert_awaited_once_with(id="pit-3")
+    
+    @pytest.mark.asyncio
+    async def test_iter_ui_monitoring_columns_uses_docvalues(self):
+        """测试精简模式不读取_source，返回毫秒时间戳和应用名称数组"""
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(return_value={"hits": {"hits": [
+            {"fields": {"timestamp": ["1709430000000"], "app": ["Code"]}, "sort": [1709430000000, 1, 0]},
+            {"fields": {"timestamp": ["1709430060000"], "app": ["Chrome"]}, "sort": [1709430060000, 2, 1]},
+        ]}})
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        pages = [page async for page in service.iter_ui_monitoring_columns(client_id="client")]
+        
+        assert pages == [([1709430000000, 1709430060000], ["Code", "Chrome"])]
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"] is False
+        assert {"field": "timestamp", "format": "epoch_millis"} in body["docvalue_fields"]
+    
+    @pytest.mark.asyncio
+    async def test_iter_client_latest_pages_composite_buckets(self):
+        """测试客户端列表通过composite聚合的after_key逐页读取"""
+        def bucket(client_id, timestamp, monitoring_id):
+            return {
+                "key": {"client_id": client_id},
+                "latest": {"hits": {"hits": [{"sort": [timestamp, monitoring_id]}]}},
+            }
+        
+        es_client = MagicMock()
+        es_client.search = AsyncMock(side_effect=[
+            {"aggregations": {"paged": {"after_key": {"client_id": "b"},
+                                        "buckets": [bucket("a", 10, 1), bucket("b", 20, 2)]}}},
+            {"aggregations": {"paged": {"after_key": {"client_id": "c"},
+                                        "buckets": [bucket("c", 30, 3)]}}},
+        ])
+        service = QueryService(es_client)
+        
+        clients = [item async for item in service.iter_ui_monitoring_client_latest(page_size=2)]
+        
+        assert clients == [("a", (10, 1)), ("b", (20, 2)), ("c", (30, 3))]
+        second = es_client.search.call_args_list[1].kwargs["body"]["aggs"]["paged"]["composite"]
+        assert second["after"] == {"client_id": "b"}
+        assert second["size"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_ocr_text_cursor_pagination(self):
+        """测试游标分页：第一页打开PIT并返回游标，下一页沿用游标中的查询条件，最后一页关闭PIT"""
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(side_effect=[
+            {"pit_id": "pit-2", "hits": {"total": {"value": 3}, "hits": [
+                {"_source": {"text": "a"}, "sort": [3, 7]}, {"_source": {"text": "b"}, "sort": [2, 5]},
+            ]}},
+            {"pit_id": "pit-2", "hits": {"hits": [{"_source": {"text": "c"}, "sort": [1, 2]}]}},
+        ])
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        first = await service.get_ocr_text_by_time(client_id="client", limit=2, use_cursor=True)
+        assert first["total"] == 3
+        assert [item["text"] for item in first["items"]] == ["a", "b"]
+        assert first["next_cursor"]
+        es_client.close_point_in_time.assert_not_called()
+        
+        second = await service.get_ocr_text_by_time(client_id="other", limit=2, cursor=first["next_cursor"])
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["pit"]["id"] == "pit-2"
+        assert body["search_after"] == [2, 5]
+        assert body["query"]["bool"]["filter"] == [{"term": {"client_id": "client"}}]
+        assert second["next_cursor"] is None
+        assert second["total"] is None
+        es_client.close_point_in_time.assert_awaited_once_with(id="pit-2")
+    
+    @pytest.mark.asyncio
+    async def test_time_range_is_rounded_into_filter_context(self):
+        """测试查询条件放在过滤上下文，同一分钟内的请求得到相同的查询体并开启请求缓存"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"hits": {"total": {"value": 0}, "hits": []}})
+        service = QueryService(es_client)
+        
+        with patch("backend.app.services.query_builder.settings.QUERY_TIME_ROUNDING", "1m"):
+            for second in (5, 50):
+                await service.get_ui_monitoring_by_time(
+                    start_time=datetime(2024, 1, 1, 10, 0, second),
+                    end_time=datetime(2024, 1, 1, 11, 30, second),
+                    client_id="client",
+                    app="",
+                )
+        
+        first, second = (call.kwargs for call in es_client.search.call_args_list)
+        assert first["body"] == second["body"]
+        assert first["request_cache"] is True
+        assert first["body"]["query"] == {"bool": {"filter": [
+            {"term": {"client_id": "client"}},
+            {"range": {"timestamp": {"gte": "2024-01-01T10:00:00", "lt": "2024-01-01T11:30:00||+1m"}}},
+        ]}}
+    
+    @pytest.mark.asyncio
+    async def test_ocr_time_range_matches_on_screen_interval(self):
+        """测试OCR文本按 [timestamp, last_seen_at] 与时间范围重叠匹配，缺少 last_seen_at 时按 timestamp"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"hits": {"total": {"value": 0}, "hits": []}})
+        service = QueryService(es_client)
+        
+        with patch("backend.app.services.query_builder.settings.QUERY_TIME_ROUNDING", "1m"):
+            await service.get_ocr_text_by_time(
+                client_id="client", start_time=datetime(2024, 1, 1, 10, 0, 5), end_time=datetime(2024, 1, 1, 11)
+            )
+        
+        assert es_client.search.call_args.kwargs["body"]["query"]["bool"]["filter"] == [
+            {"term": {"client_id": "client"}},
+            {"range": {"timestamp": {"lt": "2024-01-01T11:00:00||+1m"}}},
+            {"bool": {
+                "should": [
+                    {"range": {"last_seen_at": {"gte": "2024-01-01T10:00:00"}}},
+                    {"bool": {
+                        "must_not": [{"exists": {"field": "last_seen_at"}}],
+                        "filter": [{"range": {"timestamp": {"gte": "2024-01-01T10:00:00"}}}],
+                    }},
+                ],
+                "minimum_should_match": 1,
+            }},
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_ocr_near_duplicate_text_is_resolved_from_reference(self):
+        """测试近似重复的OCR文档在查询时从被引用的文档读取全文，游标后续页同样处理"""
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(side_effect=[
+            {"hits": {"hits": [
+                {"_source": {"app_name": "a", "text": "hello"}, "sort": [2, 1]},
+                {"_source": {"app_name": "a", "ref_doc_id": "full-1"}, "sort": [1, 1]},
+            ]}},
+            {"hits": {"hits": [{"_source": {"app_name": "a", "ref_doc_id": "full-2"}, "sort": [0, 1]}]}},
+        ])
+        es_client.mget = AsyncMock(side_effect=[
+            {"docs": [{"_id": "full-1", "found": True, "_source": {"text": "hello world"}}]},
+            {"docs": [{"_id": "full-2", "found": False}]},
+        ])
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        first = await service.get_ocr_text_by_time(limit=2, use_cursor=True, fields=["text", "app_name"])
+        assert es_client.search.call_args.kwargs["body"]["_source"] == {
+            "includes": ["text", "app_name", "ref_doc_id"]
+        }
+        assert es_client.mget.call_args.kwargs["ids"] == ["full-1"]
+        assert es_client.mget.call_args.kwargs["source_includes"] == ["text"]
+        assert first["items"] == [{"app_name": "a", "text": "hello"}, {"app_name": "a", "text": "hello world"}]
+        
+        second = await service.get_ocr_text_by_time(limit=2, cursor=first["next_cursor"])
+        assert second["items"] == [{"app_name": "a", "text": None}]
+        
+        # 未请求文本时不读取引用
+        es_client.search = AsyncMock(return_value={"hits": {"hits": [{"_source": {"ref_doc_id": "full-1"}}]}})
+        result = await service.get_ocr_text_by_time(fields=["ref_doc_id"])
+        assert result["items"] == [{"ref_doc_id": "full-1"}]
+        assert es_client.mget.await_count == 2
+    
+    def test_filter_query_without_rounding_keeps_exact_bounds(self):
+        """测试不取整时保留精确边界，列表值使用terms，False不被忽略"""
+        start = datetime(2024, 1, 1, 10, 0, 5)
+        end = datetime(2024, 1, 1, 10, 59, 59)
+        query = build_filter_query({"client_id": ["a", "b"], "focused": False}, start, end, round_time=False)
+        assert query["bool"]["filter"] == [
+            {"terms": {"client_id": ["a", "b"]}},
+            {"term": {"focused": False}},
+            {"range": {"timestamp": {"gte": start.isoformat(), "lte": end.isoformat()}}},
+        ]
+        assert parse_rounding("0") is None
+        with pytest.raises(ValueError):
+            parse_rounding("5x")
+    
+    @pytest.mark.asyncio
+    async def test_windows_facet_page_uses_composite_after_key(self):
+        """测试筛选项分页：composite聚合带前缀过滤和计数，next_after 传回后作为下一页的after"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(side_effect=[
+            {"aggregations": {"paged": {
+                "buckets": [{"key": {"value": "Doc 1"}, "doc_count": 4}, {"key": {"value": "Doc 2"}, "doc_count": 1}],
+                "after_key": {"value": "Doc 2"},
+            }}},
+            {"aggregations": {"paged": {
+                "buckets": [{"key": {"value": "Doc 3"}, "doc_count": 2}],
+                "after_key": {"value": "Doc 3"},
+            }}},
+        ])
+        service = QueryService(es_client)
+        
+        first = await service.get_ocr_text_windows_page(client_id="c1", app_name="Word", prefix="doc", size=2)
+        assert first["items"] == [{"value": "Doc 1", "count": 4}, {"value": "Doc 2", "count": 1}]
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["aggs"]["paged"]["composite"] == {
+            "size": 2, "sources": [{"value": {"terms": {"field": "window_name"}}}],
+        }
+        assert body["query"]["bool"]["filter"] == [
+            {"term": {"client_id": "c1"}},
+            {"term": {"app_name": "Word"}},
+            {"prefix": {"window_name": {"value": "doc", "case_insensitive": True}}},
+        ]
+        
+        second = await service.get_ocr_text_windows_page(
+            client_id="c1", app_name="Word", prefix="doc", after=first["next_after"], size=2
+        )
+        assert es_client.search.call_args.kwargs["body"]["aggs"]["paged"]["composite"]["after"] == {"value": "Doc 2"}
+        assert second["items"] == [{"value": "Doc 3", "count": 2}]
+        assert second["next_after"] is None
+        
+        with pytest.raises(InvalidCursorError):
+            await service.get_ui_monitoring_apps_page(after="not-a-cursor")
+    
+    @pytest.mark.asyncio
+    async def test_facet_page_cursor_is_bound_to_request(self):
+        """测试筛选项分页游标只能用于相同字段和过滤条件，after_key 只能是 {"value": <str>}"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"aggregations": {"paged": {
+            "buckets": [{"key": {"value": "Doc 1"}, "doc_count": 1}], "after_key": {"value": "Doc 1"},
+        }}})
+        service = QueryService(es_client)
+        
+        first = await service.get_ocr_text_windows_page(client_id="c1", app_name="Word", prefix="doc", size=1)
+        for kwargs in (
+            {"client_id": "c2", "app_name": "Word", "prefix": "doc"},
+            {"client_id": "c1", "app_name": "Excel", "prefix": "doc"},
+            {"client_id": "c1", "app_name": "Word"},
+        ):
+            with pytest.raises(InvalidCursorError):
+                await service.get_ocr_text_windows_page(after=first["next_after"], size=1, **kwargs)
+        with pytest.raises(InvalidCursorError):
+            await service.get_ocr_text_apps_page(client_id="c1", after=first["next_after"], size=1)
+        with pytest.raises(InvalidCursorError):
+            await service.get_ui_monitoring_windows_page(
+                client_id="c1", app="Word", prefix="doc", after=first["next_after"], size=1
+            )
+        
+        scope = {"field": "window_name", "client_id": "c1"}
+        for after_key in ({"value": 1}, {"value": "a", "other": "b"}, {"script": "x"}):
+            with pytest.raises(InvalidCursorError):
+                decode_after_key(encode_after_key(after_key, scope), scope)
+        assert decode_after_key(encode_after_key({"value": "a"}, scope), scope) == {"value": "a"}
+    
+    @pytest.mark.asyncio
+    async def test_field_projection_and_total_hits(self):
+        """测试字段过滤映射到_source，不统计总数时total为None，重建文本时补充增量字段"""
+        es_client = MagicMock()
+        es_client.search = AsyncMock(return_value={"hits": {"hits": [{"_id": "1", "_source": {"app": "Code"}}]}})
+        service = QueryService(es_client)
+        
+        result = await service.get_ui_monitoring_by_time(
+            fields=["timestamp", "app"], track_total_hits=False
+        )
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"] == {"includes": ["timestamp", "app"]}
+        assert body["track_total_hits"] is False
+        assert result["total"] is None and result["total_relation"] is None
+        assert result["items"] == [{"app": "Code"}]
+        
+        await service.get_ui_monitoring_by_time(fields=["text_output"], reconstruct_text=True)
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"]["includes"] == ["text_output", "storage_mode", "base_doc_id", "text_delta"]
+        assert "track_total_hits" not in body
+        
+        es_client.search.return_value = {"hits": {"total": {"value": 100, "relation": "gte"}, "hits": []}}
+        result = await service.get_ocr_text_by_time(exclude=["text", "text_json"], track_total_hits=100)
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"] == {"excludes": ["text", "text_json"]}
+        assert body["track_total_hits"] == 100
+        assert (result["total"], result["total_relation"]) == (100, "gte")
+        
+        assert parse_track_total_hits("exact") is True
+        assert parse_track_total_hits("off") is False
+        assert parse_track_total_hits("500") == 500
+        assert parse_track_total_hits(None) is None
+        with pytest.raises(ValueError):
+            parse_track_total_hits("0")
+    
+    @pytest.mark.asyncio
+    async def test_projection_patterns_keep_text_reconstruction(self):
+        """测试通配符字段过滤也能重建文本，被排除的增量字段读取后从结果中去掉"""
+        def response(**kwargs):
+            return {"hits": {"hits": [
+                {"_id": "k", "_source": {"app": "a", "text_output": "hello", "storage_mode": "keyframe"}},
+                {"_id": "d", "_source": {
+                    "app": "a", "storage_mode": "delta", "base_doc_id": "k",
+                    "text_delta": {"ops": [[1, 1, ["world"]]]},
+                }},
+            ]}}
+        es_client = MagicMock()
+        es_client.search = AsyncMock(side_effect=response)
+        service = QueryService(es_client)
+        
+        result = await service.get_ui_monitoring_by_time(fields=["text_*", "app"], reconstruct_text=True)
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"]["includes"] == ["text_*", "app", "storage_mode", "base_doc_id"]
+        assert result["items"] == [{"app": "a", "text_output": "hello"}, {"app": "a", "text_output": "hello\nworld"}]
+        
+        await service.get_ui_monitoring_by_time(fields=["*"], reconstruct_text=True)
+        assert es_client.search.call_args.kwargs["body"]["_source"]["includes"][0] == "*"
+        
+        result = await service.get_ui_monitoring_by_time(exclude=["storage_mode", "*_id", "window"], reconstruct_text=True)
+        body = es_client.search.call_args.kwargs["body"]
+        assert body["_source"] == {"excludes": ["window"]}
+        assert result["items"][1] == {"app": "a", "text_output": "hello\nworld"}
+        
+        await service.get_ui_monitoring_by_time(exclude=["text_*"], reconstruct_text=True)
+        assert es_client.search.call_args.kwargs["body"]["_source"] == {"excludes": ["text_*"]}
+    
+    @pytest.mark.asyncio
+    async def test_cursor_keeps_field_projection(self):
+        """测试游标分页的后续页沿用第一页的字段过滤"""
+        es_client = MagicMock()
+        es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+        es_client.search = AsyncMock(side_effect=[
+            {"hits": {"hits": [{"_source": {"app": "a"}, "sort": [2, 1]}]}},
+            {"hits": {"hits": []}},
+        ])
+        es_client.close_point_in_time = AsyncMock()
+        service = QueryService(es_client)
+        
+        first = await service.get_ui_monitoring_by_time(
+            limit=1, use_cursor=True, fields=["app"], track_total_hits=False
+        )
+        assert es_client.search.call_args.kwargs["body"]["track_total_hits"] is False
+        await service.get_ui_monitoring_by_time(limit=1, cursor=first["next_cursor"])
+        assert es_client.search.call_args.kwargs["body"]["_source"] == {"includes": ["app"]}
+    
+    def test_tampered_cursor_is_rejected(self):
+        """测试游标经过签名，修改其中的查询条件后被拒绝"""
+        cursor = encode_cursor("pit-1", [1, 2], {"bool": {"filter": []}}, [{"timestamp": "desc"}])
+        assert decode_cursor(cursor)["pit"] == "pit-1"
+        
+        body, signature = cursor.split(".")
+        payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+        payload["query"] = {"script": {"script": "while (true) {}"}}
+        forged = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(f"{forged}.{signature}")
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(forged)
+    
+    @pytest.mark.asyncio
+    async def test_invalid_cursor_is_rejected(self):
+        """测试无法解析的游标"""
+        service = QueryService(MagicMock())
+        with pytest.raises(InvalidCursorError):
+            await service.get_ui_monitoring_by_time(cursor="not-a-cursor")
+    
+    def test_ui_delta_replay_is_not_delta_encoded(self):
+        """测试重复构建已编码过的事件时以完整文本保存，且不影响之后事件的关键帧"""
+        encoder = UiDeltaEncoder(max_entries=10, keyframe_interval=10, max_delta_ratio=0.5)
+        base = "\n".join(f"row {i}" for i in range(10))
+        other = "\n".join(f"other {i}" for i in range(10))
+        
+        assert encoder.encode("c", "a", "w", base, "doc-1")[0] == "keyframe"
+        assert encoder.encode("c", "a", "w", base + "\nrow 10", "doc-2")[0] == "delta"
+        assert encoder.encode("c", "a", "w", other, "doc-3")[0] == "keyframe"
+        
+        # doc-1 的关键帧位置已被 doc-3 取代，回放时不能编码为相对 doc-3 的差异
+        assert encoder.encode("c", "a", "w", base, "doc-1") == ("keyframe", None)
+        assert encoder.encode("c", "a", "w", base + "\nrow 10", "doc-2") == ("keyframe", None)
+        
+        mode, delta = encoder.encode("c", "a", "w", other + "\nx", "doc-4")
+        assert mode == "delta"
+        assert delta["base_doc_id"] == "doc-3"
+    
+    def test_ui_delta_cache_is_bounded_by_bytes(self):
+        """测试关键帧缓存按文本总字节数淘汰最久未使用的条目"""
+        encoder = UiDeltaEncoder(max_entries=10, keyframe_interval=10, max_delta_ratio=0.5, max_bytes=100)
+        text = "x" * 40
+        
+        encoder.encode("c", "a", "w1", text, "doc-1")
+        encoder.encode("c", "a", "w2", text, "doc-2")
+        encoder.encode("c", "a", "w1", text + "\ny", "doc-3")  # w1 变为最近使用
+        encoder.encode("c", "a", "w3", text, "doc-4")
+        
+        assert list(encoder._keyframes) == [("c", "a", "w1"), ("c", "a", "w3")]
+        assert encoder._keyframe_bytes == 80
+        assert encoder.encode("c", "a", "w2", text + "\ny", "doc-5")[0] == "keyframe"
+    
+    def test_ui_delta_falls_back_to_keyframe(self):
+        """测试差异过大或达到关键帧间隔时重新写入关键帧"""
+        encoder = UiDeltaEncoder(max_entries=10, keyframe_interval=2, max_delta_ratio=0.5)
+        base = "\n".join(f"row {i}" for i in range(10))
+        
+        assert encoder.encode("c", "a", "w", base, "doc-1")[0] == "keyframe"
+        assert encoder.encode("c", "a", "w", base + "\nrow 10", "doc-2")[0] == "delta"
+        assert encoder.encode("c", "a", "w", base + "\nrow 11", "doc-3")[0] == "delta"
+        assert encoder.encode("c", "a", "w", base + "\nrow 12", "doc-4")[0] == "keyframe"
+        assert encoder.encode("c", "a", "w", "completely different", "doc-5")[0] == "keyframe"
+        # 客户端重试关键帧本身时不会引用自身
+        assert encoder.encode("c", "a", "w", "completely different", "doc-5")[0] == "keyframe"
+        
+        ops = encoder.encode("c", "a", "w", "completely different\nextra", "doc-6")[1]["text_delta"]["ops"]
+        assert apply_delta("completely different", ops) == "completely different\nextra"
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,189 @@
+import pytest
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.core.config import settings
+from backend.app.services import usage_engine
+from backend.app.services.scheduled_tasks import repair_hourly_app_usage_statistics
+from backend.app.services.usage_aggregation import HourlyUsageAccumulator, IncrementalUsageAggregator
+from backend.app.services.usage_engine import HourlyUsageEngine, PooledHourlyUsage, to_epoch_ms
+
+# UTC 01:58，即北京时间 9:58
+BASE = datetime(2025, 3, 3, 1, 58)
+BEIJING_HOUR = datetime(2025, 3, 3, 9)
+
+def ms(seconds: float) -> int:
+    """BASE之后若干秒的毫秒时间戳"""
+    return to_epoch_ms(BASE + timedelta(seconds=seconds))
+
+class TestHourlyUsageEngine:
+    """HourlyUsageEngine类的测试"""
+    
+    def test_splits_intervals_at_hour_boundaries(self):
+        """测试跨小时的区间按小时边界精确切分，切换计入区间开始的小时"""
+        engine = HourlyUsageEngine(idle_gap_seconds=0)
+        engine.feed([ms(0), ms(60), ms(3900)], ["Code", "Chrome", "Code"])
+        
+        # Chrome 9:59 - 11:03 切分为 9 点 60 秒、10 点 3600 秒、11 点 180 秒
+        assert engine.drain() == [
+            (BEIJING_HOUR, "Code", 60.0, 1),
+            (BEIJING_HOUR, "Chrome", 60.0, 1),
+            (BEIJING_HOUR + timedelta(hours=1), "Chrome", 3600.0, 0),
+            (BEIJING_HOUR + timedelta(hours=2), "Chrome", 180.0, 0),
+        ]
+    
+    def test_masks_lock_screen_and_idle_gaps(self):
+        """测试锁屏区间和超过空闲阈值的区间不计时，批次之间的区间在下一批结算"""
+        engine = HourlyUsageEngine(idle_gap_seconds=600)
+        engine.feed([ms(0), ms(30)], ["Code", "loginwindow"])
+        engine.feed([ms(90), ms(1000), ms(1010)], ["Code", "Code", "Chrome"])
+        
+        # 90 - 1000 秒的 Code 区间超过空闲阈值，不计时也不算切换
+        assert engine.drain() == [(BEIJING_HOUR, "Code", 30.0, 1),
+                                  (BEIJING_HOUR + timedelta(hours=1), "Code", 10.0, 0)]
+        assert engine.last_timestamp_ms == ms(1010)
+        
+        engine.feed([ms(1040)], ["Code"])
+        assert engine.drain() == [(BEIJING_HOUR + timedelta(hours=1), "Chrome", 30.0, 1)]
+
+    @pytest.mark.asyncio
+    async def test_pooled_chunks_match_single_engine(self):
+        """测试分块计算在块之间传递未结束区间，结果与一次性计算相同"""
+        timestamps = [ms(0), ms(60), ms(90), ms(3900), ms(3950), ms(4000), ms(4100)]
+        apps = ["Code", "Chrome", "loginwindow", "Code", "Code", "Chrome", "Code"]
+        engine = HourlyUsageEngine()
+        engine.feed(timestamps, apps)
+        expected = sorted(engine.drain())
+        
+        pooled = PooledHourlyUsage(chunk_events=2)
+        with patch.object(usage_engine, "compute_hourly_usage_in_pool",
+                          wraps=usage_engine.compute_hourly_usage_in_pool) as compute:
+            for offset in range(0, len(timestamps), 3):
+                await pooled.feed(timestamps[offset:offset + 3], apps[offset:offset + 3])
+            assert sorted(await pooled.drain()) == expected
+        assert compute.await_count == 3
+        assert all(len(call.args[0]) <= 3 for call in compute.call_args_list)
+
+class TestHourlyUsageAccumulator:
+    """HourlyUsageAccumulator类的测试"""
+    
+    def test_carry_over_between_batches(self):
+        """测试最后一个区间在下一批事件到达时结算"""
+        accumulator = HourlyUsageAccumulator(idle_gap_seconds=600)
+        accumulator.add_events("c1", [(ms(0), "Code"), (ms(60), "Chrome")])
+        assert accumulator.drain() == {("c1", BEIJING_HOUR, "Code"): [60.0, 1]}
+        
+        # Chrome 区间跨批次结算
+        accumulator.add_events("c1", [(ms(100), "loginwindow"), (ms(900), "Code")])
+        assert accumulator.drain() == {("c1", BEIJING_HOUR, "Chrome"): [40.0, 1]}
+    
+    def test_skips_old_events_and_long_gaps(self):
+        """测试重复事件被跳过，离线间隔不计入"""
+        accumulator = HourlyUsageAccumulator(idle_gap_seconds=600)
+        events = [(ms(0), "Code"), (ms(30), "Code")]
+        accumulator.add_events("c1", events)
+        accumulator.add_events("c1", events)
+        assert accumulator.events_skipped == 2
+        
+        accumulator.add_events("c1", [(ms(3 * 3600), "Chrome")])
+        assert accumulator.drain() == {("c1", BEIJING_HOUR, "Code"): [30.0, 1]}
+
+    def test_idle_and_excess_clients_are_evicted(self):
+        """测试空闲超过阈值和超出数量上限的客户端被移除，已结算的增量仍会写入"""
+        accumulator = HourlyUsageAccumulator(idle_gap_seconds=600, max_clients=2)
+        accumulator.add_events("c1", [(ms(0), "Code"), (ms(60), "Chrome")])
+        accumulator.add_events("c2", [(ms(0), "Code")])
+        accumulator.add_events("c3", [(ms(0), "Code")])
+        assert list(accumulator._engines) == ["c2", "c3"]
+        assert accumulator.engines_evicted == 1
+        
+        with patch("backend.app.services.usage_aggregation.time.monotonic", return_value=time.monotonic() + 601):
+            accumulator.add_events("c3", [(ms(30), "Chrome")])
+            assert accumulator.drain() == {
+                ("c1", BEIJING_HOUR, "Code"): [60.0, 1],
+                ("c3", BEIJING_HOUR, "Code"): [30.0, 1],
+            }
+        assert list(accumulator._engines) == ["c3"]
+        assert accumulator.engines_evicted == 2
+
+class TestIncrementalUsageAggregator:
+    """IncrementalUsageAggregator类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_flush_accumulates_and_restores_on_failure(self):
+        """测试增量写入失败时保留到下次写入"""
+        aggregator = IncrementalUsageAggregator()
+        aggregator.accumulator.add_events("c1", [(ms(0), "Code"), (ms(90), "Chrome")])
+        
+        with patch("backend.app.services.usage_aggregation.AsyncSessionLocal", side_effect=Exception("db down")):
+            await aggregator.flush()
+        assert aggregator.flush_failures == 1
+        
+        session = MagicMock()
+        session.__aenter__ = AsyncMock(return_value=MagicMock())
+        session.__aexit__ = AsyncMock(return_value=False)
+        service = MagicMock()
+        service._match_app_category = AsyncMock(return_value=5)
+        service.app_usage_service.batch_record_hourly_app_usage = AsyncMock(return_value=1)
+        with patch("backend.app.services.usage_aggregation.AsyncSessionLocal", return_value=session), \
+             patch("backend.app.services.usage_aggregation.UsageAnalysisService", return_value=service):
+            await aggregator.flush()
+        
+        records = service.app_usage_service.batch_record_hourly_app_usage.call_args.args[0]
+        assert records == [{
+            "app_name": "Code", "category_id": 5, "usage_date": BEIJING_HOUR.date(),
+            "hour": 9, "duration_minutes": 1.5, "switch_count": 1, "client_id": "c1",
+        }]
+        assert aggregator.rows_written == 1
+
+    @pytest.mark.asyncio
+    async def test_repair_takes_over_past_hours(self):
+        """测试修复任务接管之前的小时后，刷新与替换之间摄取的事件不会再被累加到这些小时"""
+        aggregator = IncrementalUsageAggregator()
+        aggregator.accumulator.add_events("c1", [(ms(0), "Code"), (ms(90), "Chrome")])
+        
+        session = MagicMock()
+        session.__aenter__ = AsyncMock(return_value=MagicMock())
+        session.__aexit__ = AsyncMock(return_value=False)
+        service = MagicMock()
+        service._match_app_category = AsyncMock(return_value=5)
+        service.app_usage_service.batch_record_hourly_app_usage = AsyncMock(return_value=1)
+        
+        async def recalculate(hours_back, use_watermark, until):
+            # 修复任务读取ES并替换之前，又有报告写入
+            report = SimpleNamespace(clientId="c1", data=SimpleNamespace(uiMonitoring=[
+                SimpleNamespace(timestamp=BASE + timedelta(seconds=100), app="Code"),
+                SimpleNamespace(timestamp=BASE + timedelta(seconds=200), app="Chrome"),
+            ]))
+            aggregator.observe([report])
+            assert until == datetime(2025, 3, 3, 2)
+        
+        now = MagicMock()
+        now.utcnow.return_value = BASE + timedelta(minutes=30)
+        with patch("backend.app.services.usage_aggregation.AsyncSessionLocal", return_value=session), \
+             patch("backend.app.services.usage_aggregation.UsageAnalysisService", return_value=service), \
+             patch("backend.app.services.scheduled_tasks.usage_aggregator", aggregator), \
+             patch("backend.app.services.scheduled_tasks.datetime", now), \
+             patch("backend.app.services.scheduled_tasks.recalculate_hourly_app_usage_statistics",
+                   AsyncMock(side_effect=recalculate)), \
+             patch.object(settings, "USAGE_INGEST_AGGREGATION_ENABLED", True):
+            await repair_hourly_app_usage_statistics(2)
+            first = service.app_usage_service.batch_record_hourly_app_usage.call_args.args[0]
+            await aggregator.flush()
+        
+        # 接管前累加的增量照常写入，之后只写入当前小时
+        assert [record["hour"] for record in first] == [9]
+        records = service.app_usage_service.batch_record_hourly_app_usage.call_args.args[0]
+        assert [(record["hour"], record["app_name"]) for record in records] == [(10, "Code")]
+        assert aggregator.deltas_dropped == 2
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
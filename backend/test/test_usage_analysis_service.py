@@ -0,0 +1,159 @@
+import asyncio
+import pytest
+import os
+import sys
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch, MagicMock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# 导入应用相关模块
+from backend.app.core.config import settings
+from backend.app.services.usage_analysis_service import UsageAnalysisService
+
+def to_ms(value: datetime) -> int:
+    """不带时区的UTC时间转毫秒时间戳"""
+    return int((value - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+class TestUsageAnalysisService:
+    """UsageAnalysisService类的测试"""
+    
+    @pytest.mark.asyncio
+    async def test_recalculate_skips_clients_without_new_events(self):
+        """测试按水位重算：没有新事件的客户端跳过，有新事件的客户端从水位所在小时开始重算"""
+        service = UsageAnalysisService(MagicMock(), MagicMock())
+        watermark_time = datetime(2025, 3, 3, 9, 42, 10)
+        idle_mark = (to_ms(watermark_time), 7)
+        busy_mark = (to_ms(watermark_time), 3)
+        
+        service._load_watermarks = AsyncMock(return_value={"idle": idle_mark, "busy": busy_mark})
+        service._get_client_latest_events = AsyncMock(return_value={
+            "idle": idle_mark,
+            "busy": (to_ms(watermark_time), 4),  # 时间戳相同，monitoring_id更大
+            "new": (to_ms(watermark_time), 1),
+        })
+        service._process_client = AsyncMock(return_value=True)
+        
+        await service.recalculate_hourly_statistics(hours_back=1)
+        
+        processed = {call.args[1]: call.args[2] for call in service._process_client.call_args_list}
+        assert set(processed) == {"busy", "new"}
+        assert processed["busy"] == datetime(2025, 3, 3, 9)
+        assert service._process_client.call_args_list[0].args[4] == (to_ms(watermark_time), 4)
+    
+    @pytest.mark.asyncio
+    async def test_recalculate_without_watermark_processes_all_clients(self):
+        """测试修复模式下不读取水位，重算窗口内的所有客户端"""
+        service = UsageAnalysisService(MagicMock(), MagicMock())
+        service._load_watermarks = AsyncMock()
+        service._get_client_latest_events = AsyncMock(return_value={"a": (1, 1), "b": (2, 1)})
+        service._process_client = AsyncMock(return_value=True)
+        
+        await service.recalculate_hourly_statistics(hours_back=2, use_watermark=False)
+        
+        service._load_watermarks.assert_not_called()
+        assert service._process_client.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_recalculate_runs_clients_concurrently_and_isolates_errors(self):
+        """测试客户端并发重算受并发上限约束，单个客户端失败不影响其他客户端"""
+        service = UsageAnalysisService(MagicMock(), MagicMock())
+        service._get_client_latest_events = AsyncMock(return_value={f"c{i}": (i, 1) for i in range(6)})
+        
+        running = 0
+        peak = 0
+        done = []
+        
+        async def recalculate(unit, query_service, client_id, start_time, end_time, until=None):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            if client_id == "c2":
+                raise RuntimeError("es timeout")
+            done.append(client_id)
+        
+        session = MagicMock()
+        session.__aenter__ = AsyncMock(return_value=MagicMock())
+        session.__aexit__ = AsyncMock(return_value=False)
+        with patch("backend.app.services.usage_analysis_service.AsyncSessionLocal", return_value=session), \
+             patch.object(UsageAnalysisService, "_recalculate_client", side_effect=recalculate, autospec=True), \
+             patch.object(UsageAnalysisService, "_save_watermark", AsyncMock()), \
+             patch("backend.app.services.usage_analysis_service.settings.USAGE_RECALC_CONCURRENCY", 3):
+            await service.recalculate_hourly_statistics(hours_back=2, use_watermark=False)
+        
+        assert peak == 3
+        assert sorted(done) == ["c0", "c1", "c3", "c4", "c5"]
+
+    @pytest.mark.asyncio
+    async def test_recalculate_client_streams_events_into_hourly_records(self):
+        """测试按页读取的事件按相邻时间差计入前一个应用，按小时边界切分，锁屏不计时"""
+        service = UsageAnalysisService(MagicMock(), MagicMock())
+        service._match_app_category = AsyncMock(return_value=1)
+        service.app_usage_service.replace_hourly_app_usage = AsyncMock(return_value=3)
+        
+        pages = [
+            ([to_ms(datetime(2025, 3, 3, 1, 58)), to_ms(datetime(2025, 3, 3, 2, 1))], ["Code", "loginwindow"]),
+            ([to_ms(datetime(2025, 3, 3, 2, 30)), to_ms(datetime(2025, 3, 3, 2, 31, 30))], ["Chrome", "Code"]),
+        ]
+        
+        async def iter_columns(**kwargs):
+            for page in pages:
+                yield page
+        
+        query_service = MagicMock()
+        query_service.iter_ui_monitoring_columns = iter_columns
+        query_service.get_ui_monitoring_event_before = AsyncMock(return_value=None)
+        
+        await service._recalculate_client(
+            query_service, "client", datetime(2025, 3, 3, 1), datetime(2025, 3, 3, 3)
+        )
+        
+        client_id, start_time, end_time, records = service.app_usage_service.replace_hourly_app_usage.call_args.args
+        assert (client_id, start_time, end_time) == ("client", datetime(2025, 3, 3, 9), datetime(2025, 3, 3, 11))
+        assert [(r["app_name"], r["hour"], r["duration_minutes"], r["switch_count"]) for r in records] == [
+            ("Code", 9, 2.0, 1), ("Code", 10, 1.0, 0), ("Chrome", 10, 1.5, 1)
+        ]
+        
+        # 修复任务只替换接管的整点之前的小时
+        await service._recalculate_client(
+            query_service, "client", datetime(2025, 3, 3, 1), datetime(2025, 3, 3, 3), until=datetime(2025, 3, 3, 2)
+        )
+        _, _, end_time, records = service.app_usage_service.replace_hourly_app_usage.call_args.args
+        assert end_time == datetime(2025, 3, 3, 9, 59, 59)
+        assert [(r["app_name"], r["hour"]) for r in records] == [("Code", 9)]
+
+    @pytest.mark.asyncio
+    async def test_recalculate_client_seeds_interval_from_previous_hour(self):
+        """测试窗口开始前的最后一个事件作为起点，延续到开始小时的区间计入该小时"""
+        service = UsageAnalysisService(MagicMock(), MagicMock())
+        service._match_app_category = AsyncMock(return_value=1)
+        service.app_usage_service.replace_hourly_app_usage = AsyncMock(return_value=2)
+        
+        async def iter_columns(**kwargs):
+            yield [to_ms(datetime(2025, 3, 3, 1, 10)), to_ms(datetime(2025, 3, 3, 1, 20))], ["Chrome", "Code"]
+        
+        query_service = MagicMock()
+        query_service.iter_ui_monitoring_columns = iter_columns
+        query_service.get_ui_monitoring_event_before = AsyncMock(
+            return_value=(to_ms(datetime(2025, 3, 3, 0, 50)), "Code")
+        )
+        
+        await service._recalculate_client(
+            query_service, "client", datetime(2025, 3, 3, 1), datetime(2025, 3, 3, 2)
+        )
+        
+        client_id, before, not_before = query_service.get_ui_monitoring_event_before.call_args.args
+        assert (client_id, before) == ("client", datetime(2025, 3, 3, 1))
+        assert not_before == datetime(2025, 3, 3, 1) - timedelta(seconds=settings.USAGE_IDLE_GAP_SECONDS)
+        _, start_time, _, records = service.app_usage_service.replace_hourly_app_usage.call_args.args
+        assert start_time == datetime(2025, 3, 3, 9)
+        # 0:50 - 1:00 的部分不在替换范围内，1:00 - 1:10 计入 Code
+        assert [(r["app_name"], r["hour"], r["duration_minutes"], r["switch_count"]) for r in records] == [
+            ("Code", 9, 10.0, 0), ("Chrome", 9, 10.0, 1)
+        ]
+
+if __name__ == "__main__":
+    pytest.main(["-xvs", __file__])
@@ -0,0 +1,11 @@
+-- 客户端活动表：摄取服务按批更新每个客户端的首次/最近上报时间
+CREATE TABLE IF NOT EXISTS client_activity (
+    client_id VARCHAR(50) NOT NULL PRIMARY KEY,
+    first_seen DATETIME NOT NULL,
+    last_seen DATETIME NOT NULL,
+    last_app VARCHAR(100) NULL,
+    last_report_size INT NULL,
+    report_count BIGINT NOT NULL DEFAULT 0,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX ix_client_activity_last_seen (last_seen)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
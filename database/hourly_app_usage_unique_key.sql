@@ -0,0 +1,25 @@
+-- 小时应用使用统计的自然键：(user_id, timestamp, app_name)
+-- 批量写入使用 INSERT ... ON DUPLICATE KEY UPDATE，依赖该唯一键
+
+-- 合并已存在的重复记录：使用时间和切换次数累加到ID最小的一行
+UPDATE hourly_app_usage h
+JOIN (
+    SELECT MIN(id) AS id,
+           SUM(total_time_seconds) AS total_time_seconds,
+           SUM(switch_count) AS switch_count
+    FROM hourly_app_usage
+    GROUP BY user_id, timestamp, app_name
+    HAVING COUNT(*) > 1
+) merged ON h.id = merged.id
+SET h.total_time_seconds = merged.total_time_seconds,
+    h.switch_count = merged.switch_count;
+
+DELETE h FROM hourly_app_usage h
+JOIN hourly_app_usage kept
+  ON h.user_id = kept.user_id
+ AND h.timestamp = kept.timestamp
+ AND h.app_name = kept.app_name
+ AND h.id > kept.id;
+
+ALTER TABLE hourly_app_usage
+    ADD UNIQUE KEY uq_hourly_usage_user_time_app (user_id, timestamp, app_name);
@@ -0,0 +1,7 @@
+-- 小时应用使用统计重算水位表
+CREATE TABLE IF NOT EXISTS usage_watermarks (
+    client_id VARCHAR(50) NOT NULL PRIMARY KEY,
+    last_event_ms BIGINT NOT NULL,
+    last_monitoring_id BIGINT NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;